@@ -16,7 +16,7 @@ from PyQt6.QtGui import QFont, QScreen, QGuiApplication, QCursor, QPainter, QCol
 if TYPE_CHECKING:
     from channelmgr import ChannelManager
     from cloudRes import CloudRes
-    from mitm_proxy import MitmProxyManager
+    from mitm_proxy import LocalDnsServer, MitmProxyManager
     from uimgr import UIManager
     from PyQt6.QtWidgets import QApplication
 
@@ -26,6 +26,7 @@ cloud_res: CloudRes | None = None
 app: QApplication | None = None
 ui_mgr: UIManager | None = None
 proxy_mgr: MitmProxyManager | None = None
+dns_server: LocalDnsServer | None = None
 
 # 用于跨线程调度的辅助对象
 _main_thread_invoker = None
@@ -428,20 +428,16 @@ class BilibiliLogin:
         qrcode_base64: str = "",
         ticket: str = "",
     ):
-        """更新全局二维码缓存，供前端轮询展示。"""
-        from envmgr import genv
+        """更新全局二维码缓存，并唤醒前端的长轮询。"""
+        import qrcode_cache
 
-        cache = genv.get("BILIBILI_QRCODE_CACHE", {})
-        if not isinstance(cache, dict):
-            cache = {}
         cache_key = self._cache_game_id or "_default"
-        cache[cache_key] = {
+        qrcode_cache.update("BILIBILI_QRCODE_CACHE", cache_key, {
             "status": status,
             "qrcode_base64": qrcode_base64,
             "ticket": ticket,
             "timestamp": int(time.time()),
-        }
-        genv.set("BILIBILI_QRCODE_CACHE", cache)
+        })
 
     # ── 二维码登录（阻塞） ────────────────────────────────────
 
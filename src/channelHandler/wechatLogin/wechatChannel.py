@@ -4,7 +4,7 @@ import requests
 
 from logutil import setup_logger
 from ssl_utils import should_verify_ssl
-from envmgr import genv
+import qrcode_cache
 
 #1106682786 is offerid
 def sig_helper(magicValue="5C2F##3[6$^(68#%#D3E96;]35q#FB46",ts="1"):
@@ -24,16 +24,12 @@ class WechatLogin:
         self.game_id = game_id
 
     def _update_qrcode_cache(self, status, qrcode_base64="", uuid=""):
-        cache = genv.get("WECHAT_QRCODE_CACHE", {})
-        if not isinstance(cache, dict):
-            cache = {}
-        cache[self.game_id if self.game_id else "_default"] = {
+        qrcode_cache.update("WECHAT_QRCODE_CACHE", self.game_id if self.game_id else "_default", {
             "status": status,
             "qrcode_base64": qrcode_base64,
             "uuid": uuid,
             "timestamp": int(time.time()),
-        }
-        genv.set("WECHAT_QRCODE_CACHE", cache)
+        })
 
     def webLogin(self):
         self._update_qrcode_cache("loading")
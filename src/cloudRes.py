@@ -126,8 +126,8 @@ class CloudRes:
         local_last_modified = self.local_data.get('lastModified', 0)
         if cloud_last_modified > local_last_modified:
             self.local_data = cloud_data
-            from secure_write import write_json_restricted
-            write_json_restricted(self.cache_file, cloud_data)
+            from secure_write import CACHE, write_json_restricted
+            write_json_restricted(self.cache_file, cloud_data, CACHE)
             logger.info("云端配置有更新，应用成功")
         else:
             logger.info("本地配置已是最新")
@@ -181,6 +181,9 @@ class CloudRes:
     def get_version(self):
         return self.local_data.get('version', genv.get('VERSION'))
 
+    def get_last_modified(self):
+        return self.local_data.get('lastModified', 0)
+
     def get_netease_qrcode_login_game_list(self):
         return self.local_data.get('netease_qrcode_login_game_list', [])
 
@@ -278,4 +281,15 @@ class CloudRes:
         domains = data.get("no_proxy_domains") or []
         if not isinstance(domains, list):
             return []
-        return domains
\ No newline at end of file
+        return domains
+
+    def get_dns_block_domains(self):
+        """返回云端下发的兼容模式 DNS 屏蔽域名列表（本地 DNS 直接返回 NXDOMAIN）。
+
+        格式同 no_proxy_domains，按后缀匹配。
+        """
+        data = self.local_data or {}
+        domains = data.get("dns_block_domains") or []
+        if not isinstance(domains, list):
+            return []
+        return domains
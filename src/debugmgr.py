@@ -487,6 +487,20 @@ class DebugMgr:
         return rules  # 返回所有规则
     
     
+    @staticmethod
+    def get_proxy_metrics():
+        """获取代理 flow 耗时统计"""
+        try:
+            import app_state
+            metrics = {}
+            if app_state.proxy_mgr is not None:
+                metrics = app_state.proxy_mgr.get_metrics()
+            if app_state.dns_server is not None:
+                metrics['dns'] = app_state.dns_server.get_stats()
+            return metrics
+        except Exception as e:
+            return {'error': str(e)}
+
     @staticmethod
     def export_debug_info_json():
         if not DebugMgr.is_windows():
@@ -501,7 +515,8 @@ class DebugMgr:
                 'processes': DebugMgr.get_process_list(),
                 'installed_apps': DebugMgr.get_installed_apps(),
                 'proxy_info': DebugMgr.get_proxy_info(),
-                'firewall_rules': DebugMgr.get_firewall_rules()
+                'firewall_rules': DebugMgr.get_firewall_rules(),
+                'proxy_metrics': DebugMgr.get_proxy_metrics()
             }
             return debug_data
         except Exception as e:
@@ -1,7 +1,244 @@
 # coding=UTF-8
+import atexit
 import json
 import os
 import threading
+import time
+
+
+# 可选的追加式日志：开启后每次落盘只向 config.json.journal 追加改动的键，
+# 日志超过 JOURNAL_COMPACT_BYTES 时才合并回 config.json。
+# 加载时总会重放残留的日志，因此关闭该选项或旧版本文件都能正常读取；
+# 压缩中途留下的 .compacting 仅在比 config.json 新时重放。
+JOURNAL_SETTING_KEY = "config_journal_enabled"
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_COMPACTING_SUFFIX = ".journal.compacting"
+JOURNAL_COMPACT_BYTES = 64 * 1024
+# Windows 上日志被其他进程打开时无法改名，短暂重试后放弃本次压缩
+JOURNAL_RENAME_RETRIES = 3
+JOURNAL_RENAME_RETRY_DELAY = 0.05
+
+
+def _stat_one(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _stat_config(path):
+    return (
+        _stat_one(path),
+        _stat_one(path + JOURNAL_SUFFIX),
+        _stat_one(path + JOURNAL_COMPACTING_SUFFIX),
+    )
+
+
+def _replay_journal(path, data):
+    """按顺序应用日志中的 {"k": key, "v": value} 记录，跳过崩溃留下的残缺行。"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and "k" in record:
+                    data[record["k"]] = record.get("v")
+    except OSError:
+        pass
+
+
+def _read_config(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        data = data if isinstance(data, dict) else {}
+    except Exception:
+        data = {}
+    # 压缩在写入快照后才删除 .compacting；快照（或外部写入）更新时其内容已包含在内
+    compacting = _stat_one(path + JOURNAL_COMPACTING_SUFFIX)
+    snapshot = _stat_one(path)
+    if compacting is not None and (snapshot is None or compacting[0] >= snapshot[0]):
+        _replay_journal(path + JOURNAL_COMPACTING_SUFFIX, data)
+    _replay_journal(path + JOURNAL_SUFFIX, data)
+    return data
+
+
+def _append_journal(journal_path, pending):
+    from secure_write import append_file_restricted
+
+    lines = "".join(
+        json.dumps({"k": k, "v": v}, ensure_ascii=False) + "\n"
+        for k, v in pending.items()
+    )
+    # 上次写入若中途崩溃，末尾可能没有换行，先补齐以免新记录与残行粘连
+    try:
+        with open(journal_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                lines = "\n" + lines
+    except OSError:
+        pass
+    append_file_restricted(journal_path, lines.encode("utf-8"))
+
+
+def _move_journal(journal_path, compacting_path):
+    """把日志改名为 .compacting，返回是否需要（且可以）继续压缩。"""
+    for attempt in range(JOURNAL_RENAME_RETRIES):
+        try:
+            os.replace(journal_path, compacting_path)
+            return True
+        except FileNotFoundError:
+            return True  # 没有日志，直接写快照
+        except OSError:
+            # 其他进程正打开着日志（Windows）
+            if attempt + 1 < JOURNAL_RENAME_RETRIES:
+                time.sleep(JOURNAL_RENAME_RETRY_DELAY)
+    return False
+
+
+def _write_config(path, pending, journal=False):
+    """落盘 pending 中的键。
+
+    日志模式下只追加记录，返回 None；否则（或日志需要压缩时）把
+    快照与日志合并后整体原子写入，删除日志，并返回写入的完整数据。
+    日志暂时无法改名时放弃压缩，改为追加日志并返回 None。
+    """
+    from secure_write import path_lock, write_json_restricted
+
+    journal_path = path + JOURNAL_SUFFIX
+    if journal:
+        _append_journal(journal_path, pending)
+        if os.path.getsize(journal_path) < JOURNAL_COMPACT_BYTES:
+            return None
+
+    # 压缩：先把日志改名，其他进程此后的追加会写入新日志而不会丢失；
+    # 持有日志的路径锁，本进程的追加不会落在改名与删除之间
+    compacting_path = path + JOURNAL_COMPACTING_SUFFIX
+    with path_lock(journal_path):
+        if not _move_journal(journal_path, compacting_path):
+            # 残留日志仍会在加载时覆盖快照，pending 必须同样写入日志
+            if not journal:
+                _append_journal(journal_path, pending)
+            return None
+        data = _read_config(path)
+        data.update(pending)
+        write_json_restricted(path, data)
+        try:
+            os.remove(compacting_path)
+        except OSError:
+            pass
+    return data
+
+
+class _ConfigStore:
+    """config.json 的内存副本：读写都只操作内存中的解析结果。
+
+    文件的 mtime/size 最多每 ``REVALIDATE_INTERVAL`` 秒检查一次，变化时
+    （如其他进程写入）重新解析；两次检查之间的查询只是一次字典查找，
+    不存在的键同样如此（快照本身即是负缓存）。
+    写入标记为 dirty，由后台定时器在 ``FLUSH_DELAY`` 秒后合并落盘；
+    落盘时重新读取文件再覆盖 dirty 键，以免冲掉其他进程写入的键。
+    配置项 ``config_journal_enabled`` 为真时改为向日志追加（见 _write_config）。
+    进程退出前需调用 :meth:`flush`（已注册 atexit，``os._exit`` 前需手动调用）。
+    """
+
+    FLUSH_DELAY = 0.5
+    REVALIDATE_INTERVAL = 1.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._path = None
+        self._stat = None
+        self._checked_at = 0.0
+        self._data = {}
+        self._dirty = set()
+        self._timer = None
+
+    def _revalidate_locked(self, force=False):
+        now = time.monotonic()
+        if not force and self._path is not None and now - self._checked_at < self.REVALIDATE_INTERVAL:
+            return
+        self._checked_at = now
+        # _cachePath 为相对路径，启动时会 chdir 到工作目录，路径变化时重新加载
+        path = os.path.abspath(_cachePath)
+        if path != self._path:
+            if self._dirty and self._path:
+                pending = {k: self._data[k] for k in self._dirty}
+                self._dirty = set()
+                threading.Thread(
+                    target=_write_config,
+                    args=(self._path, pending, self._journal_enabled_locked()),
+                    daemon=True,
+                ).start()
+            self._path = path
+            self._stat = _stat_config(path)
+            self._data = _read_config(path)
+            return
+        stat = _stat_config(path)
+        if stat != self._stat:
+            self._stat = stat
+            data = _read_config(path)
+            for k in self._dirty:
+                data[k] = self._data[k]
+            self._data = data
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._revalidate_locked()
+            return self._data.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self._revalidate_locked()
+            self._data[key] = value
+            self._dirty.add(key)
+            if self._timer is None:
+                self._timer = threading.Timer(self.FLUSH_DELAY, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _journal_enabled_locked(self):
+        return bool(self._data.get(JOURNAL_SETTING_KEY, False))
+
+    def flush(self) -> bool:
+        """将 dirty 键写入磁盘，返回是否成功；失败的键保留待下次重试。"""
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return True
+                path = self._path
+                pending = {k: self._data[k] for k in self._dirty}
+                self._dirty = set()
+                journal = self._journal_enabled_locked()
+            try:
+                data = _write_config(path, pending, journal)
+            except Exception:
+                import traceback
+                traceback.print_exc()
+                print("Failed to cache data", list(pending))
+                with self._lock:
+                    if self._path == path:
+                        self._dirty.update(pending)
+                return False
+            with self._lock:
+                if self._path == path:
+                    # 合并其他进程写入的键；本进程在落盘期间新写入的键以内存为准
+                    for k, v in (data or {}).items():
+                        if k not in self._dirty:
+                            self._data[k] = v
+                    self._stat = _stat_config(path)
+            return True
+
+
+_store = _ConfigStore()
+atexit.register(_store.flush)
 
 
 class genv:
@@ -15,46 +252,17 @@ class genv:
         #if this object is json storeable
         if isinstance(value, (str, int, float, bool, list, dict)) and isinstance(key, str):
             if cached:
-                with genv._cache_lock:
-                    try:
-                        if os.path.exists(_cachePath):
-                            with open(_cachePath, 'r', encoding='utf-8') as f:
-                                data=json.load(f)
-                        else:
-                            data={}
-                        data[key]=value
-                        from secure_write import write_json_restricted
-                        write_json_restricted(_cachePath, data)
-                    except Exception as e:
-                        import traceback
-                        traceback.print_exc()
-                        print("Failed to cache data",key,value)
-                        pass
+                _store.set(key, value)
 
     def get(key, default=None):
         if key in _list:
             return _list[key]
-        else:
-            try:
-                with open(_cachePath, 'r', encoding='utf-8') as f:
-                    data=json.load(f)
-                    if key in data:
-                        return data[key]
-                    else:
-                        return default
-            except:
-                return default
+        return _store.get(key, default)
+
+    def flush():
+        """立即将待写入的配置落盘（退出、重启或校验写入前调用）。"""
+        return _store.flush()
 
     def get_from_file(key,value):
-        try:
-            if os.path.exists(_cachePath):
-                with open(_cachePath, 'r', encoding='utf-8') as f:
-                    data=json.load(f)
-                    if key in data:
-                        return data[key]
-                    else:
-                        return value
-            else:
-                return value
-        except:
-            return value
\ No newline at end of file
+        # 直接读取磁盘（快照 + 日志），用于校验写入是否真正落盘
+        return _read_config(_cachePath).get(key, value)
@@ -61,6 +61,7 @@ def probe_cache_write_once() -> bool:
     """
     try:
         genv.set("hotfix_probed", True, True)
+        genv.flush()
         return bool(genv.get_from_file("hotfix_probed", False))
     except Exception:
         return False
@@ -321,6 +322,9 @@ def _restart_self(reason: str = ""):
         except Exception:
             pass
 
+    # 新进程启动时会读取 config.json，需先落盘
+    genv.flush()
+
     if getattr(sys, 'frozen', False):
         args = [sys.executable] + sys.argv[1:]
     else:
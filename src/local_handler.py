@@ -27,10 +27,101 @@ from urllib.parse import parse_qs, urlparse
 from envmgr import genv
 import app_state
 import const
+import qrcode_cache
 from login_stack_mgr import LoginStackManager
 from cloudSync import CloudSyncManager
 from cloudRes import CloudRes
 from channelHandler.channelUtils import getShortGameId
+from logutil import setup_logger
+
+logger = setup_logger()
+
+# 长轮询单次等待上限（秒），需小于 mitm addon 中对应路由的超时
+LONG_POLL_MAX_WAIT = 25.0
+
+
+class _TaskRegistry:
+    """异步任务（切换渠道、导入等）的状态表。
+
+    任务完成时通过条件变量唤醒长轮询的等待方。已完成但无人领取的任务
+    超过 ``done_ttl``，或已完成任务数超过 ``max_tasks`` 时淘汰最早完成的。
+    未完成的任务（如耗时的下载、等待中的文件对话框）保留到 :meth:`finish`，
+    仅在超过 ``pending_ttl`` 或数量超过 ``max_pending`` 时丢弃并记录警告，
+    两个上限都远大于正常使用，只防止卡死的任务无限累积。
+    """
+
+    def __init__(self, *, max_tasks: int = 64, done_ttl: float = 300.0,
+                 max_pending: int = 256, pending_ttl: float = 6 * 3600.0):
+        self.max_tasks = max_tasks
+        self.done_ttl = done_ttl
+        self.max_pending = max_pending
+        self.pending_ttl = pending_ttl
+        self._cond = threading.Condition()
+        self._tasks = {}  # {task_id: (state_dict, expires_at)}
+
+    def _evict_locked(self):
+        now = time.monotonic()
+        # create() / finish() 都在末尾插入，因此两类任务各自按时间顺序排列
+        done, pending = [], []
+        for task_id, (state, _) in self._tasks.items():
+            (done if state["status"] == "done" else pending).append(task_id)
+
+        excess = len(done) - self.max_tasks
+        for i, task_id in enumerate(done):
+            if i < excess or self._tasks[task_id][1] <= now:
+                del self._tasks[task_id]
+
+        expired = [t for t in pending if self._tasks[t][1] <= now]
+        alive = [t for t in pending if self._tasks[t][1] > now]
+        dropped = [(t, "超时") for t in expired]
+        dropped += [(t, "数量超过上限") for t in alive[:max(0, len(alive) - self.max_pending)]]
+        for task_id, reason in dropped:
+            del self._tasks[task_id]
+            logger.warning(f"丢弃未完成的异步任务 {task_id}（{reason}），其结果将无法领取")
+
+    def create(self) -> str:
+        import uuid as uuid_mod
+        task_id = str(uuid_mod.uuid4())
+        with self._cond:
+            self._tasks[task_id] = ({"status": "pending"}, time.monotonic() + self.pending_ttl)
+            self._evict_locked()
+        return task_id
+
+    def finish(self, task_id: str, result: dict):
+        """标记任务完成并唤醒等待方。"""
+        with self._cond:
+            if task_id not in self._tasks:
+                return
+            state = {"status": "done"}
+            state.update(result)
+            del self._tasks[task_id]
+            self._tasks[task_id] = (state, time.monotonic() + self.done_ttl)
+            self._evict_locked()
+            self._cond.notify_all()
+
+    def take(self, task_id: str, wait: float = 0.0):
+        """返回任务状态的副本，已完成的任务随之移除；未知任务返回 None。
+
+        ``wait`` > 0 时最多阻塞该秒数等待任务完成（长轮询）。
+        """
+        deadline = time.monotonic() + min(max(wait, 0.0), LONG_POLL_MAX_WAIT)
+        with self._cond:
+            while True:
+                entry = self._tasks.get(task_id)
+                if entry is None:
+                    return None
+                state = entry[0]
+                if state["status"] == "done":
+                    del self._tasks[task_id]
+                    return dict(state)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return dict(state)
+                self._cond.wait(remaining)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._tasks)
 
 
 class LocalRequestHandler:
@@ -40,13 +131,16 @@ class LocalRequestHandler:
     and the QtWebEngine URL scheme handler (for the standalone Qt window).
 
     Each call to ``handle()`` is stateless w.r.t. the handler itself;
-    all persistent state lives in ``genv`` / managers.
+    all persistent state lives in ``genv`` / managers, so a single shared
+    instance (see :meth:`get_instance`) serves all callers concurrently.
     """
 
+    _instance = None
+    _instance_lock = threading.Lock()
     _cloud_sync_mgr = None
     _cloud_sync_lock = threading.Lock()
     _auto_push_generation = {"value": 0}
-    _pending_imports = {}  # {task_id: {"status": "pending"|"done", "success": bool}}
+    _pending_imports = _TaskRegistry()  # 导入/选择路径/安装启动器等异步任务
 
     def __init__(self, *, game_helper, logger):
         self.game_helper = game_helper
@@ -58,6 +152,27 @@ class LocalRequestHandler:
                 LocalRequestHandler._cloud_sync_mgr = CloudSyncManager(logger)
         self.cloud_sync_mgr = LocalRequestHandler._cloud_sync_mgr
 
+    @classmethod
+    def create_instance(cls, *, game_helper, logger):
+        """Create the process-wide handler; called once at startup.
+
+        The handler's logger and game helper are fixed here rather than
+        taken from whichever caller happens to dispatch first.
+        """
+        with cls._instance_lock:
+            if cls._instance is not None:
+                raise RuntimeError("LocalRequestHandler 已创建")
+            cls._instance = cls(game_helper=game_helper, logger=logger)
+            return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        """Return the process-wide handler created by :meth:`create_instance`."""
+        instance = cls._instance
+        if instance is None:
+            raise RuntimeError("LocalRequestHandler 尚未创建，需先调用 create_instance()")
+        return instance
+
     # ------------------------------------------------------------------
     # Public entry point
     # ------------------------------------------------------------------
@@ -104,57 +219,66 @@ class LocalRequestHandler:
     # Router
     # ------------------------------------------------------------------
 
+    # path -> handler method name; built once at class level and bound per call
+    _ROUTES = {
+        "/_idv-login/manualChannels": "_manual_channels",
+        "/_idv-login/list": "_list_channels",
+        "/_idv-login/qrcode": "_channel_qrcode",
+        "/_idv-login/cancel-qr": "_cancel_qr",
+        "/_idv-login/switch": "_switch_channel",
+        "/_idv-login/switch-status": "_switch_status",
+        "/_idv-login/del": "_del_channel",
+        "/_idv-login/rename": "_rename_channel",
+        "/_idv-login/import": "_import_channel",
+        "/_idv-login/import-status": "_import_status",
+        "/_idv-login/setDefault": "_set_default",
+        "/_idv-login/clearDefault": "_clear_default",
+        "/_idv-login/get-auto-close-state": "_get_auto_close_state",
+        "/_idv-login/switch-auto-close-state": "_switch_auto_close_state",
+        "/_idv-login/get-game-auto-start": "_get_game_auto_start",
+        "/_idv-login/set-game-auto-start": "_set_game_auto_start",
+        "/_idv-login/start-game": "_start_game",
+        "/_idv-login/list-games": "_list_games",
+        "/_idv-login/launcher-status": "_launcher_status",
+        "/_idv-login/launcher-install": "_launcher_install",
+        "/_idv-login/launcher-update": "_launcher_update",
+        "/_idv-login/launcher-update-info": "_launcher_update_info",
+        "/_idv-login/launcher-import-fever": "_launcher_import_fever",
+        "/_idv-login/fever-games": "_list_fever_games",
+        "/_idv-login/defaultChannel": "_get_default_channel",
+        "/_idv-login/get-login-delay": "_get_login_delay",
+        "/_idv-login/set-login-delay": "_set_login_delay",
+        "/_idv-login/cloud-sync/policy": "_cloud_sync_policy",
+        "/_idv-login/cloud-sync/generate-master-key": "_cloud_sync_generate_key",
+        "/_idv-login/cloud-sync/settings": "_cloud_sync_settings",
+        "/_idv-login/cloud-sync/accounts": "_cloud_sync_accounts",
+        "/_idv-login/cloud-sync/probe": "_cloud_sync_probe",
+        "/_idv-login/cloud-sync/run": "_cloud_sync_run",
+        "/_idv-login/cloud-sync/delete": "_cloud_sync_delete",
+        "/_idv-login/cloud-sync/access-logs": "_cloud_sync_access_logs",
+        "/_idv-login/index": "_serve_index",
+        "/_idv-login/export-logs": "_export_logs",
+        "/_idv-login/open-external-url": "_open_external_url",
+        "/_idv-login/proxy-mode": "_get_proxy_mode",
+        "/_idv-login/set-proxy-mode": "_set_proxy_mode",
+        "/_idv-login/create-game-shortcut": "_create_game_shortcut",
+        "/_idv-login/scan-record-setting": "_scan_record_setting",
+        "/_idv-login/native-save-setting": "_native_save_setting",
+        "/_idv-login/metrics": "_get_metrics",
+    }
+
+    # 支持 ``wait`` 参数长轮询的路由
+    _LONG_POLL_ROUTES = frozenset({
+        "/_idv-login/qrcode",
+        "/_idv-login/switch-status",
+        "/_idv-login/import-status",
+    })
+
     def _route(self, path: str, method: str, args: dict,
                json_body: dict = None) -> Tuple[int, dict, bytes]:
-        route_map = {
-            "/_idv-login/manualChannels": self._manual_channels,
-            "/_idv-login/list": self._list_channels,
-            "/_idv-login/qrcode": self._channel_qrcode,
-            "/_idv-login/cancel-qr": self._cancel_qr,
-            "/_idv-login/switch": self._switch_channel,
-            "/_idv-login/switch-status": self._switch_status,
-            "/_idv-login/del": self._del_channel,
-            "/_idv-login/rename": self._rename_channel,
-            "/_idv-login/import": self._import_channel,
-            "/_idv-login/import-status": self._import_status,
-            "/_idv-login/setDefault": self._set_default,
-            "/_idv-login/clearDefault": self._clear_default,
-            "/_idv-login/get-auto-close-state": self._get_auto_close_state,
-            "/_idv-login/switch-auto-close-state": self._switch_auto_close_state,
-            "/_idv-login/get-game-auto-start": self._get_game_auto_start,
-            "/_idv-login/set-game-auto-start": self._set_game_auto_start,
-            "/_idv-login/start-game": self._start_game,
-            "/_idv-login/list-games": self._list_games,
-            "/_idv-login/launcher-status": self._launcher_status,
-            "/_idv-login/launcher-install": self._launcher_install,
-            "/_idv-login/launcher-update": self._launcher_update,
-            "/_idv-login/launcher-update-info": self._launcher_update_info,
-            "/_idv-login/launcher-import-fever": self._launcher_import_fever,
-            "/_idv-login/fever-games": self._list_fever_games,
-            "/_idv-login/defaultChannel": self._get_default_channel,
-            "/_idv-login/get-login-delay": self._get_login_delay,
-            "/_idv-login/set-login-delay": self._set_login_delay,
-            "/_idv-login/cloud-sync/policy": self._cloud_sync_policy,
-            "/_idv-login/cloud-sync/generate-master-key": self._cloud_sync_generate_key,
-            "/_idv-login/cloud-sync/settings": self._cloud_sync_settings,
-            "/_idv-login/cloud-sync/accounts": self._cloud_sync_accounts,
-            "/_idv-login/cloud-sync/probe": self._cloud_sync_probe,
-            "/_idv-login/cloud-sync/run": self._cloud_sync_run,
-            "/_idv-login/cloud-sync/delete": self._cloud_sync_delete,
-            "/_idv-login/cloud-sync/access-logs": self._cloud_sync_access_logs,
-            "/_idv-login/index": self._serve_index,
-            "/_idv-login/export-logs": self._export_logs,
-            "/_idv-login/open-external-url": self._open_external_url,
-            "/_idv-login/proxy-mode": self._get_proxy_mode,
-            "/_idv-login/set-proxy-mode": self._set_proxy_mode,
-            "/_idv-login/create-game-shortcut": self._create_game_shortcut,
-            "/_idv-login/scan-record-setting": self._scan_record_setting,
-            "/_idv-login/native-save-setting": self._native_save_setting,
-
-        }
-
-        handler = route_map.get(path)
-        if handler:
+        name = self._ROUTES.get(path)
+        if name:
+            handler = getattr(self, name)
             try:
                 return handler(args, json_body, method)
             except Exception as e:
@@ -173,6 +297,19 @@ class LocalRequestHandler:
         headers = {"Content-Type": "application/json; charset=utf-8"}
         return status, headers, body
 
+    @staticmethod
+    def _long_poll_wait(args) -> float:
+        """解析长轮询参数 ``wait``（秒），缺省或非法时为 0（立即返回）。"""
+        try:
+            return max(0.0, min(float(args.get("wait", 0) or 0), LONG_POLL_MAX_WAIT))
+        except (TypeError, ValueError):
+            return 0.0
+
+    @staticmethod
+    def is_long_poll(path: str, args) -> bool:
+        """请求是否为可能阻塞的长轮询，调用方据此决定是否移出 UI/代理线程。"""
+        return path in LocalRequestHandler._LONG_POLL_ROUTES and bool(args.get("wait"))
+
     @staticmethod
     def _force_dialog_foreground(widget):
         """Use Win32 API to bring a dialog widget to the foreground."""
@@ -276,14 +413,16 @@ class LocalRequestHandler:
 
         threading.Thread(target=_push, daemon=True).start()
 
-    def _pick_qrcode_data(self, channel, game_id):
-        """从指定渠道的二维码缓存中获取数据。"""
-        cache_key = {
+    @staticmethod
+    def _qrcode_cache_key(channel):
+        return {
             "myapp": "WECHAT_QRCODE_CACHE",
             "bilibili_sdk": "BILIBILI_QRCODE_CACHE",
         }.get(channel, "WECHAT_QRCODE_CACHE")
 
-        cache = genv.get(cache_key, {})
+    def _pick_qrcode_data(self, channel, game_id):
+        """从指定渠道的二维码缓存中获取数据。"""
+        cache = genv.get(self._qrcode_cache_key(channel), {})
         if not isinstance(cache, dict) or not cache:
             return None
         if game_id and game_id in cache:
@@ -330,16 +469,33 @@ class LocalRequestHandler:
         return self._json_response(200, result)
 
     def _channel_qrcode(self, args, body, method):
-        """通用二维码状态接口，支持 myapp（微信）和 bilibili_sdk。"""
+        """通用二维码状态接口，支持 myapp（微信）和 bilibili_sdk。
+
+        携带 ``version``（上次响应中的版本号）与 ``wait`` 时为长轮询：
+        缓存未变化则最多等待 ``wait`` 秒后再返回。
+        """
         game_id = args.get("game_id", "")
         channel = args.get("channel", "myapp")
+        cache_key = self._qrcode_cache_key(channel)
+        wait = self._long_poll_wait(args)
+        try:
+            since = int(args.get("version", -1))
+        except (TypeError, ValueError):
+            since = -1
+        if wait:
+            version = qrcode_cache.wait_for_change(cache_key, since, wait)
+        else:
+            version = qrcode_cache.version(cache_key)
+
         data = self._pick_qrcode_data(channel, game_id)
         if not data:
             return self._json_response(200, {
                 "success": False, "status": "idle", "qrcode_base64": "",
+                "version": version,
             })
         return self._json_response(200, {
             "success": True,
+            "version": version,
             "status": data.get("status", "idle"),
             "qrcode_base64": data.get("qrcode_base64", ""),
             "uuid": data.get("uuid", ""),
@@ -358,7 +514,7 @@ class LocalRequestHandler:
             self.logger.exception("取消 QR 失败")
         return self._json_response(200, {"success": False})
 
-    _pending_switch = {}  # {task_id: {"status": "pending"|"done", "result": any}}
+    _pending_switch = _TaskRegistry()  # 异步切换渠道任务
 
     def _switch_channel(self, args, body, method):
         uuid = args.get("uuid", "")
@@ -377,15 +533,11 @@ class LocalRequestHandler:
 
         if app and app.property("_main_loop_running"):
             # 异步模式
-            import uuid as uuid_mod
-            task_id = str(uuid_mod.uuid4())
-            LocalRequestHandler._pending_switch[task_id] = {"status": "pending"}
+            task_id = LocalRequestHandler._pending_switch.create()
 
             def do_switch():
                 def on_done(result):
-                    LocalRequestHandler._pending_switch[task_id] = {
-                        "status": "done", "result": result
-                    }
+                    LocalRequestHandler._pending_switch.finish(task_id, {"result": result})
 
                 try:
                     app_state.channels_helper.simulate_scan(
@@ -393,9 +545,7 @@ class LocalRequestHandler:
                     )
                 except Exception:
                     self.logger.exception("异步切换渠道失败")
-                    LocalRequestHandler._pending_switch[task_id] = {
-                        "status": "done", "result": False
-                    }
+                    LocalRequestHandler._pending_switch.finish(task_id, {"result": False})
 
             app_state.run_on_main_thread(do_switch)
             return self._json_response(200, {"status": "pending", "task_id": task_id})
@@ -410,12 +560,9 @@ class LocalRequestHandler:
     def _switch_status(self, args, body, method):
         """检查异步切换渠道的状态"""
         task_id = args.get("task_id", "")
-        task = LocalRequestHandler._pending_switch.get(task_id)
-        if task is None:
+        result = LocalRequestHandler._pending_switch.take(task_id, self._long_poll_wait(args))
+        if result is None:
             return self._json_response(404, {"error": "Unknown task_id"})
-        result = dict(task)
-        if task["status"] == "done":
-            del LocalRequestHandler._pending_switch[task_id]
         return self._json_response(200, result)
 
     def _del_channel(self, args, body, method):
@@ -437,9 +584,7 @@ class LocalRequestHandler:
 
         if app and app.property("_main_loop_running"):
             # 异步模式：不阻塞 scheme handler，立即返回 pending
-            import uuid as uuid_mod
-            task_id = str(uuid_mod.uuid4())
-            LocalRequestHandler._pending_imports[task_id] = {"status": "pending"}
+            task_id = LocalRequestHandler._pending_imports.create()
 
             channel = args.get("channel", "")
             game_id = args.get("game_id", "")
@@ -448,13 +593,9 @@ class LocalRequestHandler:
             def do_import():
                 def on_done(success):
                     if success is None:
-                        LocalRequestHandler._pending_imports[task_id] = {
-                            "status": "done", "success": False, "cancelled": True
-                        }
+                        LocalRequestHandler._pending_imports.finish(task_id, {"success": False, "cancelled": True})
                     else:
-                        LocalRequestHandler._pending_imports[task_id] = {
-                            "status": "done", "success": success
-                        }
+                        LocalRequestHandler._pending_imports.finish(task_id, {"success": success})
 
                 try:
                     app_state.channels_helper.manual_import(
@@ -463,9 +604,7 @@ class LocalRequestHandler:
                     )
                 except Exception:
                     self.logger.exception("异步导入失败")
-                    LocalRequestHandler._pending_imports[task_id] = {
-                        "status": "done", "success": False
-                    }
+                    LocalRequestHandler._pending_imports.finish(task_id, {"success": False})
 
             app_state.run_on_main_thread(do_import)
             return self._json_response(200, {"status": "pending", "task_id": task_id})
@@ -478,12 +617,9 @@ class LocalRequestHandler:
 
     def _import_status(self, args, body, method):
         task_id = args.get("task_id", "")
-        task = LocalRequestHandler._pending_imports.get(task_id)
-        if task is None:
+        result = LocalRequestHandler._pending_imports.take(task_id, self._long_poll_wait(args))
+        if result is None:
             return self._json_response(404, {"error": "Unknown task_id"})
-        result = dict(task)
-        if task["status"] == "done":
-            del LocalRequestHandler._pending_imports[task_id]
         return self._json_response(200, result)
 
     def _set_default(self, args, body, method):
@@ -610,9 +746,7 @@ class LocalRequestHandler:
                     app = None
 
                 if app and app.property("_main_loop_running"):
-                    import uuid as uuid_mod
-                    task_id = str(uuid_mod.uuid4())
-                    LocalRequestHandler._pending_imports[task_id] = {"status": "pending"}
+                    task_id = LocalRequestHandler._pending_imports.create()
 
                     game_helper = self.game_helper
                     logger = self.logger
@@ -637,10 +771,10 @@ class LocalRequestHandler:
                             dummy_parent.close()
 
                             if not sel_path:
-                                LocalRequestHandler._pending_imports[task_id] = {
-                                    "status": "done", "success": False, "cancelled": True,
+                                LocalRequestHandler._pending_imports.finish(task_id, {
+                                    "success": False, "cancelled": True,
                                     "enabled": False, "path": "",
-                                }
+                                })
                                 return
 
                             name = os.path.splitext(os.path.basename(sel_path))[0]
@@ -653,15 +787,13 @@ class LocalRequestHandler:
                             game_helper.set_game_auto_start(gid, True)
                             game_helper.set_game_path(gid, sel_path)
                             game_helper.rename_game(gid, name)
-                            LocalRequestHandler._pending_imports[task_id] = {
-                                "status": "done", "success": True,
+                            LocalRequestHandler._pending_imports.finish(task_id, {
+                                "success": True,
                                 "enabled": True, "path": sel_path, "game_id": gid,
-                            }
+                            })
                         except Exception as e:
                             logger.exception("异步选择游戏路径失败")
-                            LocalRequestHandler._pending_imports[task_id] = {
-                                "status": "done", "success": False, "error": str(e)
-                            }
+                            LocalRequestHandler._pending_imports.finish(task_id, {"success": False, "error": str(e)})
 
                     app_state.run_on_main_thread(do_select)
                     return self._json_response(200, {"status": "pending", "task_id": task_id})
@@ -808,9 +940,7 @@ class LocalRequestHandler:
                 app = None
 
             if app and app.property("_main_loop_running"):
-                import uuid as uuid_mod
-                task_id = str(uuid_mod.uuid4())
-                LocalRequestHandler._pending_imports[task_id] = {"status": "pending"}
+                task_id = LocalRequestHandler._pending_imports.create()
 
                 game_helper = self.game_helper
                 logger = self.logger
@@ -833,10 +963,10 @@ class LocalRequestHandler:
                         )
                         dummy.close()
                         if not target_dir:
-                            LocalRequestHandler._pending_imports[task_id] = {
-                                "status": "done", "success": False, "cancelled": True,
+                            LocalRequestHandler._pending_imports.finish(task_id, {
+                                "success": False, "cancelled": True,
                                 "error": "用户取消选择安装目录",
-                            }
+                            })
                             return
                         os.makedirs(target_dir, exist_ok=True)
                         game_path = os.path.join(target_dir, startup_path)
@@ -850,15 +980,13 @@ class LocalRequestHandler:
                             if CloudRes().is_convert_to_normal(sgid):
                                 game.create_tool_launch_shortcut(game.path or "")
                         game_helper._save_games()
-                        LocalRequestHandler._pending_imports[task_id] = {
-                            "status": "done", "success": updated,
+                        LocalRequestHandler._pending_imports.finish(task_id, {
+                            "success": updated,
                             "path": game_path, "version": game.get_version(),
-                        }
+                        })
                     except Exception as e:
                         logger.exception("异步安装启动器失败")
-                        LocalRequestHandler._pending_imports[task_id] = {
-                            "status": "done", "success": False, "error": str(e)
-                        }
+                        LocalRequestHandler._pending_imports.finish(task_id, {"success": False, "error": str(e)})
 
                 app_state.run_on_main_thread(do_install)
                 return self._json_response(200, {"status": "pending", "task_id": task_id})
@@ -1200,6 +1328,16 @@ class LocalRequestHandler:
             return self._json_response(200, {"success": True})
         return self._json_response(400, {"success": False, "error": "invalid url"})
 
+    def _get_metrics(self, args, body, method):
+        """代理 flow 耗时分布、addon 改写计数及本地 DNS 缓存统计。"""
+        proxy_mgr = app_state.proxy_mgr
+        if proxy_mgr is None:
+            return self._json_response(200, {"success": False, "error": "代理未启动"})
+        data = proxy_mgr.get_metrics()
+        if app_state.dns_server is not None:
+            data["dns"] = app_state.dns_server.get_stats()
+        return self._json_response(200, {"success": True, **data})
+
     def _get_proxy_mode(self, args, body, method):
         """获取当前代理模式 (global/process)。"""
         mode = genv.get("proxy_mode", "global")
@@ -30,9 +30,15 @@ def parse_command_line_args():
     arg_parser.add_argument('--uri', type=str, default="", help='处理 idvlogin:// URI Scheme 调用')
     arg_parser.add_argument('--open-ui', action='store_true', help='启动后直接打开渠道服管理界面')
     arg_parser.add_argument('--proxy-port', type=int, default=10717, help='mitmproxy 监听端口 (默认 10717)')
-    return arg_parser.parse_args()
+    # 隔离代理模式的子进程会以 spawn 方式重新导入本模块，忽略其附带的参数
+    return arg_parser.parse_known_args()[0]
 
 
+if __name__ == "__main__":
+    # 打包后的隔离代理子进程需在解析参数前被 multiprocessing 接管
+    import multiprocessing
+    multiprocessing.freeze_support()
+
 CLI_ARGS = parse_command_line_args()
 
 
@@ -134,6 +140,7 @@ def handle_exit():
         if genv.get("last_run_state", "") != "crash":
             genv.set("last_run_state", "ok", True)
             genv.set("last_run_state_ts", int(time.time()), True)
+        genv.flush()
     except Exception:
         pass
 
@@ -162,6 +169,7 @@ def handle_exit():
         try:
             _dns_server.stop()
             _dns_server = None
+            app_state.dns_server = None
         except Exception as e:
             if logger:
                 logger.warning(f"停止 DNS 服务器失败: {e}")
@@ -207,6 +215,8 @@ def handle_exit():
             logger.warning(f"注销 URI Scheme 失败: {e}")
             import traceback
             logger.debug(traceback.format_exc())
+    # 信号/控制台处理器随后会 os._exit，atexit 不会执行，这里确保配置落盘
+    genv.flush()
     print("再见!")
 
 def handle_update():
@@ -408,8 +418,8 @@ def initialize():
                     with open(local_cloudres_path, "r", encoding="utf-8") as f:
                         local_cloudres = json.load(f)
                     cache_path = os.path.join(genv.get("FP_WORKDIR"), "cache.json")
-                    from secure_write import write_json_restricted
-                    write_json_restricted(cache_path, local_cloudres)
+                    from secure_write import CACHE, write_json_restricted
+                    write_json_restricted(cache_path, local_cloudres, CACHE)
                     CloudPaths = []
                     print("【云端配置】未检测到版本信息，已使用本地 assets\\cloudRes.json。")
                 except Exception as e:
@@ -920,6 +930,10 @@ def setup_network_proxy(proxy_port):
     game_helper = GameManager()
     ui_logger = logger
 
+    # /_idv-login/* 请求由 addon 与 Qt 窗口共用同一个处理器
+    from local_handler import LocalRequestHandler
+    LocalRequestHandler.create_instance(game_helper=game_helper, logger=logger)
+
     # Platform-specific defaults
     if sys.platform == "darwin":
         cv = "a5.10.0"
@@ -1013,6 +1027,7 @@ def setup_network_proxy(proxy_port):
                 except Exception:
                     pass
                 _dns_server = None
+                app_state.dns_server = None
             from mitm_proxy import clear_custom_dns
             clear_custom_dns()
             # 回退到常规模式（不持久化，下次启动仍尝试兼容模式）
@@ -1128,28 +1143,40 @@ def _setup_compat_mode(addon):
     # 0. 检测并处理 443 端口占用
     _check_and_handle_port_443()
 
-    # 1. 并行预解析目标域名的真实 IP（防止 DNS 回环）
-    from mitm_proxy import resolve_domain_ip, add_custom_dns
+    # 1. 预解析目标域名的真实 IP（防止 DNS 回环）
+    #    优先使用工作目录中上次验证可用的 IP，缺失的域名才并行解析
+    from mitm_proxy import resolve_domain_ip, add_custom_dns, ResolvedIpCache
     from concurrent.futures import ThreadPoolExecutor, as_completed
 
+    ip_cache = ResolvedIpCache()
     resolved_ips = {}
-    with ThreadPoolExecutor(max_workers=len(target_domains)) as executor:
-        futures = {
-            executor.submit(resolve_domain_ip, domain, True): domain
-            for domain in target_domains
-        }
-        for future in as_completed(futures, timeout=15):
-            domain = futures[future]
-            try:
-                ip = future.result()
-                if ip:
-                    resolved_ips[domain] = ip
-                    add_custom_dns(domain, 443, ip)
-                    logger.debug(f"目标服务器: {domain} -> {ip}")
-                else:
-                    logger.warning(f"无法解析 {domain}，兼容模式可能无法正常工作")
-            except Exception as e:
-                logger.warning(f"解析 {domain} 失败: {e}")
+    for domain in target_domains:
+        ip = ip_cache.get(domain)
+        if ip:
+            resolved_ips[domain] = ip
+            add_custom_dns(domain, 443, ip)
+            logger.debug(f"目标服务器 (缓存): {domain} -> {ip}")
+
+    missing_domains = [d for d in target_domains if d not in resolved_ips]
+    if missing_domains:
+        with ThreadPoolExecutor(max_workers=len(missing_domains)) as executor:
+            futures = {
+                executor.submit(resolve_domain_ip, domain, True): domain
+                for domain in missing_domains
+            }
+            for future in as_completed(futures, timeout=15):
+                domain = futures[future]
+                try:
+                    ip = future.result()
+                    if ip:
+                        resolved_ips[domain] = ip
+                        add_custom_dns(domain, 443, ip)
+                        ip_cache.put(domain, ip, None)
+                        logger.debug(f"目标服务器: {domain} -> {ip}")
+                    else:
+                        logger.warning(f"无法解析 {domain}，兼容模式可能无法正常工作")
+                except Exception as e:
+                    logger.warning(f"解析 {domain} 失败: {e}")
 
     if not resolved_ips:
         logger.error("所有目标域名解析失败，无法启动兼容模式")
@@ -1181,6 +1208,7 @@ def _setup_compat_mode(addon):
         _dns_policy_mgr.cleanup()
         _dns_policy_mgr = None
         raise RuntimeError("Failed to start local DNS server for compat mode")
+    app_state.dns_server = _dns_server
 
     logger.debug("本地 DNS 服务器已启动 (127.0.0.1:53)")
 
@@ -1191,6 +1219,10 @@ def _setup_compat_mode(addon):
     m_proxy = proxy_mgr
     app_state.proxy_mgr = proxy_mgr
 
+    # 5. 后台重新验证（探测 RTT，IP 失效时重新解析，并经 apply_resolved_ip 切换）
+    #    放在最后：兼容模式启动失败回退时会清空自定义 DNS，此前启动的验证会把域名重新钉住
+    ip_cache.revalidate_async(target_domains)
+
 
 def _ask_user_confirmation(title: str, message: str) -> bool:
     """向用户询问确认，优先使用 Qt 对话框，回退到 Windows API，最后使用控制台。
@@ -1357,6 +1389,7 @@ def handle_error_and_exit(e):
         genv.set("last_run_state", "crash", True)
         genv.set("last_run_state_ts", int(time.time()), True)
         genv.set("last_run_error", str(e), True)
+        genv.flush()
     except Exception:
         pass
     try:
@@ -1389,14 +1422,24 @@ def handle_error_and_exit(e):
 def setup_signal_handlers():
     import signal
     
-    def signal_handler(sig, frame):
-        print(f"捕获到信号 {sig}，正在执行清理...")
-        sys.stdout.flush()
+    exiting = threading.Event()
+
+    def exit_worker():
         handle_exit()
         # 等待足够时间以确保清理操作（NRPT 规则删除、WM_SETTINGCHANGE 广播等）完成
         time.sleep(3.0)
         import os
         os._exit(0)
+
+    def signal_handler(sig, frame):
+        # 信号处理函数在主线程上执行，可能打断正持有配置/写入锁的代码，
+        # 因此只交给普通线程清理并落盘，这里立即返回；重复的信号忽略
+        if exiting.is_set():
+            return
+        exiting.set()
+        print(f"捕获到信号 {sig}，正在执行清理...")
+        sys.stdout.flush()
+        threading.Thread(target=exit_worker, name="exit-cleanup").start()
     # 捕获常见的终止信号
     signal.signal(signal.SIGINT, signal_handler)   # Ctrl+C
     signal.signal(signal.SIGTERM, signal_handler)  # kill 命令
@@ -16,12 +16,15 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
+import asyncio
+import hashlib
 import json
-import os
 import re
-import sys
 import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlencode
 
 import app_state
 from mitmproxy import http
@@ -64,6 +67,8 @@ LOGIN_METHODS = [
     },
 ]
 
+ALL_SELECT_PLATFORMS = (0, 1, 2, 3, 4, 5, 6, 7, 8, 9)
+
 PC_INFO = {
     "extra_unisdk_data": "",
     "from_game_id": "h55",
@@ -77,6 +82,130 @@ PC_INFO = {
 }
 
 
+def _assign(obj: dict, key, value) -> bool:
+    """Set ``obj[key] = value`` and report whether anything changed.
+
+    The type is compared as well so that e.g. ``1`` is not considered equal
+    to ``True`` when the server sends the "wrong" kind of truthy value.
+    """
+    if key in obj:
+        current = obj[key]
+        if type(current) is type(value) and current == value:
+            return False
+    obj[key] = value
+    return True
+
+
+class _ParsedBody:
+    """A flow's request body, parsed once and re-serialised at most once.
+
+    Form bodies keep the ``parse_qs`` list-of-values shape; JSON bodies are
+    kept as the decoded dict.  Mutations only mark the body dirty when they
+    actually change a value, so untouched bodies are forwarded as-is.
+    """
+
+    FORM = "form"
+    JSON = "json"
+
+    __slots__ = ("kind", "data", "dirty")
+
+    def __init__(self, request):
+        self.kind = None
+        self.data = {}
+        self.dirty = False
+
+        content_type = request.headers.get("content-type", "")
+        if "application/x-www-form-urlencoded" in content_type:
+            raw = request.content.decode("utf-8", errors="replace")
+            self.kind = self.FORM
+            self.data = parse_qs(raw, keep_blank_values=True)
+        elif "application/json" in content_type:
+            try:
+                data = json.loads(request.content)
+            except Exception:
+                return
+            if isinstance(data, dict):
+                self.kind = self.JSON
+                self.data = data
+
+    def get(self, key, default=""):
+        if key not in self.data:
+            return default
+        value = self.data[key]
+        if self.kind == self.FORM and len(value) == 1:
+            return value[0]
+        return value
+
+    def set(self, key, value):
+        if self.kind is None:
+            return
+        stored = [value] if self.kind == self.FORM else value
+        if self.data.get(key, None) != stored:
+            self.data[key] = stored
+            self.dirty = True
+
+    def update(self, mapping: dict):
+        for k, v in mapping.items():
+            self.set(k, v)
+
+    def pop(self, key):
+        if self.kind is not None and key in self.data:
+            del self.data[key]
+            self.dirty = True
+
+    def serialize(self) -> bytes:
+        if self.kind == self.FORM:
+            return urlencode(self.data, doseq=True).encode()
+        return json.dumps(self.data).encode()
+
+
+class _WorkerPool:
+    """A fixed-size thread pool that refuses work instead of queueing it.
+
+    A worker counts as busy from submission until the call actually
+    returns on the worker thread, so a request the caller stopped waiting
+    for (``wait_for`` timeout) keeps its worker until the handler is done.
+    """
+
+    def __init__(self, max_workers: int, name: str):
+        self.max_workers = max_workers
+        self._name = name
+        self._executor = None
+        self._busy = 0
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self) -> int:
+        return self._busy
+
+    def try_submit(self, loop, func, *args):
+        """Run *func* on an idle worker; return ``None`` if all are busy."""
+        with self._lock:
+            if self._busy >= self.max_workers:
+                return None
+            self._busy += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=self._name,
+                )
+
+        def _task():
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+        return loop.run_in_executor(self._executor, _task)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
 class IDVLoginAddon:
     """mitmproxy addon that intercepts and modifies game API traffic.
 
@@ -115,6 +244,24 @@ class IDVLoginAddon:
         self.use_login_mapping_always = use_login_mapping_always
         self.ui_manager = ui_manager
 
+        # 实际被改写 / 已满足目标值而原样透传的 JSON 响应数量
+        self.responses_rewritten = 0
+        self.responses_unchanged = 0
+
+        # /_idv-login/* 阻塞路由与长轮询各自的线程池，以及内联执行时
+        # 占用 mitmproxy 事件循环的累计耗时
+        self._idv_pool = _WorkerPool(self._IDV_BLOCKING_WORKERS, "idv-local")
+        self._idv_long_poll_pool = _WorkerPool(self._IDV_LONG_POLL_WORKERS, "idv-long-poll")
+        self.idv_loop_blocked_seconds = 0.0
+        self.idv_offloaded_requests = 0
+        self.idv_timed_out_requests = 0
+        self.idv_rejected_requests = 0
+
+        # pc_config / login_methods 改写结果缓存：
+        # (route, game_id, sha1(上游 body)) -> 改写后的 bytes（None 表示无需改写）
+        self._rewrite_cache = OrderedDict()
+        self._rewrite_cache_generation = None
+
         self.genv = genv
         self.stack_mgr = LoginStackManager.get_instance()
         self.cloud_res = CloudRes
@@ -124,123 +271,229 @@ class IDVLoginAddon:
             genv.get("DOMAIN_TARGET_OVERSEA", "sdk-os.mpsdk.easebar.com"),
         }
 
-        # Regex patterns for route matching
-        self._re_login_methods = re.compile(r"^/mpay/games/([^/]+)/login_methods$")
-        self._re_first_login = re.compile(
-            r"^/mpay/api/users/login/mobile/(finish|get_sms|verify_sms)$"
-        )
-        self._re_device_users_post = re.compile(
-            r"^/mpay/games/([^/]+)/devices/([^/]+)/users$"
-        )
-        self._re_handle_login = re.compile(
-            r"^/mpay/games/([^/]+)/devices/([^/]+)/users/([^/]+)$"
-        )
+        # 请求/响应两个钩子共用的路由表：每个 flow 只解析一次路由，
+        # 结果存放在 flow.metadata 中供 response() 复用
+        self._request_handlers = {
+            route: getattr(self, name) if name else None
+            for route, name in self._REQUEST_HANDLER_NAMES.items()
+        }
+        self._response_handlers = {
+            route: getattr(self, name)
+            for route, name in self._RESPONSE_HANDLER_NAMES.items()
+        }
+
+    # ------------------------------------------------------------------
+    # Route table
+    # ------------------------------------------------------------------
+
+    _ROUTE_METADATA_KEY = "idv_route"
+    _BODY_METADATA_KEY = "idv_body"
+    _REWRITE_TIME_METADATA_KEY = "idv_rewrite_seconds"
+
+    # 精确路径 -> 路由名
+    _EXACT_ROUTES = {
+        "/mpay/api/qrcode/create_login": "create_login",
+        "/mpay/api/users/login/mobile/finish": "mobile_login",
+        "/mpay/api/users/login/mobile/get_sms": "mobile_login",
+        "/mpay/api/users/login/mobile/verify_sms": "mobile_login",
+        "/mpay/api/qrcode/image": "qrcode_image",
+        "/mpay/games/pc_config": "pc_config",
+        "/mpay/api/users/login/qrcode/exchange_token": "exchange_token",
+        "/mpay/api/qrcode/query": "qrcode_query",
+        "/mpay/api/data/upload": "data_upload",
+        "/api/games/pc/config": "oversea_config",
+    }
+
+    # 带参数的路由合并为一个正则，命名分组即路由名
+    _RE_PARAM_ROUTES = re.compile(
+        r"^/mpay/games/(?:"
+        r"(?P<login_methods>(?P<lm_game_id>[^/]+)/login_methods)"
+        r"|(?P<handle_login>(?P<hl_game_id>[^/]+)/devices/[^/]+/users/[^/]+)"
+        r"|(?P<device_users>[^/]+/devices/[^/]+/users)"
+        r")$"
+    )
+
+    # 仅在特定 HTTP 方法下生效的参数路由，其余方法按通用路由处理
+    _ROUTE_METHODS = {
+        "handle_login": "GET",
+        "device_users": "POST",
+    }
+
+    # 不注入 cv 的前缀
+    _PASSTHROUGH_PREFIXES = ("/mpay/api/qrcode/", "/mpay/api/reverify/")
+
+    _REQUEST_HANDLER_NAMES = {
+        "create_login": "_modify_create_login_request",
+        "mobile_login": "_inject_cv",
+        "device_users": "_inject_cv",
+        "handle_login": "_modify_handle_login_request",
+        "qrcode_image": None,
+        "pc_config": "_modify_pc_config_request",
+        "exchange_token": "_modify_exchange_token_request",
+        "qrcode_query": None,    # handled in response
+        "data_upload": None,     # handled in response
+        "oversea_config": None,  # handled in response
+        "login_methods": "_modify_default_request",
+        "passthrough": None,
+        "default": "_modify_default_request",
+    }
+
+    _RESPONSE_HANDLER_NAMES = {
+        "login_methods": "_modify_login_methods_response",
+        "handle_login": "_modify_handle_login_response",
+        "qrcode_image": "_modify_qrcode_image_response",
+        "pc_config": "_modify_pc_config_response",
+        "create_login": "_modify_create_login_response",
+        "qrcode_query": "_handle_qrcode_query_response",
+        "exchange_token": "_handle_exchange_token_response",
+        "data_upload": "_handle_data_upload_response",
+        "oversea_config": "_modify_oversea_config_response",
+    }
+
+    @classmethod
+    def resolve_route(cls, path: str, method: str):
+        """Map a request path (without query) to ``(route, game_id)``.
+
+        ``game_id`` is only filled for parameterised ``/mpay/games/<id>/...``
+        routes; for everything else it is an empty string.
+        """
+        route = cls._EXACT_ROUTES.get(path)
+        if route is not None:
+            return route, ""
+
+        if path.startswith("/mpay/games/"):
+            m = cls._RE_PARAM_ROUTES.match(path)
+            if m:
+                route = m.lastgroup
+                required = cls._ROUTE_METHODS.get(route)
+                if required is None or required == method:
+                    game_id = m.group("lm_game_id") or m.group("hl_game_id") or ""
+                    return route, game_id
+                return "default", ""
+
+        if path.startswith(cls._PASSTHROUGH_PREFIXES):
+            return "passthrough", ""
+        return "default", ""
+
+    def _route_for(self, flow: http.HTTPFlow):
+        """Return the cached route of *flow*, resolving it on first use."""
+        route = flow.metadata.get(self._ROUTE_METADATA_KEY)
+        if route is None:
+            path = flow.request.path.split("?")[0]
+            if path.startswith("/_idv-login/"):
+                route = ("idv_login", "", path)
+            else:
+                name, game_id = self.resolve_route(path, flow.request.method)
+                route = (name, game_id, path)
+            flow.metadata[self._ROUTE_METADATA_KEY] = route
+        return route
+
+    def _request_body(self, flow: http.HTTPFlow) -> _ParsedBody:
+        """Return the parsed request body of *flow*, parsing it on first use.
+
+        Request-side rewrites mutate this object and ``request()`` writes it
+        back once; response-side handlers read the already-rewritten form.
+        """
+        body = flow.metadata.get(self._BODY_METADATA_KEY)
+        if body is None:
+            body = _ParsedBody(flow.request)
+            flow.metadata[self._BODY_METADATA_KEY] = body
+        return body
+
+    def _add_rewrite_time(self, flow: http.HTTPFlow, seconds: float):
+        """Accumulate time spent in our own hooks; read by the timing addon."""
+        key = self._REWRITE_TIME_METADATA_KEY
+        flow.metadata[key] = flow.metadata.get(key, 0.0) + seconds
+
+    def _flush_request_body(self, flow: http.HTTPFlow):
+        body = flow.metadata.get(self._BODY_METADATA_KEY)
+        if body is not None and body.dirty:
+            flow.request.content = body.serialize()
+            body.dirty = False
 
     # ------------------------------------------------------------------
     # mitmproxy hooks
     # ------------------------------------------------------------------
 
-    def request(self, flow: http.HTTPFlow):
+    async def request(self, flow: http.HTTPFlow):
         host = flow.request.pretty_host
         if host not in self.target_domains:
             return
 
-        path = flow.request.path.split("?")[0]
+        route, _, path = self._route_for(flow)
 
         # ── _idv-login routes: handle locally, do NOT forward upstream ──
-        if path.startswith("/_idv-login/"):
-            self._handle_idv_login_request(flow, path)
+        if route == "idv_login":
+            await self._handle_idv_login_request(flow, path)
             return
 
         # ── Game API routes: may modify query before forwarding ──
-        if path == "/mpay/api/qrcode/create_login":
-            self._modify_create_login_request(flow)
-        elif path in (
-            "/mpay/api/users/login/mobile/finish",
-            "/mpay/api/users/login/mobile/get_sms",
-            "/mpay/api/users/login/mobile/verify_sms",
-        ):
-            flow.request.query["cv"] = self.cv
-        elif self._re_device_users_post.match(path) and flow.request.method == "POST":
-            flow.request.query["cv"] = self.cv
-        elif self._re_handle_login.match(path) and flow.request.method == "GET":
-            self._modify_handle_login_request(flow)
-        elif path in ("/mpay/api/qrcode/image",):
-            pass  # no request modification needed
-        elif path == "/mpay/games/pc_config":
-            if flow.request.query.get("game_id", "") != "aecglf6ee4aaaarz-g-a50":
-                flow.request.query["cv"] = self.cv
-        elif path == "/mpay/api/users/login/qrcode/exchange_token":
-            self._modify_exchange_token_request(flow)
-        elif path == "/mpay/api/qrcode/query":
-            pass  # handled in response
-        elif path == "/mpay/api/data/upload":
-            pass  # handled in response
-        elif path == "/api/games/pc/config":
-            pass  # handled in response
-        elif not path.startswith("/mpay/api/qrcode/") and not path.startswith("/mpay/api/reverify/"):
-            # Global catch-all: add CV to query + POST body, remove arch
-            flow.request.query["cv"] = self.cv
-            if flow.request.method == "POST":
-                self._modify_post_body_cv(flow)
+        handler = self._request_handlers.get(route)
+        if handler is not None:
+            started = time.perf_counter()
+            handler(flow)
+            self._flush_request_body(flow)
+            self._add_rewrite_time(flow, time.perf_counter() - started)
 
     def response(self, flow: http.HTTPFlow):
         host = flow.request.pretty_host
         if host not in self.target_domains:
             return
 
-        path = flow.request.path.split("?")[0]
+        route, _, path = self._route_for(flow)
 
-        # ── _idv-login routes are fully handled in request() ──
-        if path.startswith("/_idv-login/"):
+        # ── _idv-login routes are fully handled in request() and have no
+        #    response handler, so they fall out here as well ──
+        handler = self._response_handlers.get(route)
+        if handler is None:
             return
 
+        started = time.perf_counter()
         try:
-            if self._re_login_methods.match(path):
-                self._modify_login_methods_response(flow)
-            elif self._re_handle_login.match(path) and flow.request.method == "GET":
-                self._modify_handle_login_response(flow)
-            elif path == "/mpay/api/qrcode/image":
-                self._modify_qrcode_image_response(flow)
-            elif path == "/mpay/games/pc_config":
-                if flow.request.query.get("game_id", "") != "aecglf6ee4aaaarz-g-a50":
-                    self._modify_pc_config_response(flow)
-            elif path == "/mpay/api/qrcode/create_login":
-                self._modify_create_login_response(flow)
-            elif path == "/mpay/api/qrcode/query":
-                self._handle_qrcode_query_response(flow)
-            elif path == "/mpay/api/users/login/qrcode/exchange_token":
-                self._handle_exchange_token_response(flow)
-            elif path == "/mpay/api/data/upload":
-                self._handle_data_upload_response(flow)
-            elif path == "/api/games/pc/config":
-                self._modify_oversea_config_response(flow)
+            handler(flow)
         except Exception:
             self.logger.exception(f"处理响应时出错: {path}")
+        self._add_rewrite_time(flow, time.perf_counter() - started)
+
+    def get_stats(self) -> dict:
+        """Counters exposed through /_idv-login/metrics and the debug export."""
+        return {
+            "responses_rewritten": self.responses_rewritten,
+            "responses_unchanged": self.responses_unchanged,
+            "rewrite_cache_entries": len(self._rewrite_cache),
+            "idv_loop_blocked_seconds": round(self.idv_loop_blocked_seconds, 6),
+            "idv_offloaded_requests": self.idv_offloaded_requests,
+            "idv_timed_out_requests": self.idv_timed_out_requests,
+            "idv_rejected_requests": self.idv_rejected_requests,
+            "idv_busy_workers": self._idv_pool.busy + self._idv_long_poll_pool.busy,
+        }
+
+    def done(self):
+        self._idv_pool.shutdown()
+        self._idv_long_poll_pool.shutdown()
 
     # ------------------------------------------------------------------
     # Request modification helpers
     # ------------------------------------------------------------------
 
+    def _inject_cv(self, flow: http.HTTPFlow):
+        flow.request.query["cv"] = self.cv
+
+    def _modify_default_request(self, flow: http.HTTPFlow):
+        """全局 catch-all：query 与 POST body 注入 cv，并移除 arch。"""
+        flow.request.query["cv"] = self.cv
+        if flow.request.method == "POST":
+            self._modify_post_body_cv(flow)
+
+    def _modify_pc_config_request(self, flow: http.HTTPFlow):
+        if flow.request.query.get("game_id", "") != "aecglf6ee4aaaarz-g-a50":
+            flow.request.query["cv"] = self.cv
+
     def _modify_post_body_cv(self, flow: http.HTTPFlow):
         """为 POST 请求的 body 注入 cv 并移除 arch（全局 catch-all 用）。"""
-        content_type = flow.request.headers.get("content-type", "")
-        if "application/x-www-form-urlencoded" in content_type:
-            from urllib.parse import parse_qs, urlencode
-            raw = flow.request.content.decode("utf-8", errors="replace")
-            parsed = parse_qs(raw, keep_blank_values=True)
-            parsed["cv"] = [self.cv]
-            parsed.pop("arch", None)
-            flat = {k: v[0] if len(v) == 1 else v for k, v in parsed.items()}
-            flow.request.content = urlencode(flat).encode()
-        elif "application/json" in content_type:
-            try:
-                body = json.loads(flow.request.content)
-                body["cv"] = self.cv
-                body.pop("arch", None)
-                flow.request.content = json.dumps(body).encode()
-            except Exception:
-                pass
+        body = self._request_body(flow)
+        body.set("cv", self.cv)
+        body.pop("arch")
 
     def _modify_create_login_request(self, flow: http.HTTPFlow):
         query = dict(flow.request.query)
@@ -257,19 +510,8 @@ class IDVLoginAddon:
 
     def _modify_exchange_token_request(self, flow: http.HTTPFlow):
         """覆写 exchange_token 请求参数（query + body），与 v5.9.1 行为一致。"""
-        game_id = flow.request.query.get("game_id", "")
-        if not game_id:
-            content_type = flow.request.headers.get("content-type", "")
-            if "application/x-www-form-urlencoded" in content_type:
-                from urllib.parse import parse_qs
-                raw = flow.request.content.decode("utf-8", errors="replace")
-                parsed = parse_qs(raw, keep_blank_values=True)
-                game_id = parsed.get("game_id", [""])[0]
-            elif "application/json" in content_type:
-                try:
-                    game_id = json.loads(flow.request.content).get("game_id", "")
-                except Exception:
-                    pass
+        body = self._request_body(flow)
+        game_id = flow.request.query.get("game_id", "") or body.get("game_id", "")
 
         config = self.cloud_res().get_qrcode_login_config(game_id)
         if not config:
@@ -284,24 +526,8 @@ class IDVLoginAddon:
             flow.request.query["cv"] = overrides["cv"]
 
         # body: 覆写所有 7 个参数 + 移除 arch
-        content_type = flow.request.headers.get("content-type", "")
-        if "application/x-www-form-urlencoded" in content_type:
-            from urllib.parse import parse_qs, urlencode
-            raw = flow.request.content.decode("utf-8", errors="replace")
-            parsed = parse_qs(raw, keep_blank_values=True)
-            for k, v in overrides.items():
-                parsed[k] = [v]
-            parsed.pop("arch", None)
-            flat = {k: v[0] if len(v) == 1 else v for k, v in parsed.items()}
-            flow.request.content = urlencode(flat).encode()
-        elif "application/json" in content_type:
-            try:
-                body = json.loads(flow.request.content)
-                body.update(overrides)
-                body.pop("arch", None)
-                flow.request.content = json.dumps(body).encode()
-            except Exception:
-                pass
+        body.update(overrides)
+        body.pop("arch")
 
     def _modify_handle_login_request(self, flow: http.HTTPFlow):
         mapping = {
@@ -320,8 +546,7 @@ class IDVLoginAddon:
 
         use_mapping = self.use_login_mapping_always
 
-        m = self._re_handle_login.match(flow.request.path.split("?")[0])
-        game_id = m.group(1) if m else ""
+        _, game_id, _ = self._route_for(flow)
 
         if self.qrcode_app_channel_provider:
             qrcode_channel = self.qrcode_app_channel_provider(game_id)
@@ -340,23 +565,73 @@ class IDVLoginAddon:
     # Response modification helpers
     # ------------------------------------------------------------------
 
+    def _patch_json_response(self, flow: http.HTTPFlow, patch) -> bool:
+        """Apply *patch* to the decoded JSON response body.
+
+        *patch* mutates the dict in place and returns whether it changed
+        anything.  The body is only re-serialised (compactly, preserving key
+        order) and written back when it did; otherwise the upstream bytes are
+        forwarded untouched.
+        """
+        data = json.loads(flow.response.content)
+        if not patch(data):
+            self.responses_unchanged += 1
+            return False
+        flow.response.content = json.dumps(
+            data, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+        self.responses_rewritten += 1
+        return True
+
+    _REWRITE_CACHE_SIZE = 32
+
+    def _cached_json_rewrite(self, flow: http.HTTPFlow, route: str, game_id: str, patch):
+        """``_patch_json_response`` memoized on the upstream body.
+
+        The cache is dropped whenever the cloud config version changes;
+        ``cv`` and ``login_style`` are fixed for the addon's lifetime.
+        """
+        generation = self.cloud_res().get_last_modified()
+        if generation != self._rewrite_cache_generation:
+            self._rewrite_cache.clear()
+            self._rewrite_cache_generation = generation
+
+        key = (route, game_id, hashlib.sha1(flow.response.content).digest())
+        if key in self._rewrite_cache:
+            self._rewrite_cache.move_to_end(key)
+            rewritten = self._rewrite_cache[key]
+            if rewritten is None:
+                self.responses_unchanged += 1
+            else:
+                flow.response.content = rewritten
+                self.responses_rewritten += 1
+            return
+
+        changed = self._patch_json_response(flow, patch)
+        self._rewrite_cache[key] = flow.response.content if changed else None
+        if len(self._rewrite_cache) > self._REWRITE_CACHE_SIZE:
+            self._rewrite_cache.popitem(last=False)
+
     def _modify_login_methods_response(self, flow: http.HTTPFlow):
+        def patch(data):
+            changed = _assign(data, "entrance", [LOGIN_METHODS])
+            changed |= _assign(data, "select_platform", True)
+            changed |= _assign(data, "qrcode_select_platform", True)
+            for cfg in data.get("config", {}).values():
+                changed |= _assign(cfg, "select_platforms", list(ALL_SELECT_PLATFORMS))
+            return changed
+
         try:
-            data = json.loads(flow.response.content)
-            data["entrance"] = [LOGIN_METHODS]
-            data["select_platform"] = True
-            data["qrcode_select_platform"] = True
-            for i in data.get("config", {}):
-                data["config"][i]["select_platforms"] = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
-            flow.response.content = json.dumps(data).encode()
+            _, game_id, _ = self._route_for(flow)
+            self._cached_json_rewrite(flow, "login_methods", game_id, patch)
         except Exception:
             pass
 
     def _modify_handle_login_response(self, flow: http.HTTPFlow):
         try:
-            data = json.loads(flow.response.content)
-            data["user"]["pc_ext_info"] = PC_INFO
-            flow.response.content = json.dumps(data).encode()
+            self._patch_json_response(
+                flow, lambda data: _assign(data["user"], "pc_ext_info", PC_INFO)
+            )
         except Exception:
             pass
 
@@ -372,14 +647,21 @@ class IDVLoginAddon:
             pass
 
     def _modify_pc_config_response(self, flow: http.HTTPFlow):
+        if flow.request.query.get("game_id", "") == "aecglf6ee4aaaarz-g-a50":
+            return
+
+        def patch(data):
+            config = data["game"]["config"]
+            changed = _assign(config, "cv_review_status", 1)
+            changed |= _assign(config, "web_token_persist", True)
+            changed |= _assign(config["mobile_related_login"], "guide_related_mobile", True)
+            changed |= _assign(config["mobile_related_login"], "force_related_login", True)
+            changed |= _assign(config["login"], "login_style", self.login_style)
+            return changed
+
         try:
-            data = json.loads(flow.response.content)
-            data["game"]["config"]["cv_review_status"] = 1
-            data["game"]["config"]["web_token_persist"] = True
-            data["game"]["config"]["mobile_related_login"]["guide_related_mobile"] = True
-            data["game"]["config"]["mobile_related_login"]["force_related_login"] = True
-            data["game"]["config"]["login"]["login_style"] = self.login_style
-            flow.response.content = json.dumps(data).encode()
+            game_id = flow.request.query.get("game_id", "")
+            self._cached_json_rewrite(flow, "pc_config", game_id, patch)
         except Exception:
             pass
 
@@ -483,17 +765,8 @@ class IDVLoginAddon:
         is_selected = bool(self.genv.get("CHANNEL_ACCOUNT_SELECTED"))
         try:
             raw_data = flow.response.content
-            form_data = {}
-            content_type = flow.request.headers.get("content-type", "")
-            if "application/x-www-form-urlencoded" in content_type:
-                from urllib.parse import parse_qs
-                raw = flow.request.content.decode("utf-8", errors="replace")
-                parsed = parse_qs(raw, keep_blank_values=True)
-                form_data = {k: v[0] if len(v) == 1 else v for k, v in parsed.items()}
-            elif "application/json" in content_type:
-                form_data = json.loads(flow.request.content)
-
-            game_id = flow.request.query.get("game_id", "") or form_data.get("game_id", "")
+            body = self._request_body(flow)
+            game_id = flow.request.query.get("game_id", "") or body.get("game_id", "")
             process_id = flow.request.query.get("process_id", "")
 
             if flow.response.status_code == 200:
@@ -590,15 +863,8 @@ class IDVLoginAddon:
 
     def _handle_data_upload_response(self, flow: http.HTTPFlow):
         try:
-            form_data = {}
-            content_type = flow.request.headers.get("content-type", "")
-            if "application/x-www-form-urlencoded" in content_type:
-                from urllib.parse import parse_qs
-                raw = flow.request.content.decode("utf-8", errors="replace")
-                parsed = parse_qs(raw, keep_blank_values=True)
-                form_data = {k: v[0] if len(v) == 1 else v for k, v in parsed.items()}
-
-            game_id = form_data.get("game_id", "")
+            body = self._request_body(flow)
+            game_id = body.get("game_id", "") if body.kind == _ParsedBody.FORM else ""
             if self.game_helper.get_auto_close_setting(game_id):
                 self._trigger_auto_close()
         except Exception:
@@ -631,33 +897,88 @@ class IDVLoginAddon:
         t.start()
 
     def _modify_oversea_config_response(self, flow: http.HTTPFlow):
+        def patch(data):
+            game_config = data["game_config"]
+            changed = False
+            for i in game_config.get("account_type", {}).values():
+                changed |= _assign(i, "disable_login", False)
+                changed |= _assign(i, "enable", True)
+            changed |= _assign(game_config, "platform_cross", True)
+            changed |= _assign(game_config["quick_login"], "show_role", True)
+            changed |= _assign(game_config["quick_login"], "enable", True)
+            return changed
+
         try:
-            data = json.loads(flow.response.content)
-            for i in data.get("game_config", {}).get("account_type", {}).values():
-                i["disable_login"] = False
-                i["enable"] = True
-            data["game_config"]["platform_cross"] = True
-            data["game_config"]["quick_login"]["show_role"] = True
-            data["game_config"]["quick_login"]["enable"] = True
-            flow.response.content = json.dumps(data).encode()
+            self._patch_json_response(flow, patch)
         except Exception:
             pass
 
-    # ------------------------------------------------------------------
-    # _idv-login/* local request handling
-    # ------------------------------------------------------------------
+    # 只读 genv / 内存状态、足够轻量的轮询类路由，直接在事件循环中执行；
+    # 其余路由（网络、磁盘、Argon2、Qt 对话框等）交给线程池
+    _INLINE_IDV_ROUTES = frozenset({
+        "/_idv-login/qrcode",
+        "/_idv-login/switch-status",
+        "/_idv-login/import-status",
+        "/_idv-login/proxy-mode",
+        "/_idv-login/get-auto-close-state",
+        "/_idv-login/get-game-auto-start",
+        "/_idv-login/get-login-delay",
+        "/_idv-login/defaultChannel",
+    })
 
-    def _handle_idv_login_request(self, flow: http.HTTPFlow, path: str):
+    # 阻塞路由的线程数；超时的请求仍占用线程直到处理函数返回，
+    # 全部占满时新请求直接返回 503 而不是排队
+    _IDV_BLOCKING_WORKERS = 4
+    # 长轮询只是在条件变量上等待，单独的线程池避免其占满阻塞路由的线程
+    _IDV_LONG_POLL_WORKERS = 16
+    _IDV_DEFAULT_TIMEOUT = 30.0
+    _IDV_ROUTE_TIMEOUTS = {
+        "/_idv-login/cloud-sync/run": 120.0,
+        "/_idv-login/cloud-sync/probe": 60.0,
+        "/_idv-login/launcher-status": 120.0,
+        "/_idv-login/launcher-install": 120.0,
+        "/_idv-login/launcher-update": 120.0,
+        "/_idv-login/export-logs": 120.0,
+    }
+
+    async def _handle_idv_login_request(self, flow: http.HTTPFlow, path: str):
         """Handle /_idv-login/* routes locally without forwarding upstream.
 
         The addon creates a response directly so mitmproxy does not
-        forward the request to the real server.
+        forward the request to the real server.  Blocking routes run on
+        a fixed pool of ``_IDV_BLOCKING_WORKERS`` threads and long-polls on
+        a separate pool, so that other proxied flows keep moving while they
+        are in progress.  When every worker is busy the request is answered
+        with 503 right away.
         """
         from local_handler import LocalRequestHandler
 
-        handler = LocalRequestHandler(
-            game_helper=self.game_helper,
-            logger=self.logger,
-        )
-        status, headers, body = handler.handle(flow.request)
+        handler = LocalRequestHandler.get_instance()
+
+        # 长轮询请求可能阻塞数十秒，不能在事件循环中内联执行
+        long_poll = handler.is_long_poll(path, flow.request.query)
+        if path in self._INLINE_IDV_ROUTES and not long_poll:
+            started = time.perf_counter()
+            status, headers, body = handler.handle(flow.request)
+            self.idv_loop_blocked_seconds += time.perf_counter() - started
+        else:
+            pool = self._idv_long_poll_pool if long_poll else self._idv_pool
+            work = pool.try_submit(asyncio.get_running_loop(), handler.handle, flow.request)
+            if work is None:
+                self.idv_rejected_requests += 1
+                self.logger.warning(f"本地请求处理线程已满 ({pool.max_workers})，拒绝: {path}")
+                status, headers, body = LocalRequestHandler._json_response(
+                    503, {"success": False, "error": "busy"}
+                )
+            else:
+                timeout = self._IDV_ROUTE_TIMEOUTS.get(path, self._IDV_DEFAULT_TIMEOUT)
+                self.idv_offloaded_requests += 1
+                try:
+                    status, headers, body = await asyncio.wait_for(work, timeout)
+                except asyncio.TimeoutError:
+                    self.idv_timed_out_requests += 1
+                    self.logger.warning(f"本地请求处理超时 ({timeout:.0f}s): {path}")
+                    status, headers, body = LocalRequestHandler._json_response(
+                        504, {"success": False, "error": "timeout"}
+                    )
         flow.response = http.Response.make(status, body, headers)
@@ -24,14 +24,20 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
 import asyncio
+import json
+import math
 import os
 import random
+import secrets
 import socket
 import ssl
 import struct
 import subprocess
 import sys
 import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
 
 from envmgr import genv
 from logutil import setup_logger
@@ -48,21 +54,171 @@ DEFAULT_PROXY_PORT = 10717
 # Compat mode reverse proxy port (HTTPS 443)
 COMPAT_HTTPS_PORT = 443
 
+# 上游连接策略（mitmproxy Options），通过 genv 的 MITM_UPSTREAM_PROFILE 选择，
+# MITM_UPSTREAM_OPTIONS (dict) 可逐项覆盖。当前 mitmproxy 版本不认识的选项会被忽略。
+#   connection_strategy: eager（mitmproxy 默认）在客户端连接时即连接上游，lazy 则推迟到首个请求
+#   http2: 上游支持时通过 ALPN 协商 HTTP/2，多路复用登录请求
+#   http2_ping_keepalive: HTTP/2 空闲连接的保活间隔（秒），0 为关闭
+#   tcp_timeout: 空闲连接超时（秒）
+UPSTREAM_PROFILES = {
+    "default": {},
+    "reuse": {
+        "connection_strategy": "lazy",
+        "http2": True,
+        "http2_ping_keepalive": 30,
+        "tcp_timeout": 300,
+    },
+    "http1": {
+        "connection_strategy": "lazy",
+        "http2": False,
+        "tcp_timeout": 300,
+    },
+}
+# 默认保持 mitmproxy 原有行为；其他策略需先用 /_idv-login/metrics 的握手计数确认收益
+DEFAULT_UPSTREAM_PROFILE = "default"
+
+# 目标域名的叶子证书预先生成并持久化在 confdir 中，避免首个请求时现场生成 RSA 密钥
+LEAF_CERT_ROTATE_BEFORE = 30 * 24 * 3600  # 距过期不足此时长时重新签发
+LEAF_CERT_CHECK_INTERVAL = 12 * 3600  # 后台轮换检查间隔
+
+# 隔离模式（genv 的 MITM_PROXY_ISOLATED）：mitmproxy 运行在独立子进程中，
+# TLS 终止、HTTP 解析与上游 I/O 不再与 UI 线程争抢 GIL
+# 子进程等待主进程 addon 处理单个钩子的上限（秒），需大于
+# IDVLoginAddon._IDV_ROUTE_TIMEOUTS 中最长的本地路由超时（120 秒）
+ISOLATED_HOOK_TIMEOUT = 150.0
+ISOLATED_QUERY_TIMEOUT = 2.0  # 主进程查询子进程指标的超时（秒）
+# 子进程启动时从主进程复制的 genv 键
+_ISOLATED_GENV_KEYS = (
+    "FP_WORKDIR",
+    "DOMAIN_TARGET",
+    "DOMAIN_TARGET_OVERSEA",
+    "MITM_UPSTREAM_PROFILE",
+    "MITM_UPSTREAM_OPTIONS",
+    "COMPAT_RESOLVED_IPS",
+)
+
 
 # ==================================================================
 # DNS 回环防止机制
 # 重写 socket.getaddrinfo，对目标域名返回预解析的真实 IP
 # ==================================================================
 
-_dns_cache: dict[tuple[str, int], list] = {}
 _original_getaddrinfo = socket.getaddrinfo
 
+# 自定义解析条目的默认有效期（秒）；过期后继续返回旧 IP，同时在后台重新解析
+CUSTOM_DNS_TTL = 600
+# 后台重新解析失败时，旧 IP 的续期时长（秒）
+CUSTOM_DNS_RETRY = 60
+
 
 def _is_ipv4(s: str) -> bool:
     return ":" not in s
 
 
-def add_custom_dns(domain: str, port: int, ip: str):
+class _CustomDnsEntry:
+    __slots__ = ("ip", "ttl", "expires_at")
+
+    def __init__(self, ip: str, ttl: float, expires_in: float | None = None):
+        self.ip = ip
+        self.ttl = ttl
+        self.expires_at = time.monotonic() + (ttl if expires_in is None else expires_in)
+
+
+class _CustomDnsTable:
+    """getaddrinfo 补丁背后的自定义解析表。
+
+    写操作持锁复制整个字典后整体替换（copy-on-write），
+    读路径只做一次字典查找，无需加锁。
+    条目过期后采用 stale-while-revalidate：立即返回旧 IP，并在后台线程
+    经 ``ResolvedIpCache`` 重新验证（当前 IP 可用则保留），IP 变化时通过
+    ``apply_resolved_ip`` 切换，使本表、持久化缓存与代理子进程保持一致。
+    """
+
+    def __init__(self):
+        self._entries: dict[tuple[str, int], _CustomDnsEntry] = {}
+        self._lock = threading.Lock()
+        self._refreshing: set[tuple[str, int]] = set()
+
+    def set(self, domain: str, port: int, ip: str, ttl: float = CUSTOM_DNS_TTL):
+        with self._lock:
+            entries = dict(self._entries)
+            entries[(domain, port)] = _CustomDnsEntry(ip, ttl)
+            self._entries = entries
+
+    def remove(self, domain: str, port: int):
+        with self._lock:
+            if (domain, port) in self._entries:
+                entries = dict(self._entries)
+                del entries[(domain, port)]
+                self._entries = entries
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+    def get(self, domain: str, port: int) -> _CustomDnsEntry | None:
+        entry = self._entries.get((domain, port))
+        if entry is not None and entry.expires_at <= time.monotonic():
+            self._schedule_refresh(domain, port, entry)
+        return entry
+
+    def snapshot(self) -> dict[tuple[str, int], str]:
+        return {key: entry.ip for key, entry in self._entries.items()}
+
+    def _schedule_refresh(self, domain: str, port: int, entry: _CustomDnsEntry):
+        key = (domain, port)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(
+            target=self._refresh,
+            args=(domain, port, entry),
+            name="CustomDnsRefresh",
+            daemon=True,
+        ).start()
+
+    def _refresh(self, domain: str, port: int, entry: _CustomDnsEntry):
+        key = (domain, port)
+        try:
+            cache = ResolvedIpCache()
+            try:
+                result = cache.validate(domain, entry.ip)
+            except Exception as e:
+                logger.debug(f"后台重新验证 {domain} 失败: {e}")
+                result = None
+            if self._entries.get(key) is not entry:
+                return  # 期间已被替换或移除（如兼容模式回退时清空）
+            if result is None:
+                self._renew(key, entry, entry.ip, expires_in=CUSTOM_DNS_RETRY)
+                return
+
+            ip, rtt = result
+            cache.put(domain, ip, rtt)
+            cache.save()
+            if ip != entry.ip:
+                logger.info(f"目标服务器 IP 已变化: {domain} {entry.ip} -> {ip}")
+                apply_resolved_ip(domain, ip)
+            # apply_resolved_ip 只更新 443 端口的条目，其余情况在此续期
+            self._renew(key, entry, ip)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _renew(self, key, entry: _CustomDnsEntry, ip: str, expires_in: float | None = None):
+        """条目仍是 *entry* 时替换为 *ip* 的新条目。"""
+        with self._lock:
+            if self._entries.get(key) is not entry:
+                return
+            entries = dict(self._entries)
+            entries[key] = _CustomDnsEntry(ip, entry.ttl, expires_in=expires_in)
+            self._entries = entries
+
+
+_custom_dns = _CustomDnsTable()
+
+
+def add_custom_dns(domain: str, port: int, ip: str, ttl: float = CUSTOM_DNS_TTL):
     """添加自定义 DNS 解析结果，防止 DNS 回环。
 
     在兼容模式下，Hosts 文件或 NRPT 将目标域名指向 127.0.0.1。
@@ -73,48 +229,59 @@ def add_custom_dns(domain: str, port: int, ip: str):
         domain: 域名
         port: 端口
         ip: 真实 IP 地址
+        ttl: 有效期（秒），过期后在后台重新解析
     """
-    key = (domain, port)
-    if _is_ipv4(ip):
-        value = (
-            socket.AddressFamily.AF_INET,
-            socket.SOCK_STREAM,
-            socket.IPPROTO_TCP,
-            "",
-            (ip, port),
-        )
-    else:
-        value = (
-            socket.AddressFamily.AF_INET6,
-            socket.SOCK_STREAM,
-            socket.IPPROTO_TCP,
-            "",
-            (ip, port, 0, 0),
-        )
-    _dns_cache[key] = [value]
+    _custom_dns.set(domain, port, ip, ttl)
     logger.debug(f"添加自定义 DNS: {domain}:{port} -> {ip}")
 
 
 def remove_custom_dns(domain: str, port: int):
     """移除自定义 DNS 解析。"""
-    key = (domain, port)
-    _dns_cache.pop(key, None)
+    _custom_dns.remove(domain, port)
 
 
 def clear_custom_dns():
     """清除所有自定义 DNS 解析。"""
-    _dns_cache.clear()
+    _custom_dns.clear()
 
 
-def _patched_getaddrinfo(*args):
-    """替换的 getaddrinfo 函数。"""
+def _patched_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    """替换的 getaddrinfo 函数。
+
+    命中自定义解析表时按请求的 family / type 构造结果；
+    地址族不匹配时报错而不是回退到系统 DNS（系统 DNS 会解析回 127.0.0.1）。
+    """
+    entry = None
     try:
-        key = args[:2]  # (hostname, port)
-        if key in _dns_cache:
-            return _dns_cache[key]
-    except Exception:
-        pass
-    return _original_getaddrinfo(*args)
+        if isinstance(host, str) and port is not None:
+            entry = _custom_dns.get(host, int(port))
+    except (TypeError, ValueError):
+        entry = None
+    if entry is None:
+        return _original_getaddrinfo(host, port, family, type, proto, flags)
+
+    ip = entry.ip
+    port = int(port)
+    if _is_ipv4(ip):
+        entry_family, sockaddr = socket.AddressFamily.AF_INET, (ip, port)
+    else:
+        entry_family, sockaddr = socket.AddressFamily.AF_INET6, (ip, port, 0, 0)
+    if family not in (0, socket.AF_UNSPEC, entry_family):
+        raise socket.gaierror(socket.EAI_NONAME, f"{host}: no address for requested family")
+
+    results = []
+    for socktype, sockproto in (
+        (socket.SOCK_STREAM, socket.IPPROTO_TCP),
+        (socket.SOCK_DGRAM, socket.IPPROTO_UDP),
+    ):
+        if type not in (0, socktype) or proto not in (0, sockproto):
+            continue
+        results.append((entry_family, socktype, sockproto, "", sockaddr))
+        if type == 0:
+            break  # 未指定类型时与旧行为一致，仅返回 TCP 条目
+    if not results:
+        raise socket.gaierror(socket.EAI_NONAME, f"{host}: no address for requested socket type")
+    return results
 
 
 # 替换 socket.getaddrinfo
@@ -141,33 +308,47 @@ HARDCODED_IPS = {
 }
 
 
-def probe_hardcoded_ip(domain: str, timeout: float = 3.0) -> bool:
-    """探测硬编码 IP 是否可访问。
+def probe_ip_rtt(domain: str, ip: str, timeout: float = 3.0) -> float | None:
+    """探测指定 IP 的 HTTPS 可达性，返回 TCP+TLS 握手耗时（毫秒）。
 
     Args:
-        domain: 域名
+        domain: 域名（用作 SNI）
+        ip: 目标 IP
         timeout: 超时时间（秒）
 
     Returns:
-        是否可访问
+        握手耗时（毫秒），不可访问返回 None
     """
-    ip = HARDCODED_IPS.get(domain)
-    if not ip:
-        return False
-
     try:
         # 尝试建立 HTTPS 连接
         context = ssl.create_default_context()
         context.check_hostname = False
         context.verify_mode = ssl.CERT_NONE
 
+        start = time.perf_counter()
         with socket.create_connection((ip, 443), timeout=timeout) as sock:
             with context.wrap_socket(sock, server_hostname=domain) as ssock:
                 # 连接成功
-                return True
+                return (time.perf_counter() - start) * 1000.0
     except Exception as e:
         logger.debug(f"探测 {domain} ({ip}) 失败: {e}")
+        return None
+
+
+def probe_hardcoded_ip(domain: str, timeout: float = 3.0) -> bool:
+    """探测硬编码 IP 是否可访问。
+
+    Args:
+        domain: 域名
+        timeout: 超时时间（秒）
+
+    Returns:
+        是否可访问
+    """
+    ip = HARDCODED_IPS.get(domain)
+    if not ip:
         return False
+    return probe_ip_rtt(domain, ip, timeout) is not None
 
 
 def resolve_domain_ip(domain: str, use_hardcoded_first: bool = True) -> str | None:
@@ -204,6 +385,152 @@ def resolve_domain_ip(domain: str, use_hardcoded_first: bool = True) -> str | No
     return None
 
 
+# 解析结果持久化缓存
+RESOLVED_IP_CACHE_FILE = "resolved_ips.json"
+RESOLVED_IP_MAX_AGE = 7 * 24 * 3600  # 超过此时长的缓存不再用于启动
+
+
+_resolved_ip_listeners = []
+_resolved_ip_listeners_lock = threading.Lock()
+
+
+def add_resolved_ip_listener(callback) -> None:
+    """注册目标域名 IP 切换的回调 (domain, ip)，如隔离模式下通知代理子进程。"""
+    with _resolved_ip_listeners_lock:
+        _resolved_ip_listeners.append(callback)
+
+
+def remove_resolved_ip_listener(callback) -> None:
+    with _resolved_ip_listeners_lock:
+        try:
+            _resolved_ip_listeners.remove(callback)
+        except ValueError:
+            pass
+
+
+def apply_resolved_ip(domain: str, ip: str) -> None:
+    """将目标域名切换到新的上游 IP。
+
+    更新本进程的 getaddrinfo 表与 ``COMPAT_RESOLVED_IPS``，并通知已注册的
+    监听方，使正在运行的代理（包括隔离模式的子进程）无需重启即可生效。
+    """
+    add_custom_dns(domain, 443, ip)
+    resolved = dict(genv.get("COMPAT_RESOLVED_IPS") or {})
+    resolved[domain] = ip
+    genv.set("COMPAT_RESOLVED_IPS", resolved)
+    with _resolved_ip_listeners_lock:
+        listeners = list(_resolved_ip_listeners)
+    for callback in listeners:
+        try:
+            callback(domain, ip)
+        except Exception as e:
+            logger.warning(f"通知目标服务器 IP 变化失败: {e}")
+
+
+class ResolvedIpCache:
+    """目标域名解析结果的持久化缓存（位于工作目录）。
+
+    兼容模式启动时直接使用上次验证可用的 IP，跳过 TLS 探测与上游 DNS 竞速；
+    随后在后台重新验证，发现 IP 变化时通过 apply_resolved_ip 原地切换。
+    文件格式: {domain: {"ip": str, "rtt_ms": float | None, "updated": float}}
+    """
+
+    def __init__(self, path: str | None = None):
+        if path is None:
+            path = os.path.join(genv.get("FP_WORKDIR", os.getcwd()), RESOLVED_IP_CACHE_FILE)
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict] = self._load()
+
+    def _load(self) -> dict[str, dict]:
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    return {
+                        domain: entry for domain, entry in data.items()
+                        if isinstance(entry, dict) and _is_ipv4(str(entry.get("ip", "")))
+                    }
+        except Exception as e:
+            logger.warning(f"读取解析缓存失败: {e}")
+        return {}
+
+    def get(self, domain: str) -> str | None:
+        """返回未过期的缓存 IP。"""
+        entry = self._entries.get(domain)
+        if not entry:
+            return None
+        if time.time() - entry.get("updated", 0) > RESOLVED_IP_MAX_AGE:
+            return None
+        return entry["ip"]
+
+    def put(self, domain: str, ip: str, rtt_ms: float | None) -> None:
+        with self._lock:
+            self._entries[domain] = {
+                "ip": ip,
+                "rtt_ms": round(rtt_ms, 1) if rtt_ms is not None else None,
+                "updated": time.time(),
+            }
+
+    def save(self) -> None:
+        with self._lock:
+            data = dict(self._entries)
+        try:
+            from secure_write import CACHE, write_json_restricted
+            write_json_restricted(self.path, data, CACHE)
+        except Exception as e:
+            logger.warning(f"保存解析缓存失败: {e}")
+
+    @staticmethod
+    def validate(domain: str, current: str | None) -> tuple[str, float | None] | None:
+        """探测 *current* 是否可访问，不可访问时重新解析。不切换 IP。
+
+        Returns:
+            (ip, rtt_ms)，重新解析失败返回 None
+        """
+        rtt = probe_ip_rtt(domain, current) if current else None
+        if rtt is not None:
+            return current, rtt
+        ip = resolve_domain_ip(domain, True)
+        if not ip:
+            return None
+        return ip, probe_ip_rtt(domain, ip)
+
+    def revalidate(self, domains, on_change=None) -> None:
+        """重新验证各域名的 IP，可访问则刷新 RTT，否则重新解析并切换。
+
+        Args:
+            domains: 需要验证的域名列表
+            on_change: IP 变化时的回调 (domain, ip)
+        """
+        for domain in domains:
+            entry = self._entries.get(domain)
+            current = entry["ip"] if entry else None
+            result = self.validate(domain, current)
+            if result is None:
+                logger.warning(f"后台重新解析 {domain} 失败，保留现有 IP")
+                continue
+            ip, rtt = result
+            if ip != current:
+                logger.info(f"目标服务器 IP 已变化: {domain} {current} -> {ip}")
+                apply_resolved_ip(domain, ip)
+                if on_change:
+                    on_change(domain, ip)
+            self.put(domain, ip, rtt)
+        self.save()
+
+    def revalidate_async(self, domains, on_change=None) -> threading.Thread:
+        thread = threading.Thread(
+            target=self.revalidate,
+            args=(list(domains), on_change),
+            daemon=True,
+            name="ResolvedIpRevalidate",
+        )
+        thread.start()
+        return thread
+
+
 def _build_dns_query(domain: str) -> bytes:
     """构造 DNS A 记录查询报文。"""
     # Header
@@ -268,7 +595,7 @@ def _query_upstream_parallel(domain: str) -> str | None:
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
             sock.settimeout(2.0)
             sock.sendto(query, (dns_server, 53))
-            response, _ = sock.recvfrom(512)
+            response, _ = sock.recvfrom(4096)
             return dns_server, _parse_dns_response(response)
 
     with ThreadPoolExecutor(max_workers=len(UPSTREAM_DNS_SERVERS)) as executor:
@@ -285,127 +612,587 @@ def _query_upstream_parallel(domain: str) -> str | None:
     return None
 
 
+# DNS 记录类型
+_QTYPE_A = 1
+_QTYPE_AAAA = 28
+_QTYPE_OPT = 41
+
+# 本地应答中通告的 EDNS0 UDP 负载上限（DNS Flag Day 2020 推荐值）
+EDNS_UDP_PAYLOAD = 1232
+
+
+def _read_dns_name(buf: memoryview, pos: int) -> tuple[str, int]:
+    """读取 pos 处的域名，支持压缩指针。
+
+    Returns:
+        (小写域名, 域名在原位置之后的偏移)
+    """
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        length = buf[pos]
+        if length == 0:
+            pos += 1
+            break
+        if length >= 192:
+            if jumps > 16:
+                raise ValueError("DNS 压缩指针循环")
+            if end is None:
+                end = pos + 2
+            pos = ((length & 0x3F) << 8) | buf[pos + 1]
+            jumps += 1
+            continue
+        labels.append(bytes(buf[pos + 1:pos + 1 + length]).decode("ascii", errors="ignore"))
+        pos += 1 + length
+    return ".".join(labels).lower(), end if end is not None else pos
+
+
 class DnsPacket:
-    """简单的 DNS 报文解析器。"""
+    """DNS 查询报文解析器。
+
+    基于 ``memoryview`` 解析，不复制原始数据；支持压缩指针、多问题、
+    EDNS0 OPT 记录，可针对 A / AAAA 问题构造本地应答。
+    """
 
     def __init__(self, data: bytes):
         self.raw = data
-        self.id = struct.unpack("!H", data[:2])[0]
-        self.flags = struct.unpack("!H", data[2:4])[0]
-        self.qd_count = struct.unpack("!H", data[4:6])[0]
-        self.an_count = struct.unpack("!H", data[6:8])[0]
-        self.ns_count = struct.unpack("!H", data[8:10])[0]
-        self.ar_count = struct.unpack("!H", data[10:12])[0]
-
-        # 解析查询域名
-        self.qname = ""
-        self.qtype = 0
-        self.qclass = 0
-        self._parse_question(data[12:])
-
-    def _parse_question(self, data: bytes):
-        """解析 DNS 问题部分。"""
-        labels = []
-        i = 0
-        while i < len(data):
-            length = data[i]
-            if length == 0:
-                i += 1
-                break
-            if length >= 192:  # 压缩指针，本实现不处理
-                i += 2
-                break
-            labels.append(data[i + 1: i + 1 + length].decode("ascii", errors="ignore"))
-            i += 1 + length
-
-        self.qname = ".".join(labels).lower()
-        if i + 4 <= len(data):
-            self.qtype = struct.unpack("!H", data[i:i + 2])[0]
-            self.qclass = struct.unpack("!H", data[i + 2:i + 4])[0]
-
-    def build_response(self, ip_address: str) -> bytes:
-        """构建包含单个 A 记录的响应报文。
+        buf = memoryview(data)
+        (
+            self.id,
+            self.flags,
+            self.qd_count,
+            self.an_count,
+            self.ns_count,
+            self.ar_count,
+        ) = struct.unpack_from("!HHHHHH", buf, 0)
+
+        # 问题部分: [(qname, qtype, qclass, 起始偏移)]
+        self.questions: list[tuple[str, int, int, int]] = []
+        pos = 12
+        for _ in range(self.qd_count):
+            start = pos
+            name, pos = _read_dns_name(buf, pos)
+            qtype, qclass = struct.unpack_from("!HH", buf, pos)
+            pos += 4
+            self.questions.append((name, qtype, qclass, start))
+        self.question_end = pos
+
+        if self.questions:
+            self.qname, self.qtype, self.qclass, _ = self.questions[0]
+        else:
+            self.qname, self.qtype, self.qclass = "", 0, 0
 
-        Args:
-            ip_address: 响应的 IP 地址
+        # EDNS0: 在附加段中查找 OPT 记录
+        self.edns_udp_size: int | None = None
+        self.edns_do = False
+        try:
+            self._parse_edns(buf, pos)
+        except Exception:
+            pass
+
+    def _parse_edns(self, buf: memoryview, pos: int):
+        for _ in range(self.an_count + self.ns_count):
+            _, pos = _read_dns_name(buf, pos)
+            rdlength = struct.unpack_from("!H", buf, pos + 8)[0]
+            pos += 10 + rdlength
+        for _ in range(self.ar_count):
+            _, pos = _read_dns_name(buf, pos)
+            rtype, rclass, ttl, rdlength = struct.unpack_from("!HHIH", buf, pos)
+            if rtype == _QTYPE_OPT:
+                self.edns_udp_size = max(512, rclass)
+                self.edns_do = bool(ttl & 0x8000)
+                return
+            pos += 10 + rdlength
 
-        Returns:
-            DNS 响应报文字节
-        """
-        # 响应头
-        response_flags = 0x8180  # QR=1, Opcode=0, AA=1, TC=0, RD=1, RA=1, Z=0, RCODE=0
+    @property
+    def max_udp_size(self) -> int:
+        """客户端可接收的最大 UDP 应答长度。"""
+        return self.edns_udp_size or 512
+
+    def _opt_record(self) -> bytes:
+        """查询带 EDNS0 时在应答中回带 OPT 记录。"""
+        if self.edns_udp_size is None:
+            return b""
+        return b"\x00" + struct.pack("!HHIH", _QTYPE_OPT, EDNS_UDP_PAYLOAD, 0, 0)
+
+    def _build(self, rcode: int, answers: list[bytes], truncated: bool = False) -> bytes:
+        opt = self._opt_record()
+        # QR=1, RD 沿用查询, RA=1
+        response_flags = 0x8080 | (self.flags & 0x0100) | (rcode & 0x000F)
+        if truncated:
+            response_flags |= 0x0200  # TC
         header = struct.pack(
             "!HHHHHH",
             self.id,
             response_flags,
-            1,  # QDCOUNT
-            1,  # ANCOUNT
-            0,  # NSCOUNT
-            0,  # ARCOUNT
+            len(self.questions),  # QDCOUNT
+            len(answers),         # ANCOUNT
+            0,                    # NSCOUNT
+            1 if opt else 0,      # ARCOUNT
         )
-
         # 问题部分：直接复制原始问题
-        question_end = 12
-        i = 12
-        while i < len(self.raw):
-            if self.raw[i] == 0:
-                question_end = i + 5  # 包含 null + QTYPE(2) + QCLASS(2)
-                break
-            i += 1 + self.raw[i]
-        question = self.raw[12:question_end]
-
-        # 回答部分
-        # Name: 使用指针压缩 (0xC00C 指向偏移 12 处的域名)
-        answer = struct.pack(
-            "!HHHLH",
-            0xC00C,  # 压缩指针
-            1,       # TYPE: A
-            1,       # CLASS: IN
-            300,     # TTL: 300 秒
-            4,       # RDLENGTH: 4 字节
-        )
+        question = self.raw[12:self.question_end]
+        return header + question + b"".join(answers) + opt
 
-        # IP 地址
-        ip_parts = [int(x) for x in ip_address.split(".")]
-        answer += struct.pack("!BBBB", *ip_parts)
+    def build_response(self, ip_address: str, ttl: int = 300) -> bytes:
+        """为与 ip_address 地址族匹配的问题（A 或 AAAA）构建应答报文。
 
-        return header + question + answer
+        Args:
+            ip_address: 响应的 IP 地址（IPv4 或 IPv6）
+            ttl: 记录 TTL（秒）
 
-    def build_empty_response(self) -> bytes:
+        Returns:
+            DNS 响应报文字节；没有匹配的问题时等同于空响应
+        """
+        if _is_ipv4(ip_address):
+            rtype, rdata = _QTYPE_A, socket.inet_aton(ip_address)
+        else:
+            rtype, rdata = _QTYPE_AAAA, socket.inet_pton(socket.AF_INET6, ip_address)
+
+        answers = []
+        for _, qtype, qclass, start in self.questions:
+            if qtype == rtype and qclass == 1 and start < 0x4000:
+                # Name: 压缩指针指向问题中的域名
+                answers.append(
+                    struct.pack("!HHHIH", 0xC000 | start, rtype, 1, ttl, len(rdata)) + rdata
+                )
+        return self._build(0, answers)
+
+    def build_empty_response(self, rcode: int = 0) -> bytes:
         """构建无记录的空响应报文（用于阻止非A类查询绕过拦截）。
 
+        Args:
+            rcode: 响应码，0 为 NOERROR，3 为 NXDOMAIN
+
         Returns:
             DNS 空响应报文字节
         """
-        response_flags = 0x8180
-        header = struct.pack(
-            "!HHHHHH",
-            self.id,
-            response_flags,
-            1,  # QDCOUNT
-            0,  # ANCOUNT - 无回答
-            0,  # NSCOUNT
-            0,  # ARCOUNT
+        return self._build(rcode, [])
+
+    def build_truncated_response(self) -> bytes:
+        """应答超出客户端 UDP 上限时返回的 TC 报文，提示客户端改用 TCP 重试。"""
+        return self._build(0, [], truncated=True)
+
+
+def _skip_dns_name(data: bytes, pos: int) -> int:
+    """跳过报文中 pos 处的域名（支持压缩指针），返回其后的偏移。"""
+    while True:
+        length = data[pos]
+        if length == 0:
+            return pos + 1
+        if length >= 192:
+            return pos + 2
+        pos += 1 + length
+
+
+def _scan_dns_ttls(data: bytes) -> tuple[int | None, list[int]]:
+    """扫描应答/授权段，返回 (最小 TTL, 各 TTL 字段偏移)。
+
+    否定应答（无 answer）按 RFC 2308 取授权段 SOA 的 min(TTL, MINIMUM)。
+    附加段（包含 EDNS0 OPT，其 TTL 字段另有含义）不参与计算。
+    """
+    qd_count, an_count, ns_count = struct.unpack("!HHH", data[4:10])
+    pos = 12
+    for _ in range(qd_count):
+        pos = _skip_dns_name(data, pos) + 4
+
+    min_ttl = None
+    offsets = []
+    for index in range(an_count + ns_count):
+        pos = _skip_dns_name(data, pos)
+        rtype, _rclass, ttl, rdlength = struct.unpack("!HHIH", data[pos:pos + 10])
+        offsets.append(pos + 4)
+        if index >= an_count and rtype == 6 and an_count == 0:  # SOA
+            minimum = struct.unpack("!I", data[pos + 10 + rdlength - 4:pos + 10 + rdlength])[0]
+            ttl = min(ttl, minimum)
+        if index < an_count or an_count == 0:
+            min_ttl = ttl if min_ttl is None else min(min_ttl, ttl)
+        pos += 10 + rdlength
+    return min_ttl, offsets
+
+
+class DnsResponseCache:
+    """上游 DNS 应答缓存，按 (qname, qtype, qclass, 是否带 EDNS0, DO 位) 索引。
+
+    - 带 EDNS0 / DO 位的查询，上游应答会附带 OPT 记录 / DNSSEC 记录，
+      不能交给不带的客户端，反之亦然；
+    - 遵循记录 TTL，命中时按剩余时间改写 TTL 并替换事务 ID；
+    - NXDOMAIN / NODATA 按 SOA 做否定缓存；
+    - SERVFAIL、REFUSED 及截断应答不缓存。
+    """
+
+    MAX_ENTRIES = 1024
+    MAX_TTL = 3600
+    NEGATIVE_DEFAULT_TTL = 60
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self._max_entries = max_entries
+        # key -> (expires_at, stored_at, response, ttl_offsets)
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+    @staticmethod
+    def key_for(packet: "DnsPacket") -> tuple[str, int, int, bool, bool]:
+        return (
+            packet.qname, packet.qtype, packet.qclass,
+            packet.edns_udp_size is not None, packet.edns_do,
         )
 
-        question_end = 12
-        i = 12
-        while i < len(self.raw):
-            if self.raw[i] == 0:
-                question_end = i + 5
+    def get(self, packet: "DnsPacket") -> bytes | None:
+        key = self.key_for(packet)
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is None or entry[0] <= now:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+        expires_at, stored_at, response, offsets = entry
+        self._entries.move_to_end(key)
+        self.hits += 1
+        if struct.unpack("!H", response[6:8])[0] == 0:
+            self.negative_hits += 1
+
+        out = bytearray(response)
+        out[0:2] = struct.pack("!H", packet.id)
+        # 保留客户端问题段（大小写随机化等），长度一致时直接替换
+        question = packet.raw[12:packet.question_end]
+        if out[12:packet.question_end].lower() == question.lower():
+            out[12:packet.question_end] = question
+        elapsed = int(now - stored_at)
+        for off in offsets:
+            ttl = struct.unpack("!I", out[off:off + 4])[0]
+            out[off:off + 4] = struct.pack("!I", max(0, ttl - elapsed))
+        return bytes(out)
+
+    def put(self, packet: "DnsPacket", response: bytes):
+        try:
+            flags = struct.unpack("!H", response[2:4])[0]
+            rcode = flags & 0x000F
+            if flags & 0x0200 or rcode not in (0, 3):  # TC / 非 NOERROR、NXDOMAIN
+                return
+            ttl, offsets = _scan_dns_ttls(response)
+        except Exception:
+            return
+
+        an_count = struct.unpack("!H", response[6:8])[0]
+        if ttl is None:
+            if an_count:
+                return
+            ttl = self.NEGATIVE_DEFAULT_TTL
+        ttl = min(ttl, self.MAX_TTL)
+        if ttl <= 0:
+            return
+
+        now = time.monotonic()
+        key = self.key_for(packet)
+        self._entries[key] = (now + ttl, now, response, offsets)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class DomainSuffixMatcher:
+    """按反转标签组织的域名后缀树。
+
+    ``add("example.com", action)`` 同时匹配 example.com 及其所有子域名；
+    查询时沿标签逐级下行，返回最长匹配规则的动作，
+    耗时只与查询域名的标签数有关，与规则数量无关。
+    """
+
+    INTERCEPT = "intercept"
+    PASS = "pass"
+    BLOCK = "block"
+
+    _ACTION = ""  # 节点上存放动作的键（合法标签不可能为空串）
+
+    def __init__(self):
+        self._root: dict = {}
+        self.size = 0
+
+    def add(self, domain: str, action: str):
+        labels = domain.strip().strip(".").lower().split(".")
+        if not labels or labels == [""]:
+            return
+        node = self._root
+        for label in reversed(labels):
+            node = node.setdefault(label, {})
+        if self._ACTION not in node:
+            self.size += 1
+        node[self._ACTION] = action
+
+    def match(self, qname: str) -> str | None:
+        node = self._root
+        action = None
+        for label in reversed(qname.split(".")):
+            node = node.get(label)
+            if node is None:
                 break
-            i += 1 + self.raw[i]
-        question = self.raw[12:question_end]
+            action = node.get(self._ACTION, action)
+        return action
+
+
+class _DnsServerProtocol(asyncio.DatagramProtocol):
+    """LocalDnsServer 的 UDP 监听端。每个数据报在事件循环中处理，不再为其创建线程。"""
 
-        return header + question
+    def __init__(self, server: "LocalDnsServer"):
+        self._server = server
+        self.transport: asyncio.DatagramTransport | None = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self._server._on_udp_query(self.transport, data, addr)
+
+    def error_received(self, exc):
+        logger.debug(f"DNS 服务器接收异常: {exc}")
+
+
+def _dns_question_key(data: bytes) -> bytes | None:
+    """返回报文唯一问题段（小写 qname + qtype + qclass），用于核对上游应答。"""
+    if len(data) < 12 or struct.unpack("!H", data[4:6])[0] != 1:
+        return None
+    pos = 12
+    try:
+        while data[pos]:
+            if data[pos] >= 192:
+                return None  # 问题段是报文中的第一个域名，不会被压缩
+            pos += 1 + data[pos]
+    except IndexError:
+        return None
+    end = pos + 5
+    if end > len(data):
+        return None
+    return data[12:pos].lower() + data[pos:end]
+
+
+class _UpstreamDnsProtocol(asyncio.DatagramProtocol):
+    """到单个上游 DNS 服务器的常驻 UDP 连接，按事务 ID 分发应答。
+
+    常驻 socket 的源端口固定，只凭 16 位事务 ID 匹配过于容易被伪造，
+    因此应答的问题段也必须与在途查询一致，否则丢弃并继续等待。
+    """
+
+    def __init__(self, upstream: "_UpstreamServer"):
+        self._upstream = upstream
+
+    def datagram_received(self, data, addr):
+        if len(data) < 12:
+            return
+        txid = struct.unpack("!H", data[:2])[0]
+        entry = self._upstream.pending.get(txid)
+        if entry is None:
+            return
+        future, question = entry
+        if _dns_question_key(data) != question:
+            return
+        del self._upstream.pending[txid]
+        if not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc):
+        # ICMP 不可达等：让当前所有等待中的查询立即失败
+        self._upstream.fail_pending(exc)
+
+    def connection_lost(self, exc):
+        self._upstream.transport = None
+        self._upstream.fail_pending(exc or ConnectionError("upstream socket closed"))
+
+
+class _UpstreamServer:
+    """单个上游 DNS 服务器的连接与健康状态。"""
+
+    RTT_ALPHA = 0.3
+
+    def __init__(self, address: str):
+        self.address = address
+        self.transport: asyncio.DatagramTransport | None = None
+        self.pending: dict[int, tuple[asyncio.Future, bytes | None]] = {}
+        self.rtt: float | None = None  # 滑动平均 RTT（秒）
+        self.consecutive_failures = 0
+        self.total_queries = 0
+        self.total_failures = 0
+        self.down_until = 0.0
+
+    def fail_pending(self, exc):
+        pending, self.pending = self.pending, {}
+        for future, _ in pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+    def record_success(self, rtt: float):
+        self.total_queries += 1
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.rtt = rtt if self.rtt is None else (
+            self.RTT_ALPHA * rtt + (1 - self.RTT_ALPHA) * self.rtt
+        )
+
+    def record_failure(self, cooldown: float, max_failures: int):
+        self.total_queries += 1
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= max_failures:
+            self.down_until = time.monotonic() + cooldown
+
+    def score(self, timeout: float) -> float:
+        """越小越好：未测量过的服务器按半个超时估计，每次连续失败再加一个超时。"""
+        rtt = self.rtt if self.rtt is not None else timeout / 2
+        return rtt + self.consecutive_failures * timeout
+
+    def get_stats(self) -> dict:
+        return {
+            "rtt_ms": round(self.rtt * 1000, 2) if self.rtt is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            "queries": self.total_queries,
+            "failures": self.total_failures,
+            "down": self.down_until > time.monotonic(),
+        }
+
+
+class UpstreamDnsPool:
+    """并发竞速的上游 DNS 转发器。
+
+    每次查询同时发往得分最好的 ``race_width`` 个上游，取最先返回的应答；
+    连续失败的服务器会被暂时下线，冷却后再参与竞速。
+    各上游使用常驻 socket，必须在同一事件循环内使用。
+    """
+
+    def __init__(
+        self,
+        servers: list[str],
+        *,
+        race_width: int = 2,
+        timeout: float = 2.0,
+        max_failures: int = 3,
+        cooldown: float = 30.0,
+    ):
+        self.servers = [_UpstreamServer(addr) for addr in servers]
+        self.race_width = race_width
+        self.timeout = timeout
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+
+    def _ranked(self) -> list[_UpstreamServer]:
+        now = time.monotonic()
+        alive = [srv for srv in self.servers if srv.down_until <= now]
+        if not alive:
+            alive = list(self.servers)
+        return sorted(alive, key=lambda srv: srv.score(self.timeout))
+
+    async def _ensure_transport(self, srv: _UpstreamServer):
+        if srv.transport is None or srv.transport.is_closing():
+            loop = asyncio.get_running_loop()
+            srv.transport, _ = await loop.create_datagram_endpoint(
+                lambda: _UpstreamDnsProtocol(srv),
+                remote_addr=(srv.address, 53),
+            )
+        return srv.transport
+
+    async def _query_one(self, srv: _UpstreamServer, data: bytes) -> bytes:
+        transport = await self._ensure_transport(srv)
+        loop = asyncio.get_running_loop()
+        # 共用 socket：为每个在途查询分配独立且不可预测的事务 ID
+        txid = secrets.randbits(16)
+        while txid in srv.pending:
+            txid = secrets.randbits(16)
+        future = loop.create_future()
+        srv.pending[txid] = (future, _dns_question_key(data))
+        started = loop.time()
+        try:
+            transport.sendto(struct.pack("!H", txid) + data[2:])
+            response = await asyncio.wait_for(future, self.timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            srv.record_failure(self.cooldown, self.max_failures)
+            raise
+        finally:
+            srv.pending.pop(txid, None)
+        srv.record_success(loop.time() - started)
+        return data[:2] + response[2:]
+
+    async def _race(self, servers: list[_UpstreamServer], data: bytes) -> bytes | None:
+        tasks = [asyncio.ensure_future(self._query_one(srv, data)) for srv in servers]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    return await next_done
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    continue
+            return None
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def query(self, data: bytes) -> bytes | None:
+        ranked = self._ranked()
+        response = await self._race(ranked[:self.race_width], data)
+        if response is None and len(ranked) > self.race_width:
+            response = await self._race(ranked[self.race_width:], data)
+        return response
+
+    async def query_tcp(self, data: bytes) -> bytes | None:
+        """通过 TCP 向上游查询（UDP 应答被截断时使用），按得分依次尝试。"""
+        for srv in self._ranked():
+            writer = None
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(srv.address, 53), self.timeout
+                )
+                writer.write(struct.pack("!H", len(data)) + data)
+                length = struct.unpack("!H", await asyncio.wait_for(reader.readexactly(2), self.timeout))[0]
+                return await asyncio.wait_for(reader.readexactly(length), self.timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                continue
+            finally:
+                if writer is not None:
+                    writer.close()
+        return None
+
+    def close(self):
+        for srv in self.servers:
+            if srv.transport is not None:
+                srv.transport.close()
+                srv.transport = None
+
+    def get_stats(self) -> dict:
+        return {srv.address: srv.get_stats() for srv in self.servers}
 
 
 class LocalDnsServer:
     """本地 DNS 服务器。
 
     对指定域名返回固定 IP，其他请求转发到上游 DNS 服务器。
+    运行在独立线程的 asyncio 事件循环上，所有查询都以事件驱动方式处理。
     """
 
+    UPSTREAM_TIMEOUT = 2.0
+    TCP_IDLE_TIMEOUT = 10.0
+
     def __init__(
         self,
         intercept_domains: set[str],
@@ -421,14 +1208,67 @@ class LocalDnsServer:
             listen_port: 监听端口
         """
         self.intercept_domains = {d.lower() for d in intercept_domains}
+        self._matcher = DomainSuffixMatcher()
+        self._rules_version = None
         self.target_ip = target_ip
         self.listen_host = listen_host
         self.listen_port = listen_port
 
         self._socket: socket.socket | None = None
+        self._tcp_socket: socket.socket | None = None
         self._thread: threading.Thread | None = None
-        self._stop_event = threading.Event()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._transport: asyncio.DatagramTransport | None = None
+        self._tcp_server: asyncio.AbstractServer | None = None
+        # 事件循环只弱引用任务，在途的 UDP 转发任务需在此保留强引用
+        self._udp_tasks: set[asyncio.Task] = set()
         self._running = False
+        self.cache = DnsResponseCache()
+        self.upstreams = UpstreamDnsPool(
+            UPSTREAM_DNS_SERVERS, timeout=self.UPSTREAM_TIMEOUT
+        )
+        self.reload_rules()
+
+    def reload_rules(self):
+        """根据拦截域名与 CloudRes 下发的列表重建匹配规则。
+
+        优先级（最长后缀优先，同一域名后写入者覆盖）：
+        屏蔽 (dns_block_domains) > 放行 (no_proxy_domains) > 拦截。
+        新规则构建完成后整体替换，查询线程无需加锁。
+        """
+        matcher = DomainSuffixMatcher()
+        for domain in self.intercept_domains:
+            matcher.add(domain, DomainSuffixMatcher.INTERCEPT)
+
+        version = None
+        try:
+            from cloudRes import CloudRes
+            cloudres = CloudRes._instance
+            if cloudres is None or not cloudres._initialized:
+                raise RuntimeError("CloudRes 尚未初始化")
+            version = cloudres.get_last_modified()
+            for domain in cloudres.get_no_proxy_domains():
+                matcher.add(domain, DomainSuffixMatcher.PASS)
+            for domain in cloudres.get_dns_block_domains():
+                matcher.add(domain, DomainSuffixMatcher.BLOCK)
+        except Exception as e:
+            logger.debug(f"加载云端 DNS 规则失败: {e}")
+
+        self._matcher = matcher
+        self._rules_version = version
+        self.cache.clear()
+
+    def _maybe_reload_rules(self):
+        """云端配置更新后自动重建规则，无需重启服务器。"""
+        try:
+            from cloudRes import CloudRes
+            cloudres = CloudRes._instance
+            if cloudres is None or not cloudres._initialized:
+                return
+            if cloudres.get_last_modified() != self._rules_version:
+                self.reload_rules()
+        except Exception:
+            pass
 
     def start(self) -> bool:
         """启动 DNS 服务器。
@@ -444,7 +1284,7 @@ class LocalDnsServer:
             self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self._socket.bind((self.listen_host, self.listen_port))
-            self._socket.settimeout(1.0)  # 1 秒超时，用于检查停止事件
+            self._socket.setblocking(False)
         except OSError as e:
             logger.error(f"DNS 服务器绑定端口失败: {e}")
             if self._socket:
@@ -452,100 +1292,247 @@ class LocalDnsServer:
                 self._socket = None
             return False
 
-        self._stop_event.clear()
+        # 同端口 TCP 监听：服务截断/超长应答。绑定失败时仅提供 UDP 服务
+        try:
+            self._tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._tcp_socket.bind((self.listen_host, self.listen_port))
+            self._tcp_socket.listen(64)
+            self._tcp_socket.setblocking(False)
+        except OSError as e:
+            logger.warning(f"DNS 服务器 TCP 端口绑定失败，仅启用 UDP: {e}")
+            if self._tcp_socket:
+                self._tcp_socket.close()
+                self._tcp_socket = None
+
+        # 与 MitmProxyManager 一致，Windows 下使用 SelectorEventLoop
+        if sys.platform == "win32":
+            self._loop = asyncio.SelectorEventLoop()
+        else:
+            self._loop = asyncio.new_event_loop()
+
+        # 事件循环线程挂载完监听端后给出结果；挂载失败或超时视为启动失败
+        ready: Future = Future()
         self._thread = threading.Thread(
             target=self._server_loop,
+            args=(ready,),
             name="LocalDnsServer",
             daemon=True,
         )
         self._thread.start()
+        try:
+            ready.result(timeout=3.0)
+        except Exception as e:
+            logger.error(f"DNS 服务器启动失败: {e!r}")
+            self._shutdown()
+            return False
         self._running = True
         logger.debug(f"本地 DNS 服务器已启动: {self.listen_host}:{self.listen_port}")
         return True
 
     def stop(self):
-        """停止 DNS 服务器。"""
+        """停止 DNS 服务器。事件循环被直接唤醒，无需等待轮询超时。"""
         if not self._running:
             return
+        self._shutdown()
+        self._running = False
+        logger.debug("本地 DNS 服务器已停止")
 
-        self._stop_event.set()
+    def _shutdown(self):
+        """停止事件循环线程并关闭监听 socket。"""
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(loop.stop)
+            except RuntimeError:
+                pass
         if self._thread and self._thread.is_alive():
             self._thread.join(timeout=3.0)
 
-        if self._socket:
-            try:
-                self._socket.close()
-            except Exception:
-                pass
-            self._socket = None
+        for sock in (self._socket, self._tcp_socket):
+            if sock:
+                try:
+                    sock.close()
+                except Exception:
+                    pass
+        self._socket = None
+        self._tcp_socket = None
 
-        self._running = False
-        logger.debug("本地 DNS 服务器已停止")
+    def _server_loop(self, ready: Future):
+        """线程入口：在事件循环上挂载 UDP/TCP 监听端并运行直到 stop()。
 
-    def _server_loop(self):
-        """服务器主循环。"""
-        while not self._stop_event.is_set():
+        两个监听端都挂载完成后 ``ready`` 得到结果；UDP 监听端挂载失败时
+        ``ready`` 得到该异常，线程随即退出。
+        """
+        loop = self._loop
+        asyncio.set_event_loop(loop)
+        try:
+            self._transport, _ = loop.run_until_complete(
+                loop.create_datagram_endpoint(
+                    lambda: _DnsServerProtocol(self), sock=self._socket
+                )
+            )
+            if self._tcp_socket is not None:
+                try:
+                    self._tcp_server = loop.run_until_complete(
+                        asyncio.start_server(self._handle_tcp_client, sock=self._tcp_socket)
+                    )
+                except OSError as e:
+                    # 与 start() 中 TCP 绑定失败的处理一致：仅提供 UDP 服务
+                    logger.warning(f"DNS 服务器 TCP 监听失败，仅启用 UDP: {e}")
+                    self._tcp_socket.close()
+                    self._tcp_socket = None
+            ready.set_result(True)
+            loop.run_forever()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            logger.debug(f"DNS 服务器事件循环异常: {e}")
+        finally:
+            if not ready.done():
+                ready.set_exception(RuntimeError("DNS 服务器事件循环已退出"))
             try:
-                data, addr = self._socket.recvfrom(512)
-            except socket.timeout:
-                continue
-            except Exception as e:
-                if not self._stop_event.is_set():
-                    logger.debug(f"DNS 服务器接收异常: {e}")
-                continue
+                if self._transport is not None:
+                    self._transport.close()
+                    self._transport = None
+                if self._tcp_server is not None:
+                    self._tcp_server.close()
+                    self._tcp_server = None
+                self.upstreams.close()
+                pending = asyncio.all_tasks(loop)
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    loop.run_until_complete(
+                        asyncio.gather(*pending, return_exceptions=True)
+                    )
+            except Exception:
+                pass
+            loop.close()
+
+    def _answer_locally(self, packet: "DnsPacket") -> bytes | None:
+        """无需访问上游即可给出的应答：拦截/屏蔽规则或转发缓存命中。"""
+        response = self._build_intercept_response(packet)
+        if response is None:
+            response = self.cache.get(packet)
+        return response
+
+    async def _resolve(self, packet: "DnsPacket", *, tcp: bool) -> bytes | None:
+        """UDP 与 TCP 共用的查询流程。"""
+        response = self._answer_locally(packet)
+        if response is not None:
+            return response
+
+        response = await self._forward_to_upstream(packet.raw)
+        if tcp and response is not None and struct.unpack("!H", response[2:4])[0] & 0x0200:
+            # 上游 UDP 应答被截断，TCP 客户端需要完整应答
+            response = await self.upstreams.query_tcp(packet.raw) or response
+        if response is not None:
+            self.cache.put(packet, response)
+        return response
 
-            # 在独立线程中处理请求（避免阻塞主循环）
-            threading.Thread(
-                target=self._handle_request,
-                args=(data, addr),
-                daemon=True,
-            ).start()
+    @staticmethod
+    def _fit_udp(packet: "DnsPacket", response: bytes) -> bytes:
+        if len(response) > packet.max_udp_size:
+            return packet.build_truncated_response()
+        return response
 
-    def _handle_request(self, data: bytes, addr: tuple):
-        """处理单个 DNS 请求。"""
+    def _on_udp_query(self, transport: asyncio.DatagramTransport, data: bytes, addr: tuple):
+        """UDP 数据报回调：本地可答的直接应答，其余转发任务挂到事件循环上。"""
         try:
             packet = DnsPacket(data)
+        except Exception as e:
+            logger.debug(f"DNS 请求解析异常: {e}")
+            return
 
-            # 检查是否需要拦截
-            should_intercept = False
-            for domain in self.intercept_domains:
-                if packet.qname == domain or packet.qname.endswith("." + domain):
-                    should_intercept = True
-                    break
-
-            if should_intercept:
-                if packet.qtype == 1:  # A 记录
-                    response = packet.build_response(self.target_ip)
-                else:
-                    # 拦截域名的非A查询（AAAA等）：返回空响应，防止绕过
-                    response = packet.build_empty_response()
-            else:
-                # 转发到上游 DNS
-                response = self._forward_to_upstream(data)
-                if response is None:
-                    return
+        response = self._answer_locally(packet)
+        if response is not None:
+            transport.sendto(self._fit_udp(packet, response), addr)
+            return
 
-            self._socket.sendto(response, addr)
+        task = self._loop.create_task(self._forward_and_reply(transport, packet, addr))
+        self._udp_tasks.add(task)
+        task.add_done_callback(self._udp_tasks.discard)
 
+    async def _forward_and_reply(self, transport, packet: "DnsPacket", addr: tuple):
+        try:
+            response = await self._resolve(packet, tcp=False)
+            if response is not None and not transport.is_closing():
+                transport.sendto(self._fit_udp(packet, response), addr)
         except Exception as e:
             logger.debug(f"DNS 请求处理异常: {e}")
 
-    def _forward_to_upstream(self, data: bytes) -> bytes | None:
-        """将 DNS 请求转发到上游服务器。
+    async def _handle_tcp_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """TCP 连接：按 2 字节长度前缀读取查询，支持同一连接上的流水线查询，
+        应答按完成顺序写回（以事务 ID 区分）。"""
+        tasks = set()
 
-        使用预配置的 IP 地址直接连接，避免 NRPT 回环。
-        """
-        for dns_server in UPSTREAM_DNS_SERVERS:
+        async def _answer(packet: DnsPacket):
             try:
-                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-                    sock.settimeout(2.0)
-                    sock.sendto(data, (dns_server, 53))
-                    response, _ = sock.recvfrom(512)
-                    return response
-            except Exception:
-                continue
+                response = await self._resolve(packet, tcp=True)
+                if response is not None and not writer.is_closing():
+                    writer.write(struct.pack("!H", len(response)) + response)
+            except Exception as e:
+                logger.debug(f"DNS TCP 请求处理异常: {e}")
 
-        return None
+        try:
+            while True:
+                header = await asyncio.wait_for(reader.readexactly(2), self.TCP_IDLE_TIMEOUT)
+                length = struct.unpack("!H", header)[0]
+                data = await asyncio.wait_for(reader.readexactly(length), self.TCP_IDLE_TIMEOUT)
+                try:
+                    packet = DnsPacket(data)
+                except Exception as e:
+                    logger.debug(f"DNS 请求解析异常: {e}")
+                    continue
+                task = asyncio.ensure_future(_answer(packet))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # 服务器停止：不再等待在途查询，也不向 start_server 抛出取消异常
+            for task in tasks:
+                task.cancel()
+            tasks.clear()
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+    def _build_intercept_response(self, packet: "DnsPacket") -> bytes | None:
+        """拦截/屏蔽域名返回本地应答；需要转发的域名返回 None。"""
+        self._maybe_reload_rules()
+        action = self._matcher.match(packet.qname)
+        if action == DomainSuffixMatcher.BLOCK:
+            return packet.build_empty_response(rcode=3)
+        if action != DomainSuffixMatcher.INTERCEPT:
+            return None
+        # 与 target_ip 地址族匹配的问题（A 或 AAAA）给出应答，
+        # 其余类型返回空响应，防止绕过
+        return packet.build_response(self.target_ip)
+
+    async def _forward_to_upstream(self, data: bytes) -> bytes | None:
+        """将 DNS 请求转发到上游服务器。
+
+        使用预配置的 IP 地址直接连接，避免 NRPT 回环；
+        两个最健康的上游并发竞速，取最先返回的应答。
+        """
+        try:
+            return await self.upstreams.query(data)
+        except Exception as e:
+            logger.debug(f"上游 DNS 转发失败: {e}")
+            return None
+
+    def get_stats(self) -> dict:
+        """诊断信息：转发缓存命中情况与各上游健康状态。"""
+        return {
+            "running": self._running,
+            "tcp": self._tcp_server is not None,
+            "rules": self._matcher.size,
+            "cache": self.cache.get_stats(),
+            "upstreams": self.upstreams.get_stats(),
+        }
 
     @property
     def is_running(self) -> bool:
@@ -901,19 +1888,32 @@ class MitmProxyManager:
     - "compat": Reverse proxy on port 443 for DNS-based traffic interception
     """
 
-    def __init__(self, *, addon, port=DEFAULT_PROXY_PORT, mode="regular"):
+    def __init__(self, *, addon, port=DEFAULT_PROXY_PORT, mode="regular", isolated=None):
         """
         Args:
             addon: The mitmproxy addon to use
             port: Proxy listen port (used in regular mode)
             mode: "regular" for HTTP proxy, "compat" for reverse proxy on 443
+            isolated: Run mitmproxy in a child process; defaults to the
+                ``MITM_PROXY_ISOLATED`` genv setting
         """
         self.addon = addon
         self.port = port
         self.mode = mode
+        if isolated is None:
+            isolated = bool(genv.get("MITM_PROXY_ISOLATED", False))
+        self.isolated = isolated
+        self._process = None
+        self._conn = None
+        self._send_lock = threading.Lock()
+        self._queries: dict[int, object] = {}
+        self._query_seq = 0
         self._thread: threading.Thread | None = None
-        self._master = None
         self._loop: asyncio.AbstractEventLoop | None = None
+        self._master = None
+        self._upstream_profile = "default"
+        self._rotate_stop = threading.Event()
+        self._rotate_thread: threading.Thread | None = None
 
     # ------------------------------------------------------------------
     # Port selection
@@ -964,6 +1964,124 @@ class MitmProxyManager:
         """Return the mitmproxy config directory used for certs."""
         return os.path.join(genv.get("FP_WORKDIR", ""), "mitmproxy-conf")
 
+    # ------------------------------------------------------------------
+    # Leaf certificates
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _leaf_cert_domains() -> list[str]:
+        return [
+            genv.get("DOMAIN_TARGET", "service.mkey.163.com"),
+            genv.get("DOMAIN_TARGET_OVERSEA", "sdk-os.mpsdk.easebar.com"),
+        ]
+
+    @classmethod
+    def _leaf_cert_path(cls, domain: str) -> str:
+        return os.path.join(cls.get_confdir(), f"leaf-{domain}.pem")
+
+    @staticmethod
+    def _load_ca():
+        """读取 confdir 中 mitmproxy 使用的 CA (私钥+证书)。"""
+        from cryptography import x509
+        from cryptography.hazmat.primitives import serialization
+
+        ca_pem = os.path.join(MitmProxyManager.get_confdir(), "mitmproxy-ca.pem")
+        with open(ca_pem, "rb") as f:
+            data = f.read()
+        ca_key = serialization.load_pem_private_key(data, password=None)
+        ca_cert = x509.load_pem_x509_certificate(data)
+        return ca_key, ca_cert
+
+    @staticmethod
+    def _ca_expired(ca_cert) -> bool:
+        return ca_cert.not_valid_after_utc.timestamp() <= time.time()
+
+    @staticmethod
+    def _leaf_cert_valid(path: str, ca_cert) -> bool:
+        """CA 未过期，叶子证书存在、由当前 CA 签发且距过期超过轮换阈值。"""
+        from cryptography import x509
+
+        if MitmProxyManager._ca_expired(ca_cert):
+            return False
+        try:
+            with open(path, "rb") as f:
+                leaf = x509.load_pem_x509_certificate(f.read())
+            leaf.verify_directly_issued_by(ca_cert)
+        except Exception:
+            return False
+        # 用同一私钥与名称重新生成的 CA 同样能通过签名校验；
+        # 生效时间早于当前 CA 的叶子证书是旧 CA 签发的
+        if leaf.not_valid_before_utc < ca_cert.not_valid_before_utc:
+            return False
+        remaining = leaf.not_valid_after_utc.timestamp() - time.time()
+        return remaining > LEAF_CERT_ROTATE_BEFORE
+
+    def ensure_leaf_certs(self) -> tuple[dict[str, str], list[str]]:
+        """为目标域名准备叶子证书，缺失/过期/CA 变更时重新签发。
+
+        Returns:
+            ({domain: pem_path}, 本次重新签发的域名列表)
+        """
+        from cryptography.hazmat.primitives import serialization
+        from certmgr import certmgr
+        from secure_write import write_file_restricted
+
+        rotated = []
+        try:
+            ca_key, ca_cert = self._load_ca()
+        except Exception as e:
+            logger.warning(f"读取 CA 失败，叶子证书将由 mitmproxy 按需生成: {e}")
+            return {}, rotated
+        if self._ca_expired(ca_cert):
+            logger.warning(f"CA 已于 {ca_cert.not_valid_after_utc} 过期，不再使用预生成的叶子证书")
+            return {}, rotated
+
+        mgr = None
+        result = {}
+        for domain in self._leaf_cert_domains():
+            path = self._leaf_cert_path(domain)
+            if not self._leaf_cert_valid(path, ca_cert):
+                try:
+                    if mgr is None:
+                        mgr = certmgr()
+                    key = mgr.generate_private_key(bits=2048)
+                    cert = mgr.generate_cert([domain], key, ca_cert, ca_key)
+                    # mitmproxy 的 certs 选项要求私钥与证书位于同一 PEM 文件
+                    write_file_restricted(path, key.private_bytes(
+                        serialization.Encoding.PEM,
+                        serialization.PrivateFormat.TraditionalOpenSSL,
+                        serialization.NoEncryption(),
+                    ) + cert.public_bytes(serialization.Encoding.PEM))
+                    rotated.append(domain)
+                    logger.debug(f"已签发叶子证书: {domain}")
+                except Exception as e:
+                    logger.warning(f"签发 {domain} 叶子证书失败: {e}")
+                    continue
+            result[domain] = path
+        return result, rotated
+
+    def _rotate_leaf_certs_loop(self):
+        while not self._rotate_stop.wait(LEAF_CERT_CHECK_INTERVAL):
+            certs, rotated = self.ensure_leaf_certs()
+            if rotated and self._loop and self._master:
+                self._loop.call_soon_threadsafe(self._reload_leaf_certs, {
+                    d: certs[d] for d in rotated
+                })
+
+    def _reload_leaf_certs(self, certs: dict[str, str]):
+        """在代理事件循环中将新证书注册到 mitmproxy 证书库。"""
+        from pathlib import Path
+
+        tlsconfig = self._master.addons.get("tlsconfig")
+        if tlsconfig is None:
+            return
+        for domain, path in certs.items():
+            try:
+                tlsconfig.certstore.add_cert_file(domain, Path(path))
+                logger.info(f"叶子证书已轮换: {domain}")
+            except Exception as e:
+                logger.warning(f"加载轮换后的 {domain} 叶子证书失败: {e}")
+
     # ------------------------------------------------------------------
     # Proxy lifecycle
     # ------------------------------------------------------------------
@@ -976,16 +2094,32 @@ class MitmProxyManager:
 
         self._resolve_port()
 
+        if self.isolated:
+            self._start_isolated()
+            mode_desc = "兼容模式 (反向代理)" if self.mode == "compat" else "常规代理模式"
+            logger.info(f"mitmproxy {mode_desc}已在独立进程中启动，监听端口 {self.port}")
+            return
+
         self._thread = threading.Thread(
             target=self._run_proxy,
             name="mitmproxy-worker",
             daemon=True,
         )
         self._thread.start()
+        self._start_cert_rotation()
 
         mode_desc = "兼容模式 (反向代理)" if self.mode == "compat" else "常规代理模式"
         logger.info(f"mitmproxy {mode_desc}已启动，监听端口 {self.port}")
 
+    def _start_cert_rotation(self):
+        self._rotate_stop.clear()
+        self._rotate_thread = threading.Thread(
+            target=self._rotate_leaf_certs_loop,
+            name="mitmproxy-cert-rotate",
+            daemon=True,
+        )
+        self._rotate_thread.start()
+
     def _run_proxy(self):
         """Thread target: create an asyncio event loop and run mitmproxy."""
         # Windows ProactorEventLoop 在多线程环境下 accept() 存在已知 bug
@@ -1051,16 +2185,77 @@ class MitmProxyManager:
                 ssl_insecure=False,  # DO verify upstream certs
             )
 
+        # 预生成的叶子证书：首个请求无需现场签发
+        leaf_certs, _ = self.ensure_leaf_certs()
+        if leaf_certs:
+            opts.update_known(certs=[f"{d}={p}" for d, p in leaf_certs.items()])
+
         self._master = DumpMaster(opts, with_dumper=False)
+        # connection_strategy 等选项由内置 addon 注册，需在 DumpMaster 创建后再应用
+        self._apply_upstream_profile(opts)
         self._master.addons.add(self.addon)
         if self.mode == "compat":
             # 兼容模式添加特殊的请求重写 addon
             self._master.addons.add(_CompatModeAddon())
-        self._master.addons.add(_ResponseLogAddon())
+        self._master.addons.add(_FlowTimingAddon(self._leaf_cert_domains()))
         await self._master.run()
 
+    @staticmethod
+    def get_upstream_options() -> tuple[str, dict]:
+        """返回 (策略名, 选项)，选项为所选策略叠加 MITM_UPSTREAM_OPTIONS 的结果。"""
+        profile = genv.get("MITM_UPSTREAM_PROFILE", DEFAULT_UPSTREAM_PROFILE)
+        if profile not in UPSTREAM_PROFILES:
+            logger.warning(f"未知的上游连接策略 {profile}，使用 {DEFAULT_UPSTREAM_PROFILE}")
+            profile = DEFAULT_UPSTREAM_PROFILE
+        options = dict(UPSTREAM_PROFILES[profile])
+        overrides = genv.get("MITM_UPSTREAM_OPTIONS", None)
+        if isinstance(overrides, dict):
+            options.update(overrides)
+        return profile, options
+
+    def _apply_upstream_profile(self, opts):
+        profile, options = self.get_upstream_options()
+        if not options:
+            return
+        try:
+            unknown = opts.update_known(**options)
+        except Exception as e:
+            logger.warning(f"应用上游连接策略 {profile} 失败: {e}")
+            return
+        if unknown:
+            logger.debug(f"当前 mitmproxy 不支持以下选项，已忽略: {sorted(unknown)}")
+        self._upstream_profile = profile
+
+    def get_metrics(self) -> dict:
+        """Return flow latency histograms plus the addon's rewrite counters."""
+        addon_stats = {}
+        get_stats = getattr(self.addon, "get_stats", None)
+        if get_stats:
+            try:
+                addon_stats = get_stats()
+            except Exception:
+                pass
+        if self._process is not None:
+            # 隔离模式：flow 统计在子进程中，addon 计数在本进程
+            metrics = self._query_child("metrics") or {"mode": self.mode}
+            metrics["isolated"] = True
+            metrics["bridge"] = metrics.pop("addon", {})
+            metrics["addon"] = addon_stats
+            return metrics
+        return {
+            "mode": self.mode,
+            "upstream_profile": self._upstream_profile,
+            "flows": flow_metrics.snapshot(),
+            "connections": flow_metrics.counters(),
+            "addon": addon_stats,
+        }
+
     def stop(self):
         """Shut down the mitmproxy proxy."""
+        self._rotate_stop.set()
+        if self._process is not None:
+            self._stop_isolated()
+            return
         if self._master:
             try:
                 self._master.shutdown()
@@ -1074,6 +2269,138 @@ class MitmProxyManager:
             except Exception:
                 pass
 
+    # ------------------------------------------------------------------
+    # Isolated mode (parent side)
+    # ------------------------------------------------------------------
+
+    def _start_isolated(self):
+        """启动代理子进程，并在本进程运行 addon 钩子的事件循环与 IPC 读取线程。"""
+        import multiprocessing
+
+        ctx = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe(duplex=True)
+        self._conn = parent_conn
+        # 先订阅 IP 切换再复制 genv，确保子进程不会错过两者之间的变化
+        add_resolved_ip_listener(self._send_resolved_ip)
+        env = {}
+        for key in _ISOLATED_GENV_KEYS:
+            value = genv.get(key)
+            if value is not None:
+                env[key] = value
+
+        self._process = ctx.Process(
+            target=_isolated_proxy_main,
+            args=(child_conn, self.port, self.mode, env),
+            name="mitmproxy-isolated",
+            daemon=True,
+        )
+        self._process.start()
+        child_conn.close()
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever,
+            name="mitmproxy-addon-host",
+            daemon=True,
+        )
+        self._thread.start()
+        threading.Thread(
+            target=self._ipc_reader,
+            name="mitmproxy-ipc",
+            daemon=True,
+        ).start()
+
+    def _ipc_send(self, msg) -> bool:
+        try:
+            with self._send_lock:
+                self._conn.send(msg)
+            return True
+        except (OSError, ValueError, EOFError) as e:
+            logger.debug(f"向代理子进程发送消息失败: {e}")
+            return False
+
+    def _send_resolved_ip(self, domain: str, ip: str):
+        """后台重新验证切换了目标 IP 时，同步到子进程的 getaddrinfo 表。"""
+        self._ipc_send(("dns", domain, ip))
+
+    def _ipc_reader(self):
+        """读取子进程消息：钩子调用交给 addon 事件循环，查询结果唤醒等待方。"""
+        conn = self._conn
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                break
+            kind = msg[0]
+            if kind == "hook":
+                _, call_id, hook, state = msg
+                asyncio.run_coroutine_threadsafe(
+                    self._dispatch_hook(call_id, hook, state), self._loop
+                )
+            elif kind == "result":
+                _, query_id, data = msg
+                waiter = self._queries.pop(query_id, None)
+                if waiter is not None:
+                    waiter.set_result(data)
+        if self._process is not None:
+            logger.warning("代理子进程的 IPC 连接已断开")
+
+    async def _dispatch_hook(self, call_id: int, hook: str, state: dict):
+        """在本进程中对重建的 flow 执行 addon 钩子，并把修改后的状态发回子进程。"""
+        from mitmproxy import http
+
+        result = None
+        try:
+            flow = http.HTTPFlow.from_state(state)
+            ret = getattr(self.addon, hook)(flow)
+            if asyncio.iscoroutine(ret):
+                await ret
+            result = (
+                flow.request.get_state(),
+                flow.response.get_state() if flow.response else None,
+                flow.metadata,
+            )
+        except Exception:
+            logger.exception(f"隔离模式下执行 {hook} 钩子失败")
+        self._ipc_send(("reply", call_id, result))
+
+    def _query_child(self, kind: str):
+        waiter = Future()
+        with self._send_lock:
+            self._query_seq += 1
+            query_id = self._query_seq
+        self._queries[query_id] = waiter
+        if not self._ipc_send((kind, query_id)):
+            self._queries.pop(query_id, None)
+            return None
+        try:
+            return waiter.result(timeout=ISOLATED_QUERY_TIMEOUT)
+        except Exception:
+            self._queries.pop(query_id, None)
+            return None
+
+    def _stop_isolated(self):
+        remove_resolved_ip_listener(self._send_resolved_ip)
+        self._ipc_send(("stop",))
+        process, self._process = self._process, None
+        try:
+            process.join(timeout=3.0)
+            if process.is_alive():
+                process.terminate()
+        except Exception:
+            pass
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        done = getattr(self.addon, "done", None)
+        if done:
+            try:
+                self._loop.call_soon_threadsafe(done)
+            except RuntimeError:
+                pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
     # ------------------------------------------------------------------
     # Game launching
     # ------------------------------------------------------------------
@@ -1148,8 +2475,274 @@ class _CompatModeAddon:
             flow.request.scheme = "https"
 
 
-class _ResponseLogAddon:
-    """仅将非 200/404 的响应以 DEBUG 级别写入日志，不输出到控制台。"""
+class _LatencyHistogram:
+    """最近 N 个样本（毫秒）的有界窗口，用于计算 p50/p95/p99。"""
+
+    def __init__(self, maxlen: int = 512):
+        self._samples: deque[float] = deque(maxlen=maxlen)
+        self.count = 0
+
+    def add(self, ms: float):
+        self._samples.append(ms)
+        self.count += 1
+
+    @staticmethod
+    def _percentile(ordered: list[float], pct: float) -> float:
+        idx = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+        return ordered[idx]
+
+    def summary(self) -> dict:
+        ordered = sorted(self._samples)
+        if not ordered:
+            return {"count": self.count}
+        return {
+            "count": self.count,
+            "p50": round(self._percentile(ordered, 50), 2),
+            "p95": round(self._percentile(ordered, 95), 2),
+            "p99": round(self._percentile(ordered, 99), 2),
+            "max": round(ordered[-1], 2),
+        }
+
+
+class FlowMetrics:
+    """按路由统计 flow 耗时：上游延迟、addon 改写耗时、整体耗时。
+
+    路由名来自 ``IDVLoginAddon`` 写入 ``flow.metadata`` 的路由表结果，
+    因此数量有限，直方图总内存有上界。
+    """
+
+    KINDS = ("upstream", "rewrite", "total")
+
+    def __init__(self, window: int = 512):
+        self._window = window
+        self._lock = threading.Lock()
+        self._histograms: dict[str, dict[str, _LatencyHistogram]] = {}
+        self._counters: dict[str, int] = {}
+
+    def incr(self, name: str, n: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def counters(self) -> dict:
+        with self._lock:
+            return dict(self._counters)
+
+    def record(self, route: str, kind: str, ms: float):
+        with self._lock:
+            per_route = self._histograms.get(route)
+            if per_route is None:
+                per_route = self._histograms[route] = {}
+            hist = per_route.get(kind)
+            if hist is None:
+                hist = per_route[kind] = _LatencyHistogram(self._window)
+            hist.add(ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                route: {kind: hist.summary() for kind, hist in per_route.items()}
+                for route, per_route in self._histograms.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+flow_metrics = FlowMetrics()
+
+
+class _FlowTimingAddon:
+    """记录目标域名 flow 的耗时分布与上游连接数，并将非 200/404 的响应以 DEBUG 级别写入日志。
+
+    需排在 ``IDVLoginAddon`` 之后注册，这样 response 钩子执行时
+    addon 的改写耗时已经累计到 ``flow.metadata`` 中。
+    """
+
+    # 与 IDVLoginAddon 中的 metadata 键保持一致
+    _ROUTE_KEY = "idv_route"
+    _REWRITE_KEY = "idv_rewrite_seconds"
+
+    def __init__(self, target_domains):
+        self.target_domains = set(target_domains)
+
+    def _is_target(self, conn) -> bool:
+        address = getattr(conn, "address", None)
+        host = address[0] if address else None
+        return host in self.target_domains or getattr(conn, "sni", None) in self.target_domains
+
+    # 上游连接计数：与 upstream_flows 一样只统计目标域名，
+    # 两者对比即可得出每 N 个请求新建的连接/握手数
+    def server_connected(self, data):
+        if self._is_target(data.server):
+            flow_metrics.incr("upstream_connects")
+
+    def tls_established_server(self, data):
+        if not self._is_target(data.conn):
+            return
+        flow_metrics.incr("upstream_tls_handshakes")
+        if getattr(data.conn, "alpn", None) == b"h2":
+            flow_metrics.incr("upstream_h2")
 
     def response(self, flow):
-        pass
+        route_info = flow.metadata.get(self._ROUTE_KEY)
+        if route_info is None:
+            return  # 非目标域名
+        route = route_info[0]
+
+        req = flow.request
+        resp = flow.response
+        if resp.status_code not in (200, 404):
+            logger.debug(f"{req.method} {route_info[2]} -> {resp.status_code}")
+
+        rewrite = flow.metadata.get(self._REWRITE_KEY)
+        if rewrite is not None:
+            flow_metrics.record(route, "rewrite", rewrite * 1000)
+
+        # 本地处理的 /_idv-login/* 没有上游请求
+        if route != "idv_login":
+            flow_metrics.incr("upstream_flows")
+        if route != "idv_login" and req.timestamp_end and resp.timestamp_start:
+            flow_metrics.record(
+                route, "upstream", (resp.timestamp_start - req.timestamp_end) * 1000
+            )
+
+        end = resp.timestamp_end or resp.timestamp_start
+        if req.timestamp_start and end:
+            flow_metrics.record(route, "total", (end - req.timestamp_start) * 1000)
+
+
+# ==================================================================
+# Isolated mode (child side)
+# ==================================================================
+
+class _IpcBridgeAddon:
+    """代理子进程中的 addon：把目标域名 flow 的钩子转发到主进程的 IDVLoginAddon。
+
+    flow 通过 ``get_state()`` 序列化发送，主进程返回修改后的 request、
+    response 与 metadata，再写回本进程的 flow。非目标域名的流量完全在
+    子进程中处理，不经过 IPC。
+    """
+
+    def __init__(self, conn, target_domains):
+        self._conn = conn
+        self._send_lock = threading.Lock()
+        self.target_domains = set(target_domains)
+        self._pending: dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.manager: MitmProxyManager | None = None
+        self.forwarded = 0
+        self.failed = 0
+
+    def _send(self, msg):
+        with self._send_lock:
+            self._conn.send(msg)
+
+    def running(self):
+        self._loop = asyncio.get_running_loop()
+        threading.Thread(target=self._reader, name="mitmproxy-ipc", daemon=True).start()
+
+    def _reader(self):
+        while True:
+            try:
+                msg = self._conn.recv()
+            except (EOFError, OSError):
+                # 主进程已退出，子进程随之结束
+                logger.warning("主进程 IPC 连接已断开，代理子进程退出")
+                os._exit(0)
+            kind = msg[0]
+            if kind == "reply":
+                self._loop.call_soon_threadsafe(self._resolve, msg[1], msg[2])
+            elif kind == "dns":
+                _, domain, ip = msg
+                add_custom_dns(domain, 443, ip, ttl=math.inf)
+                resolved = dict(genv.get("COMPAT_RESOLVED_IPS") or {})
+                resolved[domain] = ip
+                genv.set("COMPAT_RESOLVED_IPS", resolved)
+            elif kind == "metrics":
+                self._send(("result", msg[1], self.manager.get_metrics()))
+            elif kind == "stop":
+                self.manager.stop()
+                return
+
+    def _resolve(self, call_id: int, result):
+        fut = self._pending.get(call_id)
+        if fut is not None and not fut.done():
+            fut.set_result(result)
+
+    async def _forward(self, hook: str, flow):
+        if flow.request.pretty_host not in self.target_domains:
+            return
+        from mitmproxy import http
+
+        self._next_id += 1
+        call_id = self._next_id
+        fut = self._loop.create_future()
+        self._pending[call_id] = fut
+        try:
+            self._send(("hook", call_id, hook, flow.get_state()))
+            result = await asyncio.wait_for(fut, ISOLATED_HOOK_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"主进程处理 {hook} 钩子超时")
+            self._fail(flow, 504)
+            return
+        except Exception as e:
+            logger.warning(f"转发 {hook} 钩子到主进程失败: {e}")
+            self._fail(flow, 502)
+            return
+        finally:
+            self._pending.pop(call_id, None)
+        if result is None:
+            self._fail(flow, 502)
+            return
+
+        self.forwarded += 1
+        request_state, response_state, metadata = result
+        flow.request.set_state(request_state)
+        if response_state is not None:
+            if flow.response is None:
+                flow.response = http.Response.from_state(response_state)
+            else:
+                flow.response.set_state(response_state)
+        flow.metadata.update(metadata)
+
+    def _fail(self, flow, status: int):
+        """钩子未能在主进程执行时直接应答错误，不能让未经处理的 flow
+        （尤其是本地的 /_idv-login/* 请求）被发往真实服务器。"""
+        from mitmproxy import http
+
+        self.failed += 1
+        flow.response = http.Response.make(
+            status, b"idv-login: addon unavailable", {"Content-Type": "text/plain"}
+        )
+
+    async def request(self, flow):
+        await self._forward("request", flow)
+
+    async def response(self, flow):
+        await self._forward("response", flow)
+
+    def get_stats(self) -> dict:
+        return {
+            "forwarded_hooks": self.forwarded,
+            "failed_hooks": self.failed,
+            "pending_hooks": len(self._pending),
+        }
+
+
+def _isolated_proxy_main(conn, port: int, mode: str, env: dict):
+    """代理子进程入口：恢复必要的 genv 配置后在主线程运行 mitmproxy。"""
+    for key, value in env.items():
+        genv.set(key, value)
+    # 兼容模式下子进程同样需要绕过被劫持的系统 DNS。条目不过期：
+    # 由主进程重新验证后经 IPC 推送，子进程不自行解析
+    for domain, ip in (env.get("COMPAT_RESOLVED_IPS") or {}).items():
+        add_custom_dns(domain, 443, ip, ttl=math.inf)
+
+    bridge = _IpcBridgeAddon(conn, MitmProxyManager._leaf_cert_domains())
+    manager = MitmProxyManager(addon=bridge, port=port, mode=mode, isolated=False)
+    bridge.manager = manager
+    manager._start_cert_rotation()
+    manager._run_proxy()
@@ -0,0 +1,46 @@
+# coding=UTF-8
+"""二维码登录状态缓存（WECHAT_QRCODE_CACHE / BILIBILI_QRCODE_CACHE）的变更通知。
+
+各渠道通过 :func:`update` 写入状态，写入时递增该缓存的版本号并唤醒等待方；
+管理页通过 ``/_idv-login/qrcode?version=..&wait=..`` 长轮询，在状态或图片
+变化时立即返回，而不是固定间隔轮询。
+"""
+
+import threading
+import time
+
+from envmgr import genv
+
+_cond = threading.Condition()
+_versions = {}  # {cache_key: int}
+
+
+def update(cache_key: str, entry_key: str, entry: dict) -> int:
+    """写入 ``genv[cache_key][entry_key]`` 并通知等待方，返回新的版本号。"""
+    with _cond:
+        cache = genv.get(cache_key, {})
+        if not isinstance(cache, dict):
+            cache = {}
+        cache[entry_key] = entry
+        genv.set(cache_key, cache)
+        version = _versions.get(cache_key, 0) + 1
+        _versions[cache_key] = version
+        _cond.notify_all()
+    return version
+
+
+def version(cache_key: str) -> int:
+    with _cond:
+        return _versions.get(cache_key, 0)
+
+
+def wait_for_change(cache_key: str, since: int, timeout: float) -> int:
+    """阻塞直到版本号不等于 ``since`` 或超时，返回当前版本号。"""
+    deadline = time.monotonic() + timeout
+    with _cond:
+        while _versions.get(cache_key, 0) == since:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            _cond.wait(remaining)
+        return _versions.get(cache_key, 0)
@@ -310,6 +310,7 @@ def _probe_proxy_mode(logger):
                 handle_exit()
             except Exception:
                 pass
+            genv.flush()
 
             if getattr(sys, 'frozen', False):
                 args = [sys.executable] + sys.argv[1:]
@@ -7,9 +7,20 @@ should use the helpers in this module so that they are readable
 only by the current user.
 
 Writes are atomic: data goes to a temporary file first, then
-``os.replace()`` swaps it into place.  A per-path file lock
-(``msvcrt`` on Windows, ``fcntl`` on Unix) prevents concurrent
-writers from corrupting each other.
+``os.replace()`` swaps it into place.  Writes to the same path go
+through a per-path coordinator: while one write is in flight, later
+writes to that path collapse into a single follow-up write of the
+newest data (group commit), so a burst of saves costs at most two
+writes.
+
+Each write has a durability class:
+
+* ``SECRET`` (default) -- fsync before the rename, and on Windows
+  restrict the ACL to Administrators + SYSTEM.  The ACL is applied
+  once, when the file is first created by this process; later writes
+  use ``ReplaceFileW`` which keeps the existing ACL.
+* ``CACHE`` -- re-fetchable data (CDN cache, resolved IPs, cloud
+  resources): no fsync and no ACL.
 """
 
 import json
@@ -18,24 +29,128 @@ import sys
 import tempfile
 import threading
 
-_write_locks = {}          # type: dict[str, threading.Lock]
+SECRET = "secret"
+CACHE = "cache"
+_DURABILITY_RANK = {CACHE: 0, SECRET: 1}
+
+_write_locks = {}          # type: dict[str, threading.RLock]
 _meta_lock = threading.Lock()
+_path_states = {}          # type: dict[str, _PathState]
+_acl_applied = set()       # type: set[str]  # paths whose restricted ACL is in place
 
 
-def _get_lock(filepath: str) -> threading.Lock:
-    key = os.path.normcase(os.path.abspath(filepath))
+def _path_key(filepath: str) -> str:
+    return os.path.normcase(os.path.abspath(filepath))
+
+
+def _get_lock(filepath: str) -> threading.RLock:
+    key = _path_key(filepath)
     with _meta_lock:
         if key not in _write_locks:
-            _write_locks[key] = threading.Lock()
+            _write_locks[key] = threading.RLock()
         return _write_locks[key]
 
 
-def _atomic_write(filepath: str, data: bytes, *, restrict_unix: bool = True):
+def path_lock(filepath: str) -> threading.RLock:
+    """Return the per-path lock taken by :func:`append_file_restricted`.
+
+    Hold it while renaming or removing an append-only file so that no
+    append from this process lands in between.
+    """
+    return _get_lock(filepath)
+
+
+class _PathState:
+    """Group-commit state for one path.
+
+    Every submitted write takes a ticket.  ``done`` is the highest ticket
+    whose batch has finished and ``ok`` the highest one covered by a
+    successful batch -- since the newest data wins, a later success also
+    satisfies earlier tickets.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending = None
+        self.durability = None
+        self.submitted = 0
+        self.done = 0
+        self.ok = 0
+        self.writing = False
+        self.error = None
+
+
+def _get_state(filepath: str) -> _PathState:
+    key = _path_key(filepath)
+    with _meta_lock:
+        state = _path_states.get(key)
+        if state is None:
+            state = _path_states[key] = _PathState()
+        return state
+
+
+def _submit(filepath: str, data: bytes, durability: str):
+    """Write *data* to *filepath*, coalescing with concurrent writes.
+
+    Blocks until *data* or newer data for the same path is on disk.
+    """
+    if durability not in _DURABILITY_RANK:
+        raise ValueError(f"unknown durability class: {durability!r}")
+    state = _get_state(filepath)
+    with state.cond:
+        state.submitted += 1
+        ticket = state.submitted
+        state.pending = data
+        if state.durability is None or _DURABILITY_RANK[durability] > _DURABILITY_RANK[state.durability]:
+            state.durability = durability
+        while True:
+            if state.done >= ticket:
+                if state.ok >= ticket:
+                    return
+                raise state.error
+            if not state.writing:
+                break
+            state.cond.wait()
+        # 成为本批次的写入者：取走目前最新的数据
+        state.writing = True
+        data, durability, batch = state.pending, state.durability, state.submitted
+        state.pending = state.durability = None
+
+    error = None
+    try:
+        _write_now(filepath, data, durability)
+    except Exception as exc:
+        error = exc
+    with state.cond:
+        state.writing = False
+        state.done = batch
+        if error is None:
+            state.ok = batch
+        else:
+            state.error = error
+        state.cond.notify_all()
+    if error is not None:
+        raise error
+
+
+def _write_now(filepath: str, data: bytes, durability: str):
+    try:
+        _atomic_write(filepath, data, durability=durability)
+    except Exception:
+        # Fallback: standard write (still better than losing data silently)
+        with open(filepath, "wb") as f:
+            f.write(data)
+
+
+def _atomic_write(filepath: str, data: bytes, *, restrict_unix: bool = True,
+                  durability: str = SECRET):
     """Write *data* atomically via temp-file + os.replace().
 
     On Unix the temp file is created with mode 0o600 when *restrict_unix*
-    is True.  On Windows, ACLs are applied after the rename.
+    is True.  ``SECRET`` writes are fsynced before the rename; on Windows
+    their ACL is applied once per path (see module docstring).
     """
+    secret = durability == SECRET
     dirpath = os.path.dirname(os.path.abspath(filepath)) or "."
     fd = None
     tmp_path = None
@@ -44,6 +159,8 @@ def _atomic_write(filepath: str, data: bytes, *, restrict_unix: bool = True):
             fd = tempfile.mkstemp(dir=dirpath, prefix=".tmp_", suffix=".json")
             tmp_path = fd[1]
             os.write(fd[0], data)
+            if secret:
+                os.fsync(fd[0])
             os.close(fd[0])
             fd = None
             os.chmod(tmp_path, 0o600)
@@ -54,14 +171,27 @@ def _atomic_write(filepath: str, data: bytes, *, restrict_unix: bool = True):
             ) as tmp:
                 tmp.write(data)
                 tmp.flush()
-                os.fsync(tmp.fileno())
+                if secret:
+                    os.fsync(tmp.fileno())
                 tmp_path = tmp.name
 
+        key = _path_key(filepath)
+        acl = _acl_enabled()
+        if acl and secret and key in _acl_applied \
+                and _win_replace_keep_acl(tmp_path, filepath):
+            tmp_path = None
+            return
+
         os.replace(tmp_path, filepath)
         tmp_path = None  # rename succeeded, nothing to clean up
 
-        if sys.platform == "win32":
-            _win_restrict_acl(filepath)
+        if acl:
+            # os.replace() 后文件带的是临时文件继承的 ACL
+            if secret:
+                _win_restrict_acl(filepath)
+                _acl_applied.add(key)
+            else:
+                _acl_applied.discard(key)
     finally:
         if fd is not None:
             try:
@@ -75,49 +205,184 @@ def _atomic_write(filepath: str, data: bytes, *, restrict_unix: bool = True):
                 pass
 
 
-def write_file_restricted(filepath: str, data: bytes):
+def write_file_restricted(filepath: str, data: bytes, durability: str = SECRET):
     """Write *data* (bytes) atomically and restrict permissions."""
-    lock = _get_lock(filepath)
-    lock.acquire(timeout=5)
-    try:
-        _atomic_write(filepath, data)
-    except Exception:
-        # Fallback: standard write (still better than losing data silently)
-        with open(filepath, "wb") as f:
-            f.write(data)
-    finally:
-        try:
-            lock.release()
-        except RuntimeError:
-            pass
+    _submit(filepath, data, durability)
 
 
-def write_json_restricted(filepath: str, obj):
+def write_json_restricted(filepath: str, obj, durability: str = SECRET):
     """Serialize *obj* as JSON and write atomically with restricted permissions."""
     text = json.dumps(obj, ensure_ascii=False)
-    data = text.encode("utf-8")
+    _submit(filepath, text.encode("utf-8"), durability)
+
+
+def append_file_restricted(filepath: str, data: bytes):
+    """Append *data* to *filepath*, creating it with restricted permissions.
+
+    Not atomic and not fsynced: meant for append-only journals whose reader
+    tolerates a torn final record.
+    """
     lock = _get_lock(filepath)
-    lock.acquire(timeout=5)
+    acquired = lock.acquire(timeout=5)
     try:
-        _atomic_write(filepath, data)
-    except Exception:
-        with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(obj, f, ensure_ascii=False)
-    finally:
+        created = not os.path.exists(filepath)
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0)
+        fd = os.open(filepath, flags, 0o600)
         try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        if created and _acl_enabled():
+            _win_restrict_acl(filepath)
+    finally:
+        if acquired:
             lock.release()
-        except RuntimeError:
-            pass
 
 
-def write_text_restricted(filepath: str, text: str, encoding: str = "utf-8"):
+def write_text_restricted(filepath: str, text: str, encoding: str = "utf-8",
+                          durability: str = SECRET):
     """Write text atomically with restricted permissions."""
     data = text.encode(encoding)
-    write_file_restricted(filepath, data)
+    write_file_restricted(filepath, data, durability)
 
 
-def _win_restrict_acl(filepath: str):
-    """Restrict ACL to Administrators + SYSTEM on Windows."""
+# Administrators + SYSTEM full control, protected (no inherited ACEs) --
+# the same DACL that ``icacls /reset`` + ``/inheritance:r /grant:r`` leaves.
+_RESTRICTED_SDDL = "D:P(A;;FA;;;BA)(A;;FA;;;SY)"
+
+
+class _Win32SecurityApi:
+    """Thin ctypes binding over the Win32 calls used by this module.
+
+    ``_win_api`` holds the instance in use; anything with the same methods
+    can be assigned there (e.g. a stub recording calls), which makes the
+    whole ACL path of the ``write_*_restricted`` helpers runnable on
+    non-Windows hosts (see tests/test_secure_write.py).
+    """
+
+    SE_FILE_OBJECT = 1
+    DACL_SECURITY_INFORMATION = 0x4
+    PROTECTED_DACL_SECURITY_INFORMATION = 0x80000000
+    SDDL_REVISION_1 = 1
+    REPLACEFILE_IGNORE_MERGE_ERRORS = 0x2
+
+    def __init__(self):
+        import ctypes
+        from ctypes import wintypes
+        self._ctypes = ctypes
+        advapi32 = ctypes.WinDLL("advapi32", use_last_error=True)
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+
+        self._sddl_to_sd = advapi32.ConvertStringSecurityDescriptorToSecurityDescriptorW
+        self._sddl_to_sd.argtypes = [wintypes.LPCWSTR, wintypes.DWORD,
+                                     ctypes.POINTER(wintypes.LPVOID),
+                                     ctypes.POINTER(wintypes.ULONG)]
+        self._sddl_to_sd.restype = wintypes.BOOL
+
+        self._get_sd_dacl = advapi32.GetSecurityDescriptorDacl
+        self._get_sd_dacl.argtypes = [wintypes.LPVOID, ctypes.POINTER(wintypes.BOOL),
+                                      ctypes.POINTER(wintypes.LPVOID),
+                                      ctypes.POINTER(wintypes.BOOL)]
+        self._get_sd_dacl.restype = wintypes.BOOL
+
+        self._set_named_security_info = advapi32.SetNamedSecurityInfoW
+        self._set_named_security_info.argtypes = [wintypes.LPWSTR, wintypes.DWORD,
+                                                  wintypes.DWORD, wintypes.LPVOID,
+                                                  wintypes.LPVOID, wintypes.LPVOID,
+                                                  wintypes.LPVOID]
+        self._set_named_security_info.restype = wintypes.DWORD
+
+        self._local_free = kernel32.LocalFree
+        self._local_free.argtypes = [wintypes.LPVOID]
+        self._local_free.restype = wintypes.LPVOID
+
+        self._replace_file = kernel32.ReplaceFileW
+        self._replace_file.argtypes = [wintypes.LPCWSTR, wintypes.LPCWSTR,
+                                       wintypes.LPCWSTR, wintypes.DWORD,
+                                       wintypes.LPVOID, wintypes.LPVOID]
+        self._replace_file.restype = wintypes.BOOL
+
+    def _last_error(self, func: str) -> OSError:
+        code = self._ctypes.get_last_error()
+        return OSError(code, f"{func} failed", None, code)
+
+    def sd_from_sddl(self, sddl: str):
+        from ctypes import wintypes
+        sd = wintypes.LPVOID()
+        if not self._sddl_to_sd(sddl, self.SDDL_REVISION_1, self._ctypes.byref(sd), None):
+            raise self._last_error("ConvertStringSecurityDescriptorToSecurityDescriptorW")
+        return sd
+
+    def get_dacl(self, sd):
+        from ctypes import wintypes
+        present = wintypes.BOOL()
+        defaulted = wintypes.BOOL()
+        dacl = wintypes.LPVOID()
+        if not self._get_sd_dacl(sd, self._ctypes.byref(present),
+                                 self._ctypes.byref(dacl), self._ctypes.byref(defaulted)):
+            raise self._last_error("GetSecurityDescriptorDacl")
+        if not present.value:
+            raise OSError("security descriptor has no DACL")
+        return dacl
+
+    def set_file_dacl(self, path: str, dacl):
+        info = self.DACL_SECURITY_INFORMATION | self.PROTECTED_DACL_SECURITY_INFORMATION
+        # SetNamedSecurityInfoW 直接返回错误码，而非设置 LastError
+        code = self._set_named_security_info(path, self.SE_FILE_OBJECT, info,
+                                             None, None, dacl, None)
+        if code:
+            raise OSError(code, "SetNamedSecurityInfoW failed", path, code)
+
+    def free(self, sd):
+        self._local_free(sd)
+
+    def replace_file(self, src: str, dst: str) -> bool:
+        return bool(self._replace_file(dst, src, None,
+                                       self.REPLACEFILE_IGNORE_MERGE_ERRORS, None, None))
+
+
+_win_api = None            # type: _Win32SecurityApi | None | bool  # False: unavailable
+
+
+def _get_win_api():
+    global _win_api
+    if _win_api is None:
+        try:
+            _win_api = _Win32SecurityApi()
+        except (ImportError, AttributeError, OSError):
+            _win_api = False
+    return _win_api or None
+
+
+def _acl_enabled() -> bool:
+    """Whether restricted writes should set an ACL.
+
+    True on Windows (native API, else the icacls fallback) and wherever an
+    api object has been installed in ``_win_api``.
+    """
+    return _get_win_api() is not None or sys.platform == "win32"
+
+
+def _win_replace_keep_acl(src: str, dst: str) -> bool:
+    """Replace *dst* with *src* via ``ReplaceFileW``, which keeps *dst*'s ACL.
+
+    Returns False (leaving *src* in place) if the call is unavailable or fails.
+    """
+    api = _get_win_api()
+    if api is None:
+        return False
+    return api.replace_file(src, dst)
+
+
+def _native_restrict_acl(filepath: str, api) -> None:
+    sd = api.sd_from_sddl(_RESTRICTED_SDDL)
+    try:
+        api.set_file_dacl(os.path.abspath(filepath), api.get_dacl(sd))
+    finally:
+        api.free(sd)
+
+
+def _icacls_restrict_acl(filepath: str):
     import subprocess
     subprocess.run(
         ["icacls", filepath, "/reset"],
@@ -129,3 +394,19 @@ def _win_restrict_acl(filepath: str):
          "/grant:r", "*S-1-5-18:(F)"],
         capture_output=True, timeout=10,
     )
+
+
+def _win_restrict_acl(filepath: str):
+    """Restrict ACL to Administrators + SYSTEM on Windows.
+
+    Uses the Win32 security API in-process; falls back to ``icacls`` when
+    ctypes/advapi32 is unavailable or the call fails.
+    """
+    api = _get_win_api()
+    if api is not None:
+        try:
+            _native_restrict_acl(filepath, api)
+            return
+        except OSError:
+            pass
+    _icacls_restrict_acl(filepath)
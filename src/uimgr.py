@@ -34,7 +34,7 @@ from PyQt6.QtWebEngineWidgets import QWebEngineView
 from PyQt6.QtWidgets import QMainWindow
 
 from logutil import setup_logger
-from secure_write import write_file_restricted
+from secure_write import CACHE, write_file_restricted
 
 logger = setup_logger()
 
@@ -105,8 +105,8 @@ def _save_cdn_to_disk(url: str, content_type: str, body: bytes):
     data_path = os.path.join(cache_dir, key + ".data")
     try:
         meta = json.dumps({"url": url, "content_type": content_type}).encode("utf-8")
-        write_file_restricted(meta_path, meta)
-        write_file_restricted(data_path, body)
+        write_file_restricted(meta_path, meta, CACHE)
+        write_file_restricted(data_path, body, CACHE)
     except Exception as exc:
         logger.debug(f"CDN 磁盘缓存写入失败: {url}: {exc}")
 
@@ -225,11 +225,30 @@ class IDVLoginSchemeHandler(QWebEngineUrlSchemeHandler):
         # Dispatch to shared handler
         from local_handler import LocalRequestHandler
 
-        handler = LocalRequestHandler(
-            game_helper=self.game_helper,
-            logger=self.ui_logger,
-        )
+        handler = LocalRequestHandler.get_instance()
+
+        if handler.is_long_poll(path, args):
+            # 长轮询在后台线程等待，完成后回到主线程回复，避免阻塞 UI
+            import app_state
+
+            def _wait_and_reply():
+                headers, body = self._dispatch_local(handler, path, method, args, json_body)
+
+                def _deliver():
+                    try:
+                        self._reply(job, headers, body)
+                    except RuntimeError:
+                        pass  # 页面已取消该请求，job 已被销毁
+
+                app_state.run_on_main_thread(_deliver)
+
+            threading.Thread(target=_wait_and_reply, name="idv-long-poll", daemon=True).start()
+            return
+
+        headers, body = self._dispatch_local(handler, path, method, args, json_body)
+        self._reply(job, headers, body)
 
+    def _dispatch_local(self, handler, path, method, args, json_body):
         try:
             _status, headers, body = handler.handle_simple(
                 path, method.upper(), args, json_body
@@ -238,7 +257,10 @@ class IDVLoginSchemeHandler(QWebEngineUrlSchemeHandler):
             self.ui_logger.exception(f"处理本地请求失败: {path}")
             body = json.dumps({"error": str(e)}).encode("utf-8")
             headers = {"Content-Type": "application/json"}
+        return headers, body
 
+    @staticmethod
+    def _reply(job: QWebEngineUrlRequestJob, headers: dict, body: bytes):
         content_type = headers.get("Content-Type", "application/octet-stream")
 
         buf = QBuffer(parent=job)
@@ -0,0 +1,138 @@
+# coding=UTF-8
+"""secure_write 的 ACL 路径测试：用桩对象替换 Win32 安全 API，在任意平台上运行。"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import secure_write  # noqa: E402
+
+
+class FakeSecurityApi:
+    """记录调用的 _Win32SecurityApi 替身。"""
+
+    def __init__(self, fail_set=False):
+        self.fail_set = fail_set
+        self.calls = []
+
+    def sd_from_sddl(self, sddl):
+        self.calls.append(("sd_from_sddl", sddl))
+        return ("sd", sddl)
+
+    def get_dacl(self, sd):
+        self.calls.append(("get_dacl", sd))
+        return ("dacl", sd)
+
+    def set_file_dacl(self, path, dacl):
+        self.calls.append(("set_file_dacl", path, dacl))
+        if self.fail_set:
+            raise OSError(5, "SetNamedSecurityInfoW failed", path, 5)
+
+    def free(self, sd):
+        self.calls.append(("free", sd))
+
+    def replace_file(self, src, dst):
+        self.calls.append(("replace_file", src, dst))
+        os.replace(src, dst)
+        return True
+
+    def names(self):
+        return [call[0] for call in self.calls]
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    api = FakeSecurityApi()
+    monkeypatch.setattr(secure_write, "_win_api", api)
+    monkeypatch.setattr(secure_write, "_acl_applied", set())
+    return api
+
+
+def test_restricted_write_sets_protected_dacl(fake_api, tmp_path):
+    path = str(tmp_path / "channels.json")
+    secure_write.write_json_restricted(path, {"a": 1})
+
+    sd = ("sd", "D:P(A;;FA;;;BA)(A;;FA;;;SY)")
+    assert fake_api.calls == [
+        ("sd_from_sddl", "D:P(A;;FA;;;BA)(A;;FA;;;SY)"),
+        ("get_dacl", sd),
+        ("set_file_dacl", os.path.abspath(path), ("dacl", sd)),
+        ("free", sd),
+    ]
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"a": 1}
+
+
+def test_acl_is_applied_once_per_path(fake_api, tmp_path):
+    path = str(tmp_path / "channels.json")
+    secure_write.write_json_restricted(path, {"a": 1})
+    fake_api.calls.clear()
+
+    secure_write.write_json_restricted(path, {"a": 2})
+
+    # 之后的写入经 ReplaceFileW 保留已有 ACL，不再设置 DACL
+    assert fake_api.names() == ["replace_file"]
+    assert fake_api.calls[0][2] == path
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"a": 2}
+
+
+def test_cache_writes_skip_acl(fake_api, tmp_path):
+    path = str(tmp_path / "cdn.data")
+    secure_write.write_file_restricted(path, b"body", secure_write.CACHE)
+    secure_write.write_file_restricted(path, b"body2", secure_write.CACHE)
+
+    assert fake_api.calls == []
+    with open(path, "rb") as f:
+        assert f.read() == b"body2"
+
+
+def test_append_sets_acl_only_on_create(fake_api, tmp_path):
+    path = str(tmp_path / "config.json.journal")
+    secure_write.append_file_restricted(path, b"one\n")
+    secure_write.append_file_restricted(path, b"two\n")
+
+    assert fake_api.names().count("set_file_dacl") == 1
+    with open(path, "rb") as f:
+        assert f.read() == b"one\ntwo\n"
+
+
+def test_native_failure_falls_back_to_icacls(monkeypatch, tmp_path):
+    api = FakeSecurityApi(fail_set=True)
+    monkeypatch.setattr(secure_write, "_win_api", api)
+    monkeypatch.setattr(secure_write, "_acl_applied", set())
+    fallback = []
+    monkeypatch.setattr(secure_write, "_icacls_restrict_acl", fallback.append)
+
+    path = str(tmp_path / "device.json")
+    secure_write.write_json_restricted(path, {"id": "x"})
+
+    assert fallback == [path]
+    # 失败时同样释放安全描述符
+    assert api.names()[-1] == "free"
+
+
+def test_append_does_not_release_a_lock_it_failed_to_take(fake_api, tmp_path, monkeypatch):
+    class BusyLock:
+        released = False
+
+        def acquire(self, timeout=-1):
+            return False
+
+        def release(self):
+            self.released = True
+
+    lock = BusyLock()
+    monkeypatch.setattr(secure_write, "_get_lock", lambda filepath: lock)
+    path = str(tmp_path / "config.json.journal")
+
+    # 拿不到锁时照常追加，但不能释放其他线程持有的锁
+    secure_write.append_file_restricted(path, b"x\n")
+
+    assert not lock.released
+    with open(path, "rb") as f:
+        assert f.read() == b"x\n"
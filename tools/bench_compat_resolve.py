@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+兼容模式启动时目标域名解析耗时基准
+
+复现 _setup_compat_mode 第 1 步（预解析目标域名的真实 IP）：
+没有 ResolvedIpCache 的旧版本每次并行执行 resolve_domain_ip（TLS 探测
+硬编码 IP、上游 DNS 竞速）；新版本先在空工作目录中解析并保存一次，
+随后的启动直接读取缓存。每轮都在新进程中运行，与实际冷启动一致。
+
+需要访问外网。--no-hardcoded 清空 HARDCODED_IPS，模拟硬编码 IP 失效、
+必须走上游 DNS 竞速的情况。
+
+用法:
+    python tools/bench_compat_resolve.py
+    python tools/bench_compat_resolve.py --src /path/to/other/checkout/src --rounds 10 --no-hardcoded
+
+--src 可指向旧版本的 src 目录，用于比较改动前后的结果。
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(SCRIPT_DIR)
+
+TARGET_DOMAINS = ["service.mkey.163.com", "sdk-os.mpsdk.easebar.com"]
+
+
+def _resolve_once(src, workdir, no_hardcoded):
+    """在当前进程中执行一次第 1 步，返回耗时（秒）。"""
+    sys.path.insert(0, src)
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    os.chdir(workdir)
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    import mitm_proxy
+    from envmgr import genv
+
+    genv.set("FP_WORKDIR", workdir)
+    if no_hardcoded:
+        mitm_proxy.HARDCODED_IPS.clear()
+
+    started = time.perf_counter()
+    resolved_ips = {}
+    ip_cache = None
+    if hasattr(mitm_proxy, "ResolvedIpCache"):
+        ip_cache = mitm_proxy.ResolvedIpCache()
+        for domain in TARGET_DOMAINS:
+            ip = ip_cache.get(domain)
+            if ip:
+                resolved_ips[domain] = ip
+                mitm_proxy.add_custom_dns(domain, 443, ip)
+
+    missing = [d for d in TARGET_DOMAINS if d not in resolved_ips]
+    if missing:
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            futures = {
+                executor.submit(mitm_proxy.resolve_domain_ip, domain, True): domain
+                for domain in missing
+            }
+            for future in as_completed(futures, timeout=15):
+                ip = future.result()
+                if ip:
+                    resolved_ips[futures[future]] = ip
+                    mitm_proxy.add_custom_dns(futures[future], 443, ip)
+                    if ip_cache is not None:
+                        ip_cache.put(futures[future], ip, None)
+    elapsed = time.perf_counter() - started
+
+    if ip_cache is not None:
+        ip_cache.save()
+    if not resolved_ips:
+        sys.exit("所有目标域名解析失败")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--src", default=os.path.join(REPO_ROOT, "src"))
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--no-hardcoded", action="store_true")
+    parser.add_argument("--once", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    src = os.path.abspath(args.src)
+
+    if args.once is not None:
+        print(f"{_resolve_once(src, args.once, args.no_hardcoded):.6f}")
+        return
+
+    workdir = tempfile.mkdtemp(prefix="bench_compat_resolve_")
+    cmd = [sys.executable, os.path.abspath(__file__), "--src", src, "--once", workdir]
+    if args.no_hardcoded:
+        cmd.append("--no-hardcoded")
+
+    # 第一次运行时缓存为空（新版本随后写入缓存），单独列出
+    timings = []
+    for _ in range(args.rounds + 1):
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            sys.exit(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "解析失败")
+        timings.append(float(proc.stdout.strip().splitlines()[-1]))
+
+    first, rest = timings[0], sorted(timings[1:])
+    print(f"src: {src}")
+    print(f"first start: {first * 1000:.1f} ms")
+    print(f"later starts: median {rest[len(rest) // 2] * 1000:.1f} ms, "
+          f"max {rest[-1] * 1000:.1f} ms ({len(rest)} runs)")
+
+
+if __name__ == "__main__":
+    main()
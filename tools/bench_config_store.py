@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+genv 配置读写基准
+
+在空工作目录中预先写入含若干键的 config.json，然后测量：
+  - genv.set(key, value, cached=True) 的单次耗时（含最后一次 genv.flush）
+  - genv.get 读取仅存在于 config.json 中的键（命中 / 不存在）的单次耗时
+旧版本每次 set 都完整读写一次文件、每次 get 都重新解析文件；新版本
+读写内存副本并在后台合并落盘。
+
+用法:
+    python tools/bench_config_store.py
+    python tools/bench_config_store.py --src /path/to/other/checkout/src --ops 1000
+
+--src 可指向旧版本的 src 目录，用于比较改动前后的结果。
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(SCRIPT_DIR)
+
+
+def _timed(func, keys):
+    started = time.perf_counter()
+    for key in keys:
+        func(key)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--src", default=os.path.join(REPO_ROOT, "src"))
+    parser.add_argument("--ops", type=int, default=1000)
+    parser.add_argument("--existing-keys", type=int, default=50)
+    args = parser.parse_args()
+    src = os.path.abspath(args.src)
+
+    workdir = tempfile.mkdtemp(prefix="bench_config_store_")
+    os.chdir(workdir)
+    # 典型的配置文件：若干已有键，值为短字符串
+    existing = {f"existing_{i}": f"value-{i}" * 4 for i in range(args.existing_keys)}
+    with open("config.json", "w", encoding="utf-8") as f:
+        json.dump(existing, f)
+
+    sys.path.insert(0, src)
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from envmgr import genv
+
+    flush = getattr(genv, "flush", lambda: None)
+    set_keys = [f"bench_set_{i % 20}" for i in range(args.ops)]
+    started = time.perf_counter()
+    for i, key in enumerate(set_keys):
+        genv.set(key, i, cached=True)
+    flush()
+    set_elapsed = time.perf_counter() - started
+
+    hit_keys = [f"existing_{i % args.existing_keys}" for i in range(args.ops)]
+    miss_keys = [f"missing_{i}" for i in range(args.ops)]
+    hit_elapsed = _timed(genv.get, hit_keys)
+    miss_elapsed = _timed(genv.get, miss_keys)
+
+    with open("config.json", "r", encoding="utf-8") as f:
+        on_disk = json.load(f)
+    if on_disk.get(set_keys[-1]) != args.ops - 1:
+        sys.exit("最后一次写入没有落盘")
+
+    print(f"src: {src}")
+    print(f"{args.ops} ops, config.json with {args.existing_keys} keys")
+    for name, elapsed in (("set(cached)", set_elapsed), ("get hit", hit_elapsed), ("get miss", miss_elapsed)):
+        print(f"{name:>12}: {elapsed / args.ops * 1e6:9.2f} us/op, total {elapsed * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
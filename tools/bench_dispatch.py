@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IDVLoginAddon 路由分发开销基准
+
+按一组 mpay 路径的调用比例构造 flow，依次执行 addon 的 request() 与
+response()。各路由的具体改写方法被替换为空操作，因此测得的是路由
+分发本身（以及全局 cv 注入）的每 flow 开销。
+
+用法:
+    python tools/bench_dispatch.py
+    python tools/bench_dispatch.py --src /path/to/other/checkout/src --flows 20000
+
+--src 可指向旧版本的 src 目录，用于比较改动前后的结果。
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(SCRIPT_DIR)
+
+# (路径, 方法, 权重)：大致对应一次扫码登录 + 启动游戏的请求构成
+PATH_MIX = [
+    ("/mpay/games/aecfrt3rmaaaaajl-g-g37/login_methods", "GET", 6),
+    ("/mpay/games/pc_config", "GET", 6),
+    ("/mpay/api/qrcode/create_login", "GET", 3),
+    ("/mpay/api/qrcode/query", "GET", 20),
+    ("/mpay/api/qrcode/image", "GET", 3),
+    ("/mpay/api/users/login/qrcode/exchange_token", "POST", 3),
+    ("/mpay/games/aecfrt3rmaaaaajl-g-g37/devices/abc/users", "POST", 4),
+    ("/mpay/games/aecfrt3rmaaaaajl-g-g37/devices/abc/users/123", "GET", 4),
+    ("/mpay/api/users/login/mobile/get_sms", "POST", 1),
+    ("/mpay/api/data/upload", "POST", 10),
+    ("/mpay/api/reverify/check", "GET", 2),
+    ("/mpay/config/common.json", "GET", 8),
+    ("/api/games/pc/config", "GET", 2),
+]
+
+
+def _load_addon(src):
+    sys.path.insert(0, src)
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    import mitm_addon
+
+    handler_names = [
+        name for name in dir(mitm_addon.IDVLoginAddon)
+        if (name.startswith("_modify_") or name.startswith("_handle_"))
+        and name != "_handle_idv_login_request"
+    ]
+
+    def _noop(self, *args, **kwargs):
+        return None
+
+    # 子类覆盖改写方法：新旧版本都通过 self 查找（或在 __init__ 中绑定）处理函数
+    bench_cls = type("BenchAddon", (mitm_addon.IDVLoginAddon,), {n: _noop for n in handler_names})
+
+    import logging
+    return bench_cls(
+        cv="a5.10.0",
+        login_style=1,
+        game_helper=None,
+        logger=logging.getLogger("bench"),
+    )
+
+
+def _make_flows(count, host, seed):
+    from mitmproxy.test import tflow
+    from mitmproxy import http
+
+    rng = random.Random(seed)
+    population = [(p, m) for p, m, w in PATH_MIX for _ in range(w)]
+    flows = []
+    for _ in range(count):
+        path, method = rng.choice(population)
+        flow = tflow.tflow(resp=True)
+        flow.request.host = host
+        flow.request.method = method
+        flow.request.path = path + "?game_id=aecfrt3rmaaaaajl-g-g37&cv=a1"
+        if method == "POST":
+            flow.request.headers["content-type"] = "application/x-www-form-urlencoded"
+            flow.request.content = b"game_id=aecfrt3rmaaaaajl-g-g37&arch=win_x64&cv=a1"
+        flow.response = http.Response.make(200, b"{}", {"content-type": "application/json"})
+        flows.append(flow)
+    return flows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--src", default=os.path.join(REPO_ROOT, "src"))
+    parser.add_argument("--flows", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    src = os.path.abspath(args.src)
+
+    # addon 初始化会读写工作目录中的 config.json 等文件
+    os.chdir(tempfile.mkdtemp(prefix="bench_dispatch_"))
+    addon = _load_addon(src)
+    host = next(iter(addon.target_domains))
+
+    best = None
+    for i in range(args.rounds):
+        flows = _make_flows(args.flows, host, seed=i)
+        started = time.perf_counter()
+        for flow in flows:
+            addon.request(flow)
+            addon.response(flow)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    per_flow_us = best / args.flows * 1e6
+    print(f"src: {src}")
+    print(f"flows: {args.flows} x {args.rounds} rounds (best)")
+    print(f"dispatch cost: {per_flow_us:.2f} us/flow")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DNS 拦截规则匹配开销基准
+
+用不同数量的拦截域名构造 LocalDnsServer（不启动监听），对一半命中、
+一半未命中的查询名测量单次匹配耗时。旧版本逐条比较后缀，新版本
+使用 DomainSuffixMatcher。
+
+用法:
+    python tools/bench_dns_matcher.py
+    python tools/bench_dns_matcher.py --src /path/to/other/checkout/src --rules 10 1000 100000
+
+--src 可指向旧版本的 src 目录，用于比较改动前后的结果。
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(SCRIPT_DIR)
+
+
+def _rule(i):
+    return f"svc{i}.zone{i % 97}.example.com"
+
+
+def _queries(rule_count, count, seed):
+    rng = random.Random(seed)
+    names = []
+    for _ in range(count):
+        i = rng.randrange(rule_count)
+        if rng.random() < 0.5:
+            names.append(f"api.{_rule(i)}")
+        else:
+            names.append(f"api.miss{i}.zone{i % 97}.example.net")
+    return names
+
+
+def _lookup_for(server):
+    matcher = getattr(server, "_matcher", None)
+    if matcher is not None:
+        return matcher.match
+    return server._should_intercept
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--src", default=os.path.join(REPO_ROOT, "src"))
+    parser.add_argument("--rules", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--queries", type=int, default=20000)
+    args = parser.parse_args()
+    src = os.path.abspath(args.src)
+
+    sys.path.insert(0, src)
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    os.chdir(tempfile.mkdtemp(prefix="bench_dns_matcher_"))
+    import mitm_proxy
+
+    print(f"src: {src}")
+    for rule_count in args.rules:
+        server = mitm_proxy.LocalDnsServer({_rule(i) for i in range(rule_count)}, listen_port=0)
+        lookup = _lookup_for(server)
+        names = _queries(rule_count, args.queries, seed=rule_count)
+        # 线性扫描在大规则数下很慢，按规则数缩减查询量
+        names = names[:max(200, args.queries * 100 // max(rule_count, 100))]
+
+        best = None
+        for _ in range(3):
+            started = time.perf_counter()
+            for name in names:
+                lookup(name)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{rule_count:>7} rules: {best / len(names) * 1e6:9.2f} us/lookup")
+
+
+if __name__ == "__main__":
+    main()
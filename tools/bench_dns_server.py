@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LocalDnsServer 负载基准（吞吐与尾延迟）
+
+在子进程中启动 --src 指定版本的 LocalDnsServer，主进程以固定并发数
+持续发送对拦截域名的 UDP A 查询（无需访问上游），统计每秒应答数与
+应答延迟的分位数。服务器独占一个进程，避免与压测端争用 GIL。
+
+用法:
+    python tools/bench_dns_server.py
+    python tools/bench_dns_server.py --src /path/to/other/checkout/src --concurrency 64 --seconds 10
+
+--src 可指向旧版本的 src 目录，用于比较改动前后的结果。
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(SCRIPT_DIR)
+
+DOMAIN = "service.mkey.163.com"
+
+
+def _serve(src, port):
+    sys.path.insert(0, src)
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    # 服务器初始化会读写工作目录中的配置文件
+    os.chdir(tempfile.mkdtemp(prefix="bench_dns_server_"))
+    import mitm_proxy
+
+    server = mitm_proxy.LocalDnsServer({DOMAIN}, listen_port=port)
+    if not server.start():
+        sys.exit(1)
+    print("ready", flush=True)
+    sys.stdin.read()
+    server.stop()
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _build_query(txid):
+    header = struct.pack("!HHHHHH", txid, 0x0100, 1, 0, 0, 0)
+    qname = b"".join(bytes([len(p)]) + p.encode() for p in DOMAIN.split(".")) + b"\x00"
+    return header + qname + struct.pack("!HH", 1, 1)
+
+
+class _Client(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.waiter = None
+
+    def datagram_received(self, data, addr):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(data)
+
+
+async def _worker(port, deadline, latencies, index):
+    loop = asyncio.get_running_loop()
+    transport, proto = await loop.create_datagram_endpoint(
+        _Client, remote_addr=("127.0.0.1", port)
+    )
+    txid = index
+    lost = 0
+    try:
+        while time.perf_counter() < deadline:
+            txid = (txid + 1) & 0xFFFF
+            proto.waiter = loop.create_future()
+            started = time.perf_counter()
+            transport.sendto(_build_query(txid))
+            try:
+                await asyncio.wait_for(proto.waiter, 1.0)
+            except asyncio.TimeoutError:
+                lost += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+    finally:
+        transport.close()
+    return lost
+
+
+async def _load(port, concurrency, seconds):
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    lost = await asyncio.gather(*[
+        _worker(port, deadline, latencies, i * 1000) for i in range(concurrency)
+    ])
+    return latencies, sum(lost)
+
+
+def _percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--src", default=os.path.join(REPO_ROOT, "src"))
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--serve", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    src = os.path.abspath(args.src)
+
+    if args.serve is not None:
+        _serve(src, args.serve)
+        return
+
+    port = _free_port()
+    child = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--src", src, "--serve", str(port)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        if child.stdout.readline().strip() != "ready":
+            sys.exit("DNS 服务器启动失败")
+        latencies, lost = asyncio.run(_load(port, args.concurrency, args.seconds))
+    finally:
+        child.stdin.close()
+        child.wait(timeout=10)
+
+    latencies.sort()
+    print(f"src: {src}")
+    print(f"concurrency: {args.concurrency}, {args.seconds:.0f}s, lost: {lost}")
+    print(f"throughput: {len(latencies) / args.seconds:,.0f} qps")
+    for pct in (50, 99, 99.9):
+        print(f"p{pct}: {_percentile(latencies, pct) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
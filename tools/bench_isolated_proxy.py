@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+隔离模式基准：UI 进程有 CPU 负载时代理请求的尾延迟
+
+在子进程（模拟 UI 进程）中启动 MitmProxyManager，并运行若干个纯 Python
+的哈希计算线程与代理争用 GIL；分别以进程内模式与隔离模式
+（isolated=True，mitmproxy 运行在再下一级子进程中）测量经代理访问替身
+HTTPS 服务器的单请求延迟。目标域名的请求仍会经过 UI 进程中的 addon。
+
+用法:
+    python tools/bench_isolated_proxy.py
+    python tools/bench_isolated_proxy.py --requests 1000 --load-threads 4
+    python tools/bench_isolated_proxy.py --src /path/to/other/checkout/src
+
+--src 可指向旧版本的 src 目录，用于比较改动前后的结果（需包含隔离模式）。
+"""
+
+import argparse
+import hashlib
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(SCRIPT_DIR)
+
+from bench_upstream_profiles import (  # noqa: E402
+    DOMAIN, _StandInServer, _free_port, _read_result, _self_signed_cert, _wait_port,
+)
+
+
+class _BenchAddon:
+    def request(self, flow):
+        if flow.request.pretty_host == DOMAIN:
+            # 与 IDVLoginAddon 一致，_FlowTimingAddon 只统计带路由信息的 flow
+            flow.metadata["idv_route"] = ("bench", None, flow.request.path)
+
+    def response(self, flow):
+        # 隔离模式会把 response 钩子也转发到 UI 进程
+        pass
+
+
+def _cpu_load(stop):
+    """模拟 UI 线程的 Python 计算：小块哈希不会释放 GIL。"""
+    data = b"x" * 64
+    while not stop.is_set():
+        for _ in range(1000):
+            data = hashlib.sha256(data).digest()
+
+
+def _run_app(src, workdir, isolated, proxy_port, load_threads):
+    """子进程：模拟 UI 进程，运行代理与 CPU 负载，stdin 关闭后退出。"""
+    sys.path.insert(0, src)
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    os.chdir(workdir)
+    import mitm_proxy
+    from envmgr import genv
+
+    genv.set("FP_WORKDIR", workdir)
+    genv.set("DOMAIN_TARGET", DOMAIN)
+    # 替身服务器使用自签名证书
+    genv.set("MITM_UPSTREAM_OPTIONS", {"ssl_insecure": True})
+
+    manager = mitm_proxy.MitmProxyManager(
+        addon=_BenchAddon(), port=proxy_port, mode="regular", isolated=isolated
+    )
+    manager.start()
+
+    stop = threading.Event()
+    for _ in range(load_threads):
+        threading.Thread(target=_cpu_load, args=(stop,), daemon=True).start()
+    print("BENCH ready", flush=True)
+    sys.stdin.read()
+    stop.set()
+    manager.stop()
+
+
+def _measure(proxy_port, upstream_port, count):
+    import requests
+    import urllib3
+
+    urllib3.disable_warnings()
+    proxies = {"https": f"http://127.0.0.1:{proxy_port}"}
+    # 直接连接替身服务器的 IP，Host 头决定是否为目标域名
+    url = f"https://127.0.0.1:{upstream_port}/mpay/api/qrcode/query"
+    headers = {"Host": DOMAIN}
+    latencies = []
+    with requests.Session() as session:
+        for i in range(count + 20):
+            started = time.perf_counter()
+            resp = session.get(url, headers=headers, proxies=proxies, verify=False, timeout=30)
+            if resp.status_code != 200:
+                sys.exit(f"代理返回 {resp.status_code}: {resp.text[:200]}")
+            if i >= 20:  # 前 20 个请求用于预热连接
+                latencies.append(time.perf_counter() - started)
+    return sorted(latencies)
+
+
+def _bench_mode(src, isolated, args, server):
+    proxy_port = _free_port()
+    workdir = tempfile.mkdtemp(prefix="bench_isolated_")
+    cmd = [sys.executable, os.path.abspath(__file__), "--src", src, "--run-app", workdir,
+           "--proxy-port", str(proxy_port), "--load-threads", str(args.load_threads)]
+    if isolated:
+        cmd.append("--isolated")
+    child = subprocess.Popen(
+        cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    try:
+        if _read_result(child) != "ready" or not _wait_port(proxy_port):
+            sys.exit("代理启动失败")
+        return _measure(proxy_port, server.port, args.requests)
+    finally:
+        child.stdin.close()
+        child.wait(timeout=15)
+
+
+def _pct(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--src", default=os.path.join(REPO_ROOT, "src"))
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--load-threads", type=int, default=2)
+    parser.add_argument("--run-app", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--proxy-port", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--isolated", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    src = os.path.abspath(args.src)
+
+    if args.run_app is not None:
+        _run_app(src, args.run_app, args.isolated, args.proxy_port, args.load_threads)
+        return
+
+    cert_path, key_path = _self_signed_cert(tempfile.mkdtemp(prefix="bench_isolated_cert_"))
+    server = _StandInServer(_free_port(), cert_path, key_path)
+    server.start()
+
+    print(f"src: {src}")
+    print(f"{args.requests} requests, {args.load_threads} CPU load threads in the UI process")
+    for isolated in (False, True):
+        latencies = _bench_mode(src, isolated, args, server)
+        name = "isolated" if isolated else "in-process"
+        print(f"{name:>10}: p50 {_pct(latencies, 50):6.2f} ms, p99 {_pct(latencies, 99):6.2f} ms, "
+              f"max {latencies[-1] * 1000:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
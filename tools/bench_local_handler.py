@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LocalRequestHandler 请求吞吐基准
+
+按 mitm addon 的调用方式获取 handler 并分发 /_idv-login/list 与
+/_idv-login/switch-status 请求：旧版本每个请求新建一个 handler，新版本
+复用启动时创建的共享实例。渠道列表由一个返回固定数据的对象提供，
+因此测得的主要是 handler 获取与路由分发的开销。
+
+用法:
+    python tools/bench_local_handler.py
+    python tools/bench_local_handler.py --src /path/to/other/checkout/src --requests 50000
+
+--src 可指向旧版本的 src 目录，用于比较改动前后的结果。
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(SCRIPT_DIR)
+
+
+class _FixedChannels:
+    """只读的渠道列表，代替 ChannelManager。"""
+
+    def __init__(self, count):
+        self._channels = [
+            {"uuid": f"uuid-{i}", "name": f"channel {i}", "game_id": "aecfrt3rmaaaaajl-g-g37"}
+            for i in range(count)
+        ]
+
+    def list_channels(self, game_id):
+        return self._channels
+
+
+class _Request:
+    method = "GET"
+    content = b""
+
+    def __init__(self, path):
+        self.path = path
+
+
+def _load_handler_factory(src, channels):
+    sys.path.insert(0, src)
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    import app_state
+    import local_handler
+
+    app_state.channels_helper = _FixedChannels(channels)
+    cls = local_handler.LocalRequestHandler
+    logger = logging.getLogger("bench")
+
+    # 与 addon 在各版本中的写法一致
+    if hasattr(cls, "create_instance"):
+        cls.create_instance(game_helper=None, logger=logger)
+        return cls, cls.get_instance
+    if hasattr(cls, "get_instance"):
+        return cls, lambda: cls.get_instance(game_helper=None, logger=logger)
+    return cls, lambda: cls(game_helper=None, logger=logger)
+
+
+def _pending_task(cls):
+    registry = cls._pending_switch
+    if hasattr(registry, "create"):
+        return registry.create()
+    registry["bench-task"] = {"status": "pending"}
+    return "bench-task"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--src", default=os.path.join(REPO_ROOT, "src"))
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--channels", type=int, default=20)
+    args = parser.parse_args()
+    src = os.path.abspath(args.src)
+
+    # handler 初始化会读写工作目录中的配置文件
+    os.chdir(tempfile.mkdtemp(prefix="bench_local_handler_"))
+    cls, get_handler = _load_handler_factory(src, args.channels)
+    task_id = _pending_task(cls)
+    requests = [
+        _Request("/_idv-login/list?game_id=aecfrt3rmaaaaajl-g-g37"),
+        _Request(f"/_idv-login/switch-status?task_id={task_id}"),
+    ]
+
+    print(f"src: {src}")
+    for req in requests:
+        best = None
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                status, _, _ = get_handler().handle(req)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        assert status == 200, status
+        name = req.path.split("?", 1)[0]
+        print(f"{name}: {args.requests / best:,.0f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+secure_write 写入吞吐基准（writes/sec）
+
+两部分：
+
+1. ACL 路径（需 --src 版本包含 _win_api）：对同一路径顺序执行 100 次
+   小 JSON 的 SECRET 写入，比较
+     - icacls：原生 API 不可用，每次写入都调用两次 icacls 子进程
+       （即改为进程内实现之前的行为）；
+     - native：通过桩 API（与 tests/test_secure_write.py 的 FakeSecurityApi
+       相同的接口）只在首次写入时设置 DACL，之后用 ReplaceFileW 保留 ACL。
+   非 Windows 上没有 icacls，PATH 中会放入一个立即退出的替身程序，因此
+   icacls 一行只包含子进程创建的开销，是真实成本的下限；桩 API 不含 Win32
+   调用本身的耗时（微秒级）。
+
+2. 同路径并发写入：若干线程同时向同一路径写入小 JSON，分别以 SECRET
+   （fsync）与 CACHE（不 fsync）耐久等级统计每秒完成的写入调用数，以及
+   实际落盘（os.replace）的次数。没有耐久等级的旧版本一律按 SECRET 写入。
+
+用法:
+    python tools/bench_secure_write.py
+    python tools/bench_secure_write.py --writes 100 --threads 8
+    python tools/bench_secure_write.py --src /path/to/other/checkout/src
+
+--src 可指向旧版本的 src 目录，用于比较改动前后的结果。
+"""
+
+import argparse
+import inspect
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(SCRIPT_DIR)
+
+
+class _StubSecurityApi:
+    """_Win32SecurityApi 的桩：不做任何权限设置，ReplaceFileW 用 os.replace 代替。"""
+
+    def __init__(self, native=True):
+        self.native = native
+
+    def sd_from_sddl(self, sddl):
+        return sddl
+
+    def get_dacl(self, sd):
+        return sd
+
+    def set_file_dacl(self, path, dacl):
+        if not self.native:
+            raise OSError(5, "SetNamedSecurityInfoW failed", path, 5)
+
+    def free(self, sd):
+        pass
+
+    def replace_file(self, src, dst):
+        if not self.native:
+            return False
+        os.replace(src, dst)
+        return True
+
+
+def _install_fake_icacls():
+    bindir = tempfile.mkdtemp(prefix="bench_icacls_")
+    path = os.path.join(bindir, "icacls")
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\nexit 0\n")
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    os.environ["PATH"] = bindir + os.pathsep + os.environ.get("PATH", "")
+
+
+def _bench_acl(secure_write, writes):
+    if not hasattr(secure_write, "_win_api"):
+        print("acl: skipped (no native ACL implementation in this tree)")
+        return
+    if sys.platform != "win32":
+        _install_fake_icacls()
+    print(f"acl: {writes} sequential SECRET writes to one path")
+    for name, native in (("icacls", False), ("native", True)):
+        secure_write._win_api = _StubSecurityApi(native)
+        secure_write._acl_applied.clear()
+        path = os.path.join(tempfile.mkdtemp(prefix="bench_acl_"), "records.json")
+        started = time.perf_counter()
+        for i in range(writes):
+            secure_write.write_json_restricted(path, {"seq": i, "token": "x" * 64})
+        elapsed = time.perf_counter() - started
+        print(f"  {name:>7}: {writes / elapsed:9.0f} writes/s ({elapsed / writes * 1000:.2f} ms/write)")
+    secure_write._win_api = None
+
+
+def _bench_group(secure_write, writes, threads):
+    has_durability = "durability" in inspect.signature(secure_write.write_json_restricted).parameters
+    replaces = [0]
+    real_replace = os.replace
+
+    def counting_replace(src, dst):
+        replaces[0] += 1
+        return real_replace(src, dst)
+
+    os.replace = counting_replace
+    print(f"group: {threads} threads x {writes} writes to one path")
+    try:
+        for durability in ("secret", "cache"):
+            if durability == "cache" and not has_durability:
+                print("  cache: skipped (no durability classes in this tree)")
+                continue
+            kwargs = {"durability": durability} if has_durability else {}
+            path = os.path.join(tempfile.mkdtemp(prefix="bench_group_"), "config.json")
+            replaces[0] = 0
+            barrier = threading.Barrier(threads + 1)
+
+            def writer(index):
+                barrier.wait()
+                for i in range(writes):
+                    secure_write.write_json_restricted(path, {"writer": index, "seq": i}, **kwargs)
+
+            workers = [threading.Thread(target=writer, args=(t,)) for t in range(threads)]
+            for worker in workers:
+                worker.start()
+            barrier.wait()
+            started = time.perf_counter()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+            total = threads * writes
+            print(f"  {durability:>6}: {total / elapsed:9.0f} writes/s, "
+                  f"{replaces[0]} renames for {total} calls")
+    finally:
+        os.replace = real_replace
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--src", default=os.path.join(REPO_ROOT, "src"))
+    parser.add_argument("--writes", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+    src = os.path.abspath(args.src)
+
+    sys.path.insert(0, src)
+    os.chdir(tempfile.mkdtemp(prefix="bench_secure_write_"))
+    import secure_write
+
+    print(f"src: {src}")
+    _bench_acl(secure_write, args.writes)
+    _bench_group(secure_write, args.writes, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上游连接策略基准：每 100 次登录流程的上游连接 / TLS 握手数
+
+在本进程中启动一个替身 HTTPS 服务器（自签名证书，HTTP/1.1 keep-alive），
+通过自定义 DNS 将目标域名指向它；在子进程中以指定的 MITM_UPSTREAM_PROFILE
+启动 MitmProxyManager（常规代理模式）。每次"登录流程"是一个新的客户端
+会话，经代理依次发送一组 mpay 请求。结束后输出替身服务器接受的 TLS
+握手数，以及 _FlowTimingAddon 的 upstream_* 计数。
+
+替身服务器只支持 HTTP/1.1，因此无法体现 HTTP/2 多路复用的收益。
+
+用法:
+    python tools/bench_upstream_profiles.py
+    python tools/bench_upstream_profiles.py --profiles default reuse --logins 100
+    python tools/bench_upstream_profiles.py --src /path/to/other/checkout/src
+
+--src 可指向旧版本的 src 目录，用于比较改动前后的结果。
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(SCRIPT_DIR)
+
+DOMAIN = "service.mkey.163.com"
+
+# 一次扫码登录大致的请求序列
+LOGIN_PATHS = [
+    ("GET", "/mpay/games/aecfrt3rmaaaaajl-g-g37/login_methods"),
+    ("GET", "/mpay/games/pc_config"),
+    ("GET", "/mpay/api/qrcode/create_login"),
+    ("GET", "/mpay/api/qrcode/query"),
+    ("GET", "/mpay/api/qrcode/query"),
+    ("GET", "/mpay/api/qrcode/query"),
+    ("POST", "/mpay/api/users/login/qrcode/exchange_token"),
+]
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _self_signed_cert(directory):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, DOMAIN)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(DOMAIN)]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, "standin-cert.pem")
+    key_path = os.path.join(directory, "standin-key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ))
+    return cert_path, key_path
+
+
+class _StandInServer:
+    """HTTP/1.1 keep-alive 的替身上游，统计 TLS 握手与请求数。"""
+
+    def __init__(self, port, cert_path, key_path):
+        self.port = port
+        self.handshakes = 0
+        self.requests = 0
+        self._ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        self._ctx.load_cert_chain(cert_path, key_path)
+        self._ctx.set_alpn_protocols(["http/1.1"])
+        self._ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=lambda: asyncio.run(self._main()), daemon=True).start()
+        self._ready.wait(5)
+
+    async def _main(self):
+        server = await asyncio.start_server(self._client, "127.0.0.1", self.port, ssl=self._ctx)
+        self._ready.set()
+        async with server:
+            await server.serve_forever()
+
+    async def _client(self, reader, writer):
+        self.handshakes += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n")[1:]:
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                if length:
+                    await reader.readexactly(length)
+                self.requests += 1
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: 2\r\nConnection: keep-alive\r\n\r\n{}"
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def _run_proxy(src, workdir, profile, proxy_port, upstream_port):
+    """子进程：以指定策略运行代理，stdin 关闭后输出计数。"""
+    sys.path.insert(0, src)
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    os.chdir(workdir)
+    import mitm_proxy
+    from envmgr import genv
+
+    genv.set("FP_WORKDIR", workdir)
+    genv.set("MITM_UPSTREAM_PROFILE", profile)
+    # 替身服务器使用自签名证书
+    genv.set("MITM_UPSTREAM_OPTIONS", {"ssl_insecure": True})
+    mitm_proxy.add_custom_dns(DOMAIN, upstream_port, "127.0.0.1")
+
+    class _BenchAddon:
+        def request(self, flow):
+            if flow.request.pretty_host == DOMAIN:
+                # 与 IDVLoginAddon 一致，_FlowTimingAddon 只统计带路由信息的 flow
+                flow.metadata["idv_route"] = ("bench", None, flow.request.path)
+
+    manager = mitm_proxy.MitmProxyManager(
+        addon=_BenchAddon(), port=proxy_port, mode="regular", isolated=False
+    )
+    manager.start()
+    # 日志同样输出到 stdout，结果行加前缀区分
+    print("BENCH ready", flush=True)
+    sys.stdin.read()
+    print("BENCH " + json.dumps(mitm_proxy.flow_metrics.counters()), flush=True)
+    manager.stop()
+
+
+def _read_result(child):
+    for line in child.stdout:
+        if line.startswith("BENCH "):
+            return line[len("BENCH "):].strip()
+    return None
+
+
+def _wait_port(port, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def _login_flows(proxy_port, upstream_port, logins):
+    import requests
+    import urllib3
+
+    urllib3.disable_warnings()
+    proxies = {"https": f"http://127.0.0.1:{proxy_port}"}
+    base = f"https://{DOMAIN}:{upstream_port}"
+    for _ in range(logins):
+        # 每次登录是一个新的 WebView 会话
+        with requests.Session() as session:
+            for method, path in LOGIN_PATHS:
+                resp = session.request(method, base + path, proxies=proxies, verify=False, timeout=10)
+                resp.raise_for_status()
+
+
+def _bench_profile(src, profile, logins, cert_path, key_path):
+    upstream_port = _free_port()
+    proxy_port = _free_port()
+    server = _StandInServer(upstream_port, cert_path, key_path)
+    server.start()
+
+    workdir = tempfile.mkdtemp(prefix="bench_upstream_")
+    child = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--src", src, "--run-proxy", workdir,
+         "--profile-name", profile, "--proxy-port", str(proxy_port),
+         "--upstream-port", str(upstream_port)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    try:
+        if _read_result(child) != "ready" or not _wait_port(proxy_port):
+            sys.exit(f"代理启动失败 ({profile})")
+        started = time.perf_counter()
+        _login_flows(proxy_port, upstream_port, logins)
+        elapsed = time.perf_counter() - started
+        child.stdin.close()
+        counters = json.loads(_read_result(child) or "{}")
+    finally:
+        if not child.stdin.closed:
+            child.stdin.close()
+        child.wait(timeout=10)
+    return server, counters, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--src", default=os.path.join(REPO_ROOT, "src"))
+    parser.add_argument("--profiles", nargs="+", default=["default", "reuse", "http1"])
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--run-proxy", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--profile-name", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--proxy-port", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--upstream-port", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    src = os.path.abspath(args.src)
+
+    if args.run_proxy is not None:
+        _run_proxy(src, args.run_proxy, args.profile_name, args.proxy_port, args.upstream_port)
+        return
+
+    cert_path, key_path = _self_signed_cert(tempfile.mkdtemp(prefix="bench_upstream_cert_"))
+    print(f"src: {src}")
+    print(f"{args.logins} logins x {len(LOGIN_PATHS)} requests")
+    for profile in args.profiles:
+        server, counters, elapsed = _bench_profile(src, profile, args.logins, cert_path, key_path)
+        per100 = 100.0 / args.logins
+        print(
+            f"{profile:>8}: {server.handshakes * per100:6.1f} upstream TLS handshakes / 100 logins "
+            f"(proxy counted connects={counters.get('upstream_connects', 0)}, "
+            f"handshakes={counters.get('upstream_tls_handshakes', 0)}, "
+            f"flows={counters.get('upstream_flows', 0)}), {elapsed:.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()